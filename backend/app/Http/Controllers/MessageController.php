@@ -10,6 +10,8 @@
 use App\Models\Sender;
 use App\Models\Message;
 use App\Models\MessageEntity;
+use App\Models\MessageReply;
+use App\Models\ImportBatch;
 
 use function PHPSTORM_META\map;
 
@@ -35,9 +37,25 @@ public function import(Request $request)
             $payload = [$payload];
         }
 
+        // A batch that was already applied (e.g. re-sent after a timeout) is not redone
+        $key = $request->header('Idempotency-Key');
+        if ($key) {
+            $batch = ImportBatch::where('idempotency_key', $key)->first();
+            if ($batch) {
+                return response()->json([
+                    'status'    => 'ok',
+                    'created'   => $batch->created,
+                    'updated'   => $batch->updated,
+                    'skipped'   => $batch->skipped,
+                    'duplicate' => true,
+                ]);
+            }
+        }
+
         $created = 0;
         $updated = 0;
         $skipped = 0;
+        $failed = 0;
 
         foreach ($payload as $item) {
             if (empty($item['channel']['telegram_id']) || empty($item['message']['telegram_id'])) {
@@ -48,31 +66,38 @@ public function import(Request $request)
             DB::beginTransaction();
             try {
                 // --- Upsert channel ---
+                $channelData = [
+                    'title'         => $item['channel']['title'] ?? null,
+                    'username'      => $item['channel']['username'] ?? null,
+                    'is_private'    => $item['channel']['is_private'] ?? false,
+                    'is_adults'    => (bool)($item['channel']['is_adults'] ?? false),
+                    'type'          => $item['channel']['type'] ?? 'channel',
+                    'description'   => $item['channel']['description'] ?? null,
+                    'members_count' => $item['channel']['members_count'] ?? null,
+                ];
+                // Photos are downloaded in the background; keep the last known one
+                if (!empty($item['channel']['photo_url'])) {
+                    $channelData['photo_url'] = $item['channel']['photo_url'];
+                }
                 $channel = Channel::updateOrCreate(
                     ['telegram_id' => $item['channel']['telegram_id']],
-                    [
-                        'title'         => $item['channel']['title'] ?? null,
-                        'username'      => $item['channel']['username'] ?? null,
-                        'is_private'    => $item['channel']['is_private'] ?? false,
-                        'is_adults'    => (bool)($item['channel']['is_adults'] ?? false),
-                        'type'          => $item['channel']['type'] ?? 'channel',
-                        'description'   => $item['channel']['description'] ?? null,
-                        'members_count' => $item['channel']['members_count'] ?? null,
-                        'photo_url'     => $item['channel']['photo_url'] ?? null,
-                    ]
+                    $channelData
                 );
 
                 // --- Upsert sender ---
                 $sender = null;
                 if (!empty($item['sender']['telegram_id'])) {
+                    $senderData = [
+                        'username'     => $item['sender']['username'] ?? null,
+                        'display_name' => $item['sender']['display_name'] ?? null,
+                        'is_bot'       => $item['sender']['is_bot'] ?? false,
+                    ];
+                    if (!empty($item['sender']['photo_url'])) {
+                        $senderData['photo_url'] = $item['sender']['photo_url'];
+                    }
                     $sender = Sender::updateOrCreate(
                         ['telegram_id' => $item['sender']['telegram_id']],
-                        [
-                            'username'     => $item['sender']['username'] ?? null,
-                            'display_name' => $item['sender']['display_name'] ?? null,
-                            'is_bot'       => $item['sender']['is_bot'] ?? false,
-                            'photo_url'    => $item['sender']['photo_url'] ?? null,
-                        ]
+                        $senderData
                     );
                 }
 
@@ -120,16 +145,236 @@ public function import(Request $request)
                 }
             } catch (\Throwable $e) {
                 DB::rollBack();
-                $skipped++;
+                $failed++;
                 \Log::error('Message import error: ' . $e->getMessage(), ['item' => $item]);
             }
         }
 
+        // Only a fully applied batch is recorded; after a partial failure a retry
+        // with the same key must run again instead of getting the cached answer
+        if ($key && $failed === 0) {
+            ImportBatch::query()->insertOrIgnore([
+                'idempotency_key' => $key,
+                'created'         => $created,
+                'updated'         => $updated,
+                'skipped'         => $skipped,
+                'created_at'      => now(),
+                'updated_at'      => now(),
+            ]);
+        }
+
         return response()->json([
             'status'   => 'ok',
             'created'  => $created,
             'updated'  => $updated,
             'skipped'  => $skipped,
+            'failed'   => $failed,
+        ]);
+    }
+
+    /**
+     * Which of the given idempotency keys were applied
+     * (POST /api/messages/import/acks)
+     */
+    public function acks(Request $request)
+    {
+        $token = $request->bearerToken();
+        if (!$token || $token !== env('IMPORT_TOKEN')) {
+            return response()->json(['error' => 'Unauthorized'], 401);
+        }
+
+        $keys = array_values(array_filter((array) $request->input('keys', []), 'is_string'));
+        if (empty($keys)) {
+            return response()->json(['error' => 'Empty payload'], 400);
+        }
+
+        return response()->json([
+            'status'       => 'ok',
+            'acknowledged' => ImportBatch::whereIn('idempotency_key', $keys)->pluck('idempotency_key'),
+        ]);
+    }
+
+    /**
+     * Apply counter/edit deltas from the crawler's refresh mode
+     * (POST /api/messages/counters)
+     */
+    public function counters(Request $request)
+    {
+        $token = $request->bearerToken();
+        if (!$token || $token !== env('IMPORT_TOKEN')) {
+            return response()->json(['error' => 'Unauthorized'], 401);
+        }
+
+        $channelTelegramId = $request->input('channel.telegram_id');
+        $deltas = $request->input('messages', []);
+        if (empty($channelTelegramId) || !is_array($deltas)) {
+            return response()->json(['error' => 'Empty payload'], 400);
+        }
+
+        $channel = Channel::where('telegram_id', $channelTelegramId)->first();
+        if (!$channel) {
+            return response()->json(['status' => 'ok', 'updated' => 0, 'skipped' => count($deltas)]);
+        }
+
+        $updated = 0;
+        $skipped = 0;
+
+        foreach ($deltas as $delta) {
+            if (empty($delta['telegram_id'])) {
+                $skipped++;
+                continue;
+            }
+
+            $message = Message::where('channel_id', $channel->id)
+                ->where('telegram_id', $delta['telegram_id'])
+                ->first();
+            if (!$message) {
+                $skipped++;
+                continue;
+            }
+
+            DB::beginTransaction();
+            try {
+                // Only the fields present in the delta are touched
+                $message->fill(array_intersect_key(
+                    $delta,
+                    array_flip(['views', 'forwards', 'replies_count', 'content_text'])
+                ));
+                $message->save();
+
+                if (array_key_exists('entities', $delta)) {
+                    MessageEntity::where('message_id', $message->id)->delete();
+                    foreach ($delta['entities'] ?? [] as $ent) {
+                        if (empty($ent['entity_type']) || empty($ent['entity_value'])) continue;
+                        MessageEntity::create([
+                            'message_id'   => $message->id,
+                            'entity_type'  => $ent['entity_type'],
+                            'entity_value' => $ent['entity_value'],
+                        ]);
+                    }
+                }
+
+                DB::commit();
+                $updated++;
+            } catch (\Throwable $e) {
+                DB::rollBack();
+                $skipped++;
+                \Log::error('Message counters error: ' . $e->getMessage(), ['delta' => $delta]);
+            }
+        }
+
+        return response()->json([
+            'status'  => 'ok',
+            'updated' => $updated,
+            'skipped' => $skipped,
+        ]);
+    }
+
+    /**
+     * Delete messages the crawler found deleted on Telegram
+     * (POST /api/messages/tombstones)
+     */
+    public function tombstones(Request $request)
+    {
+        $token = $request->bearerToken();
+        if (!$token || $token !== env('IMPORT_TOKEN')) {
+            return response()->json(['error' => 'Unauthorized'], 401);
+        }
+
+        $channelTelegramId = $request->input('channel.telegram_id');
+        $ids = array_values(array_filter((array) $request->input('ids', []), 'is_numeric'));
+        if (empty($channelTelegramId) || empty($ids)) {
+            return response()->json(['error' => 'Empty payload'], 400);
+        }
+
+        $channel = Channel::where('telegram_id', $channelTelegramId)->first();
+        if (!$channel) {
+            return response()->json(['status' => 'ok', 'deleted' => 0]);
+        }
+
+        // Entities and replies cascade on delete
+        $deleted = Message::where('channel_id', $channel->id)
+            ->whereIn('telegram_id', $ids)
+            ->delete();
+
+        return response()->json([
+            'status'  => 'ok',
+            'deleted' => $deleted,
+        ]);
+    }
+
+    /**
+     * Store reply edges of one chat in bulk
+     * (POST /api/messages/replies)
+     */
+    public function replies(Request $request)
+    {
+        $token = $request->bearerToken();
+        if (!$token || $token !== env('IMPORT_TOKEN')) {
+            return response()->json(['error' => 'Unauthorized'], 401);
+        }
+
+        $channelTelegramId = $request->input('channel.telegram_id');
+        $edges = $request->input('edges', []);
+        if (empty($channelTelegramId) || !is_array($edges) || empty($edges)) {
+            return response()->json(['error' => 'Empty payload'], 400);
+        }
+
+        $channel = Channel::where('telegram_id', $channelTelegramId)->first();
+        if (!$channel) {
+            return response()->json(['status' => 'ok', 'created' => 0, 'skipped' => count($edges)]);
+        }
+
+        // Resolve every telegram id to a row id with one query per chat
+        $wanted = [$channel->telegram_id => []];
+        foreach ($edges as $edge) {
+            if (empty($edge['telegram_id']) || empty($edge['reply_to_id'])) continue;
+            $wanted[$channel->telegram_id][] = $edge['telegram_id'];
+            $wanted[$edge['reply_to_channel_id'] ?? $channel->telegram_id][] = $edge['reply_to_id'];
+        }
+
+        $rowIds = [];
+        $channels = Channel::whereIn('telegram_id', array_keys($wanted))->pluck('id', 'telegram_id');
+        foreach ($wanted as $chatTelegramId => $telegramIds) {
+            if (!isset($channels[$chatTelegramId])) continue;
+            $rowIds[$chatTelegramId] = Message::where('channel_id', $channels[$chatTelegramId])
+                ->whereIn('telegram_id', array_unique($telegramIds))
+                ->pluck('id', 'telegram_id');
+        }
+
+        $rows = [];
+        $now = now();
+        foreach ($edges as $edge) {
+            $parentChat = $edge['reply_to_channel_id'] ?? $channel->telegram_id;
+            $messageId = $rowIds[$channel->telegram_id][$edge['telegram_id'] ?? null] ?? null;
+            $replyToId = $rowIds[$parentChat][$edge['reply_to_id'] ?? null] ?? null;
+            if ($messageId && $replyToId) {
+                $rows[$messageId] = [
+                    'message_id'  => $messageId,
+                    'reply_to_id' => $replyToId,
+                    'created_at'  => $now,
+                    'updated_at'  => $now,
+                ];
+            }
+        }
+
+        // A message replies to exactly one parent; existing edges are kept
+        $existing = MessageReply::whereIn('message_id', array_keys($rows))->pluck('message_id')->all();
+        $rows = array_values(array_diff_key($rows, array_flip($existing)));
+
+        try {
+            foreach (array_chunk($rows, 500) as $chunk) {
+                MessageReply::insert($chunk);
+            }
+        } catch (\Throwable $e) {
+            \Log::error('Message replies error: ' . $e->getMessage(), ['channel' => $channelTelegramId]);
+            return response()->json(['error' => 'Insert failed'], 500);
+        }
+
+        return response()->json([
+            'status'  => 'ok',
+            'created' => count($rows),
+            'skipped' => count($edges) - count($rows),
         ]);
     }
 
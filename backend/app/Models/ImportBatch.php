@@ -0,0 +1,10 @@
+<?php
+
+namespace App\Models;
+
+use Illuminate\Database\Eloquent\Model;
+
+class ImportBatch extends Model
+{
+    protected $fillable = ['idempotency_key', 'created', 'updated', 'skipped'];
+}
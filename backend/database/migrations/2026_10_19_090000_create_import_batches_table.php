@@ -0,0 +1,31 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        Schema::create('import_batches', function (Blueprint $table) {
+            $table->id();
+            $table->string('idempotency_key')->unique();
+            $table->unsignedInteger('created')->default(0);
+            $table->unsignedInteger('updated')->default(0);
+            $table->unsignedInteger('skipped')->default(0);
+            $table->timestamps();
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('import_batches');
+    }
+};
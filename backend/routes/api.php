@@ -6,6 +6,10 @@
 
 
 Route::post('/messages/import', [MessageController::class, 'import']);
+Route::post('/messages/import/acks', [MessageController::class, 'acks']);
+Route::post('/messages/counters', [MessageController::class, 'counters']);
+Route::post('/messages/tombstones', [MessageController::class, 'tombstones']);
+Route::post('/messages/replies', [MessageController::class, 'replies']);
 Route::get('/messages', [MessageController::class, 'index']);
 
 
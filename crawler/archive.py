@@ -0,0 +1,120 @@
+"""Local archive of import batches, shared by main.py, replay.py and bulkload.py.
+
+Kept free of main's import-time setup (logging handlers, client pool), so the
+standalone tools can read the archive without it.
+"""
+import fcntl
+import gzip
+import itertools
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+# Partitioned by channel id and posting date. An empty CRAWLER_ARCHIVE_DIR disables it.
+ARCHIVE_DIR = os.environ.get("CRAWLER_ARCHIVE_DIR", "archive")
+ARCHIVE_COMPACT_MIN_SEGMENTS = 8  # Segments in an open partition before it is compacted
+
+class MessageArchive:
+    """Append-only local copy of everything sent to the import API.
+
+    Payloads are stored as gzip JSONL in <root>/<channel id>/<posted date>/.
+    Every write adds a new immutable segment; compaction merges the files of a
+    partition into one part, keeping the newest copy of each message. File
+    names start with a nanosecond timestamp, so name order is write order.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.seq = itertools.count(1)  # Writes may come from several threads
+
+    def write(self, payloads: List[Dict[str, Any]]):
+        partitions: Dict[tuple, List[Dict[str, Any]]] = {}
+        for p in payloads:
+            day = (p["message"].get("posted_at") or "unknown")[:10]
+            partitions.setdefault((p["channel"]["telegram_id"], day), []).append(p)
+
+        for (channel_id, day), items in partitions.items():
+            folder = os.path.join(self.root, str(channel_id), day)
+            os.makedirs(folder, exist_ok=True)
+            name = f"{time.time_ns():020d}-seg-{os.getpid()}-{next(self.seq)}.jsonl.gz"
+            self._write_file(folder, name, (json.dumps(p, ensure_ascii=False, separators=(",", ":")) for p in items))
+
+    @staticmethod
+    def _write_file(folder: str, name: str, lines):
+        tmp = os.path.join(folder, "." + name)
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line + "\n")
+        os.replace(tmp, os.path.join(folder, name))
+
+    @staticmethod
+    def files(folder: str) -> List[str]:
+        return sorted(n for n in os.listdir(folder) if n.endswith(".jsonl.gz") and not n.startswith("."))
+
+    def partitions(self):
+        """(channel id, date, folder) of every partition"""
+        if not os.path.isdir(self.root):
+            return
+        for channel_id in sorted(os.listdir(self.root)):
+            channel_dir = os.path.join(self.root, channel_id)
+            if os.path.isdir(channel_dir):
+                for day in sorted(os.listdir(channel_dir)):
+                    yield channel_id, day, os.path.join(channel_dir, day)
+
+    def read_partition(self, folder: str) -> List[Dict[str, Any]]:
+        """Newest copy of every message in a partition, by message id"""
+        latest: Dict[int, Dict[str, Any]] = {}
+        lock_fd = os.open(os.path.join(folder, ".lock"), os.O_CREAT | os.O_RDWR)
+        try:
+            # Compaction holds the lock exclusively, so the listed files stay in place while they are read
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            for name in self.files(folder):
+                with gzip.open(os.path.join(folder, name), "rt", encoding="utf-8") as f:
+                    for line in f:
+                        p = json.loads(line)
+                        latest[p["message"]["telegram_id"]] = p
+        finally:
+            os.close(lock_fd)
+        return [latest[i] for i in sorted(latest)]
+
+    def compact(self, folder: str, force: bool = False) -> int:
+        """Merge the files of one partition. Returns the number of files merged."""
+        lock_fd = os.open(os.path.join(folder, ".lock"), os.O_CREAT | os.O_RDWR)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # Another process is compacting or reading it
+
+            names = self.files(folder)
+            if len(names) < 2 or (len(names) < ARCHIVE_COMPACT_MIN_SEGMENTS and not force):
+                return 0
+
+            latest: Dict[int, str] = {}
+            for name in names:
+                with gzip.open(os.path.join(folder, name), "rt", encoding="utf-8") as f:
+                    for line in f:
+                        latest[json.loads(line)["message"]["telegram_id"]] = line.rstrip("\n")
+
+            # Same timestamp as the newest input, so later segments still sort after it
+            part = names[-1].split("-", 1)[0] + "-part.jsonl.gz"
+            self._write_file(folder, part, (latest[i] for i in sorted(latest)))
+            for name in names:
+                if name != part:
+                    os.remove(os.path.join(folder, name))
+            return len(names)
+        finally:
+            os.close(lock_fd)
+
+    def compact_all(self) -> Dict[str, int]:
+        """One compaction pass. Partitions of past days are merged down to a single file."""
+        report = {"partitions": 0, "files": 0}
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        for _, day, folder in self.partitions():
+            merged = self.compact(folder, force=day < today)
+            if merged:
+                report["partitions"] += 1
+                report["files"] += merged
+        return report
@@ -0,0 +1,248 @@
+"""Offline crawler throughput against a fake Telegram client and a fake import server.
+
+Run from the crawler directory:
+
+    python -m bench.crawl [--channels 40] [--messages 1000] [--latency 0.05] [--flood-rate 0]
+                          [--concurrency 3] [--rate 0] [--delays] [--save FILE] [--baseline FILE]
+    python -m bench.crawl --fixtures DIR [--speed 1]
+
+Two scenarios run on the same synthetic channels (see bench.fakes):
+fetch_channel_messages called on each channel in turn, and run_account over
+all of them. A first crawl takes the newest BATCH_SIZE posts of a channel,
+so volume comes from --channels. With --fixtures, both scenarios run on
+the channels recorded with main.py --record instead (see recording.py),
+replayed with their original timing divided by --speed (0: no delays).
+
+Each scenario reports messages/s, Telegram RPCs per message, upload
+requests and bytes, and peak RSS. The crawler's jitter sleeps are skipped unless
+--delays is given, so the numbers measure the code and the simulated RPC
+latency. State files and the archive go to a temporary directory.
+
+--save writes the results as JSON; --baseline compares against such a file
+and exits with status 1 when a metric regressed by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import types
+from typing import Any, Dict
+
+import main
+from bench.fakes import FakeImportServer, FakeTelegramClient, SyntheticChannel, point_crawler_at
+from recording import ReplayClient
+
+SESSION = "bench"
+WORKDIR = tempfile.gettempdir()  # Set to a fresh directory by main_bench
+
+# Metric -> True when higher is better
+REGRESSION_METRICS = {"msgs_per_s": True, "rpcs_per_msg": False, "upload_bytes_per_msg": False, "peak_rss_mb": False}
+
+class PeakRss:
+    """Samples the process RSS in a background thread while the block runs"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    @staticmethod
+    def current() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Lifetime peak where /proc is missing
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+def skip_crawler_sleeps():
+    """Make main's asyncio.sleep return immediately; the fakes keep their real latency"""
+    fast = types.ModuleType("asyncio")
+    fast.__dict__.update(asyncio.__dict__)
+    real_sleep = asyncio.sleep
+
+    async def no_sleep(delay, result=None):
+        return await real_sleep(0, result)
+
+    fast.sleep = no_sleep
+    main.asyncio = fast
+
+def report(name: str, fetched: int, elapsed: float, client, server: FakeImportServer,
+           rss: PeakRss, before: Dict[str, int]) -> Dict[str, Any]:
+    rpcs = sum(client.rpcs.values())
+    upload_bytes = server.metrics["bytes"] - before["bytes"]
+    return {
+        "scenario": name,
+        "messages": fetched,
+        "seconds": round(elapsed, 3),
+        "msgs_per_s": round(fetched / elapsed, 1) if elapsed else 0.0,
+        "rpcs": rpcs,
+        "rpcs_per_msg": round(rpcs / fetched, 4) if fetched else 0.0,
+        "rpcs_by_type": dict(client.rpcs),
+        "floods": getattr(client, "floods", 0),
+        "upload_requests": server.metrics["requests"] - before["requests"],
+        "upload_bytes": upload_bytes,
+        "upload_bytes_per_msg": round(upload_bytes / fetched, 1) if fetched else 0.0,
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+    }
+
+def scenario_dir(name: str):
+    """Give each scenario its own state files, so run_account does not resume the previous crawl"""
+    path = os.path.join(WORKDIR, name)
+    os.makedirs(path)
+    os.chdir(path)
+
+async def bench_fetch_channels(client, usernames, args, server: FakeImportServer) -> Dict[str, Any]:
+    scenario_dir("fetch_channel_messages")
+    main.pace_client(client, main.RpcLimiter(args.rate, main.ACCOUNT_RPC_BURST))
+    media = main.MediaStage(client, SESSION)
+    discovery = main.DiscoveryCollector()
+    last_ids, counters, ledger = {}, {}, {}
+    before = server.metrics.copy()
+    fetched = 0
+    with PeakRss() as rss:
+        started = time.perf_counter()
+        for username in usernames:
+            result = await main.fetch_channel_messages(client, SESSION, {"username": username}, last_ids,
+                                                       counters, ledger, None, media, discovery)
+            if result.get("status") != "ok":
+                logging.warning(f"fetch_channel_messages returned {result} for {username}")
+            fetched += result.get("fetched", 0)
+        elapsed = time.perf_counter() - started
+    await media.close()
+    return report("fetch_channel_messages", fetched, elapsed, client, server, rss, before)
+
+async def bench_run_account(client, usernames, args, server: FakeImportServer) -> Dict[str, Any]:
+    scenario_dir("run_account")
+    main.save_json(main.CHANNELS_TEMPLATE.format(SESSION), [{"username": u} for u in usernames])
+    main.client_pool = main.ClientPool(lambda account: client)
+    main.client_pool.limiters[SESSION] = main.RpcLimiter(args.rate, main.ACCOUNT_RPC_BURST)
+    main.stats["public"].update(channels=0, messages=0, created=0, updated=0)
+    before = server.metrics.copy()
+    try:
+        with PeakRss() as rss:
+            started = time.perf_counter()
+            result = await main.run_account({"session": SESSION})
+            elapsed = time.perf_counter() - started
+    finally:
+        await main.client_pool.close()
+    counts = result.get("counts") or {}
+    if result.get("failed_count") or not counts:
+        logging.warning(f"run_account returned {result}")
+    return report("run_account", counts.get("messages", 0), elapsed, client, server, rss, before)
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> list:
+    """Human-readable regressions of `results` against `baseline`"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in REGRESSION_METRICS.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name}.{metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+async def run(args) -> Dict[str, Dict[str, Any]]:
+    server = FakeImportServer(latency=args.api_latency)
+    point_crawler_at(server.start())
+    try:
+        if args.fixtures:
+            usernames = ReplayClient(args.fixtures).usernames()
+            single = await bench_fetch_channels(ReplayClient(args.fixtures, args.speed), usernames, args, server)
+            account = await bench_run_account(ReplayClient(args.fixtures, args.speed), usernames, args, server)
+        else:
+            channels = [SyntheticChannel(1000 + i, f"bench_channel_{i}", args.messages, seed=args.seed)
+                        for i in range(args.channels)]
+            client = FakeTelegramClient(channels, latency=args.latency, flood_rate=args.flood_rate)
+            single = await bench_fetch_channels(client, [c.username for c in channels], args, server)
+            # Same content under other ids, so the fake server counts it as new
+            channels = [SyntheticChannel(c.channel_id + args.channels, f"bench_account_{i}", args.messages,
+                                         seed=args.seed) for i, c in enumerate(channels)]
+            client = FakeTelegramClient(channels, latency=args.latency, flood_rate=args.flood_rate)
+            account = await bench_run_account(client, [c.username for c in channels], args, server)
+        return {r["scenario"]: r for r in (single, account)}
+    finally:
+        server.stop()
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=1000, help="message ids per channel")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Telegram RPC")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds per import API request")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability of a FloodWait per RPC")
+    parser.add_argument("--concurrency", type=int, default=main.CHANNEL_CONCURRENCY, help="channels at once")
+    parser.add_argument("--rate", type=float, default=0.0, help="account RPC rate limit (0: unlimited)")
+    parser.add_argument("--delays", action="store_true", help="keep the crawler's jitter sleeps")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fixtures", metavar="DIR", help="replay channels recorded with main.py --record")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up of recorded timing (0: none)")
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="fail on regressions against saved results")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        args.fixtures = os.path.abspath(args.fixtures)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    save = os.path.abspath(args.save) if args.save else None
+
+    logging.getLogger().setLevel(logging.WARNING)
+    main.MAX_MESSAGES_PER_CHANNEL = max(main.MAX_MESSAGES_PER_CHANNEL, args.messages)
+    main.CHANNEL_CONCURRENCY = args.concurrency
+    if not args.delays:
+        skip_crawler_sleeps()
+
+    global WORKDIR
+    with tempfile.TemporaryDirectory(prefix="crawler-bench-") as WORKDIR:
+        os.chdir(WORKDIR)
+        results = asyncio.run(run(args))
+        os.chdir(WORKDIR)
+
+    for r in results.values():
+        print(f"{r['scenario']:24} {r['messages']:7} msgs  {r['msgs_per_s']:9.1f} msg/s  "
+              f"{r['rpcs_per_msg']:.3f} rpc/msg  {r['upload_requests']:5} uploads  "
+              f"{r['upload_bytes_per_msg']:7.0f} B/msg  peak RSS {r['peak_rss_mb']} MiB"
+              + (f"  floods {r['floods']}" if r["floods"] else ""))
+
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,372 @@
+"""Fakes for offline crawler benchmarks: synthetic channels, a Telegram client and an import server.
+
+SyntheticChannel builds Telethon messages on demand, deterministic per seed,
+with a realistic mix of text lengths, scripts, entities and media.
+FakeTelegramClient serves them through get_entity / iter_messages /
+get_messages, spending one RPC per Telegram request (100 messages per page)
+with configurable latency and FloodWait injection. FakeImportServer answers
+the import API endpoints like the backend and counts what it receives.
+FakeUpdateSource stands in for TelethonUpdateSource in live mode; new posts
+and edits are pushed into it by hand.
+"""
+import asyncio
+import json
+import math
+import random
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.tl import types
+
+import main
+
+# ---------------------------
+# Synthetic channels
+# ---------------------------
+# Weights loosely follow the public channels the crawler sees
+SCRIPTS = [("latin", 0.45), ("cyrillic", 0.30), ("arabic", 0.10), ("cjk", 0.10), ("emoji", 0.05)]
+MEDIA_MIX = [("text", 0.40), ("photo", 0.35), ("video", 0.15), ("document", 0.06), ("audio", 0.04)]
+TEXT_MEDIAN_CHARS = 180  # Lognormal text length, capped at Telegram's 4096
+TEXT_SIGMA = 1.0
+CAPTIONLESS_MEDIA = 0.15  # Share of media posts without any text
+ENTITY_SHARE = 0.04  # Share of words that are a hashtag, mention or url
+REPLY_SHARE = 0.03  # Posts replying to an earlier post of the channel
+GAP_SHARE = 0.02  # Ids that were deleted
+
+RANGES = {"latin": (0x61, 0x7A), "cyrillic": (0x430, 0x44F), "arabic": (0x627, 0x64A), "cjk": (0x4E00, 0x9FFF)}
+EMOJI = (0x1F600, 0x1F64F)
+TAGS = ["news", "sale", "crypto", "music", "video", "sport", "tech", "daily", "promo", "chat"]
+
+def pick(rnd: random.Random, weighted: List[tuple]) -> str:
+    x = rnd.random()
+    for name, weight in weighted:
+        x -= weight
+        if x < 0:
+            return name
+    return weighted[-1][0]
+
+def synthetic_text(rnd: random.Random, length: int) -> tuple:
+    """(text, entities) of about `length` characters in one script, with hashtags, mentions and urls"""
+    script = pick(rnd, SCRIPTS)
+    parts, entities, size = [], [], 0
+    while size < length:
+        if rnd.random() < ENTITY_SHARE:
+            kind = rnd.choice((types.MessageEntityHashtag, types.MessageEntityMention, types.MessageEntityUrl))
+            tag = rnd.choice(TAGS)
+            word = {types.MessageEntityHashtag: "#" + tag, types.MessageEntityMention: f"@{tag}_channel",
+                    types.MessageEntityUrl: f"https://t.me/{tag}_{rnd.randint(1, 999)}"}[kind]
+            entities.append(kind(offset=size, length=len(word)))
+        elif script == "emoji" or rnd.random() < 0.02:
+            word = "".join(chr(rnd.randint(*EMOJI)) for _ in range(rnd.randint(1, 3)))
+        else:
+            lo, hi = RANGES[script]
+            word = "".join(chr(rnd.randint(lo, hi)) for _ in range(rnd.randint(2, 9 if script != "cjk" else 20)))
+        parts.append(word)
+        size += len(word) + 1
+    return " ".join(parts), entities
+
+def synthetic_media(rnd: random.Random, kind: str, msg_id: int, date: datetime):
+    if kind == "photo":
+        return types.MessageMediaPhoto(photo=types.Photo(id=msg_id, access_hash=0, file_reference=b"", date=date,
+                                                         sizes=[], dc_id=2))
+    mime, attributes = {
+        "video": ("video/mp4", [types.DocumentAttributeVideo(duration=rnd.randint(5, 600), w=1280, h=720)]),
+        "document": ("application/pdf", [types.DocumentAttributeFilename(file_name=f"file{msg_id}.pdf")]),
+        "audio": ("audio/mpeg", [types.DocumentAttributeAudio(duration=rnd.randint(30, 400))]),
+    }[kind]
+    return types.MessageMediaDocument(document=types.Document(
+        id=msg_id, access_hash=0, file_reference=b"", date=date, mime_type=mime,
+        size=rnd.randint(10 ** 4, 10 ** 8), dc_id=2, attributes=attributes))
+
+class SyntheticChannel:
+    """A public broadcast channel with `size` message ids; messages are built when requested"""
+
+    def __init__(self, channel_id: int, username: str, size: int, seed: int = 1):
+        self.channel_id = channel_id
+        self.username = username
+        self.size = size
+        self.seed = seed
+        self.start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.entity = types.Channel(id=channel_id, title=f"Bench {username}", photo=types.ChatPhotoEmpty(),
+                                    date=self.start, username=username, broadcast=True, access_hash=channel_id)
+
+    def message(self, msg_id: int) -> Optional[types.Message]:
+        """The message with this id, or None if it does not exist (deleted or not posted yet)"""
+        if not 1 <= msg_id <= self.size:
+            return None
+        rnd = random.Random(self.seed * 1_000_003 + self.channel_id * 10_007 + msg_id)
+        if rnd.random() < GAP_SHARE:
+            return None
+
+        date = self.start + timedelta(minutes=7 * msg_id)
+        kind = pick(rnd, MEDIA_MIX)
+        length = 0
+        if kind == "text" or rnd.random() >= CAPTIONLESS_MEDIA:
+            length = min(4096, max(10, int(rnd.lognormvariate(math.log(TEXT_MEDIAN_CHARS), TEXT_SIGMA))))
+        text, entities = synthetic_text(rnd, length) if length else ("", [])
+        reply_to = None
+        if msg_id > 1 and rnd.random() < REPLY_SHARE:
+            reply_to = types.MessageReplyHeader(reply_to_msg_id=rnd.randint(max(1, msg_id - 500), msg_id - 1))
+
+        msg = types.Message(
+            id=msg_id, peer_id=types.PeerChannel(self.channel_id), date=date, message=text,
+            entities=entities or None, media=None if kind == "text" else synthetic_media(rnd, kind, msg_id, date),
+            views=int(rnd.paretovariate(1.2) * 100), forwards=rnd.randint(0, 50), reply_to=reply_to,
+            replies=types.MessageReplies(replies=rnd.randint(0, 20), replies_pts=msg_id), post=True,
+        )
+        msg._text = text  # What the client's parse mode sets on received messages
+        msg._chat = self.entity
+        return msg
+
+# ---------------------------
+# Fake Telegram client
+# ---------------------------
+class FakeTelegramClient:
+    """The subset of TelegramClient the crawler uses, served from synthetic channels.
+
+    Every Telegram request goes through `_call`, like Telethon's, so
+    ClientPool's rate limiter paces it; `rpcs` counts them by request name.
+    """
+
+    PAGE_SIZE = 100  # Messages per GetHistory / GetMessages request
+
+    def __init__(self, channels: List[SyntheticChannel], latency: float = 0.0, flood_rate: float = 0.0,
+                 flood_seconds: int = 30, seed: int = 1):
+        self.channels = {c.username.lower(): c for c in channels}
+        self.by_id = {c.channel_id: c for c in channels}
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.rnd = random.Random(seed)
+        self.rpcs: Counter = Counter()
+        self.floods = 0
+        self.connected = False
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        self.rpcs[request] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and self.rnd.random() < self.flood_rate:
+            self.floods += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        return await self._call(None, request, ordered=ordered)
+
+    def _channel(self, entity) -> SyntheticChannel:
+        if isinstance(entity, str):
+            return self.channels[entity.lstrip("@").lower()]
+        return self.by_id[getattr(entity, "channel_id", None) or entity.id]
+
+    async def get_entity(self, username):
+        await self("ResolveUsername")
+        try:
+            return self._channel(username).entity
+        except KeyError:
+            raise ValueError(f'No user has "{username}" as username')
+
+    async def iter_messages(self, entity, limit: Optional[int] = None, min_id: int = 0, max_id: int = 0,
+                            reply_to: Optional[int] = None, **kwargs):
+        channel = self._channel(entity)
+        if reply_to is not None:
+            await self("GetReplies")
+            return
+        msg_id = (max_id or channel.size + 1) - 1
+        sent = 0
+        while msg_id > min_id and (limit is None or sent < limit):
+            await self("GetHistory")
+            page = 0
+            while msg_id > min_id and page < self.PAGE_SIZE and (limit is None or sent < limit):
+                msg = channel.message(msg_id)
+                msg_id -= 1
+                if msg is not None:
+                    page += 1
+                    sent += 1
+                    yield msg
+
+    async def get_messages(self, entity, ids=None, limit: Optional[int] = None, **kwargs):
+        channel = self._channel(entity)
+        if ids is None:
+            await self("GetHistory")
+            newest = next((m for m in map(channel.message, range(channel.size, 0, -1)) if m), None)
+            return [newest] if newest else []
+        if isinstance(ids, int):
+            await self("GetMessages")
+            return channel.message(ids)
+        ids = list(ids)
+        for _ in range(0, len(ids), self.PAGE_SIZE):
+            await self("GetMessages")
+        return [channel.message(i) for i in ids]
+
+    async def iter_dialogs(self):
+        """Every channel as a joined dialog"""
+        await self("GetDialogs")
+        for channel in self.channels.values():
+            yield SimpleNamespace(entity=channel.entity, is_channel=True)
+
+    async def download_profile_photo(self, peer, file=None, download_big=False):
+        await self("GetFile")
+        return b""
+
+    async def start(self):
+        self.connected = True
+
+    async def connect(self):
+        self.connected = True
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def get_me(self):
+        await self("GetUsers")
+        return types.User(id=1, is_self=True)
+
+    async def disconnect(self):
+        self.connected = False
+
+# ---------------------------
+# Fake import server
+# ---------------------------
+class FakeImportServer:
+    """Local stand-in for the Laravel import API, with optional latency and 503s"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 1, keep_content: bool = False):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.keep_content = keep_content
+        self.content: Dict[tuple, Optional[str]] = {}  # (channel id, message id) -> last content_text, with keep_content
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.metrics = Counter()
+        self.messages: set = set()
+        self.keys: Dict[str, Dict[str, int]] = {}
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api"
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # Headers and body are separate writes; keep-alive would stall on them
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                status, body, headers = fake.handle(self.path, self.headers, raw)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handle(self, path: str, headers, raw: bytes) -> tuple:
+        if self.latency:
+            threading.Event().wait(self.latency)
+        with self.lock:
+            self.metrics["requests"] += 1
+            self.metrics["bytes"] += len(raw)
+            if self.error_rate and self.rnd.random() < self.error_rate:
+                self.metrics["errors"] += 1
+                return 503, {"error": "Service unavailable"}, {"Retry-After": "1"}
+
+            body = json.loads(raw) if raw else None
+            if path.endswith("/messages/import/acks"):
+                return 200, {"status": "ok", "acknowledged": [k for k in body.get("keys", []) if k in self.keys]}, {}
+            if path.endswith("/messages/import"):
+                return 200, self.import_batch(body if isinstance(body, list) else [body], headers.get("Idempotency-Key")), {}
+            if path.endswith("/messages/counters"):
+                return 200, {"status": "ok", "updated": len(body.get("messages", [])), "skipped": 0}, {}
+            if path.endswith("/messages/tombstones"):
+                return 200, {"status": "ok", "deleted": len(body.get("ids", []))}, {}
+            if path.endswith("/messages/replies"):
+                return 200, {"status": "ok", "created": len(body.get("edges", []))}, {}
+            return 404, {"error": "Not found"}, {}
+
+    def import_batch(self, payloads: List[Dict[str, Any]], key: Optional[str]) -> Dict[str, Any]:
+        if key and key in self.keys:
+            return {"status": "ok", **self.keys[key], "duplicate": True}
+        counts = {"created": 0, "updated": 0, "skipped": 0}
+        for p in payloads:
+            ident = (p.get("channel", {}).get("telegram_id"), p.get("message", {}).get("telegram_id"))
+            if not all(ident):
+                counts["skipped"] += 1
+                continue
+            counts["updated" if ident in self.messages else "created"] += 1
+            self.messages.add(ident)
+            if self.keep_content:
+                self.content[ident] = p["message"].get("content_text")
+        self.metrics["payloads"] += len(payloads)
+        if key:
+            self.keys[key] = counts
+        return {"status": "ok", **counts}
+
+# ---------------------------
+# Fake live updates
+# ---------------------------
+class FakeUpdateSource:
+    """TelethonUpdateSource stand-in: post() and edit() queue the events an
+    update handler would, for channels of a FakeTelegramClient"""
+
+    def __init__(self, client: FakeTelegramClient, chats: List[Any]):
+        self.client = client
+        self.chats = chats
+        self.queue: Optional[asyncio.Queue] = None
+
+    async def start(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    async def stop(self):
+        self.queue = None
+
+    def post(self, channel: SyntheticChannel, count: int = 1, deliver: bool = True) -> List[int]:
+        """Publish `count` new messages; without `deliver` they are missed, as while disconnected"""
+        ids = list(range(channel.size + 1, channel.size + count + 1))
+        channel.size += count
+        if deliver:
+            for msg_id in ids:
+                msg = channel.message(msg_id)
+                if msg is not None:
+                    self.queue.put_nowait(("new", utils.get_peer_id(channel.entity), msg))
+        return ids
+
+    def edit(self, channel: SyntheticChannel, msg_id: int, text: str):
+        msg = channel.message(msg_id)
+        msg.message = msg._text = text
+        msg.edit_date = msg.date + timedelta(hours=1)
+        self.queue.put_nowait(("edit", utils.get_peer_id(channel.entity), msg))
+
+def point_crawler_at(base: str):
+    """Send the crawler's uploads to `base` (e.g. FakeImportServer.url) instead of the backend"""
+    main.LARAVEL_API = f"{base}/messages/import"
+    main.LARAVEL_ACKS_API = f"{base}/messages/import/acks"
+    main.LARAVEL_COUNTERS_API = f"{base}/messages/counters"
+    main.LARAVEL_TOMBSTONES_API = f"{base}/messages/tombstones"
+    main.LARAVEL_REPLIES_API = f"{base}/messages/replies"
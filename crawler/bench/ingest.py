@@ -0,0 +1,191 @@
+"""Import throughput: the ingest service against the controller's per-row writes.
+
+Run from the crawler directory against a scratch database with the backend
+migrations applied (both runs write to it):
+
+    python -m bench.ingest --dsn postgresql://... [--payloads 20000] [--batch 50] [--workers 4]
+
+"Per-row" replays MessageController::import's query pattern straight over
+psycopg: one transaction per payload, a select plus insert/update per
+channel, sender and message, then delete+insert of the entities. It skips
+HTTP and PHP entirely, so it is an upper bound for the controller. "Service"
+posts the same batches over HTTP to an in-process IngestService. Each mode
+runs once on an empty database (inserts) and once more (unchanged rows).
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import psycopg
+import requests
+
+from bulkload import DEFAULT_DSN
+from ingest import IMPORT_TOKEN, IngestService
+
+BENCH_TOKEN = IMPORT_TOKEN or "bench"  # Any value works against the in-process service
+WORDS = ["sale", "new", "video", "today", "channel", "join", "free", "link", "photo", "update", "best", "watch"]
+
+def synthetic_payloads(n: int, channels: int = 50, seed: int = 1) -> list:
+    """Import payloads spread over a few channels and senders, most with entities"""
+    rnd = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    payloads = []
+    for i in range(1, n + 1):
+        ch = rnd.randint(1, channels)
+        sender = rnd.randint(1, channels * 20)
+        entities = [{"entity_type": "hashtag", "entity_value": "#" + rnd.choice(WORDS)},
+                    {"entity_type": "mention", "entity_value": "@" + rnd.choice(WORDS)}][:rnd.randint(0, 2)]
+        payloads.append({
+            "channel": {"telegram_id": 1000 + ch, "title": f"Channel {ch}", "username": f"chan{ch}",
+                        "type": "channel", "is_private": False, "is_adults": False,
+                        "description": None, "members_count": 100 * ch, "photo_url": ""},
+            "sender": {"telegram_id": 50000 + sender, "username": f"user{sender}",
+                       "display_name": f"User {sender}", "is_bot": False, "photo_url": ""},
+            "message": {"telegram_id": 10 ** 6 * ch + i, "message_type": "text",
+                        "content_text": " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 40))),
+                        "media_file_path": None, "views": rnd.randint(0, 5000), "forwards": rnd.randint(0, 50),
+                        "replies_count": 0, "posted_at": (start + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S")},
+            "entities": entities,
+        })
+    return payloads
+
+# ---------------------------
+# Per-row baseline
+# ---------------------------
+def upsert_row(cur, table: str, where: dict, values: dict) -> tuple:
+    """updateOrCreate: select by the keys, then update the row or insert a new one"""
+    cond = " AND ".join(f"{k} = %s" for k in where)
+    cur.execute(f"SELECT * FROM {table} WHERE {cond} LIMIT 1", list(where.values()))
+    row = cur.fetchone()
+    if row:
+        names = [d.name for d in cur.description]
+        current = dict(zip(names, row))
+        dirty = {k: v for k, v in values.items() if str(current.get(k)) != str(v)}
+        if dirty:
+            sets = ", ".join(f"{k} = %s" for k in dirty)
+            cur.execute(f"UPDATE {table} SET {sets}, updated_at = now() WHERE id = %s", [*dirty.values(), current["id"]])
+        return current["id"], False, bool(dirty)
+    cols = {**where, **values}
+    cur.execute(f"INSERT INTO {table} ({', '.join(cols)}, created_at, updated_at) "
+                f"VALUES ({', '.join(['%s'] * len(cols))}, now(), now()) RETURNING id", list(cols.values()))
+    return cur.fetchone()[0], True, False
+
+def per_row_import(conn, payloads: list) -> dict:
+    counts = {"created": 0, "updated": 0, "skipped": 0}
+    for item in payloads:
+        ch, sender, msg = item["channel"], item.get("sender") or {}, item["message"]
+        try:
+            created, changed = per_row_item(conn, ch, sender, msg, item.get("entities"))
+        except psycopg.Error:
+            # Concurrent requests racing on a new channel/sender: the controller skips the item too
+            counts["skipped"] += 1
+            continue
+        counts["created" if created else "updated" if changed else "skipped"] += 1
+    return counts
+
+def per_row_item(conn, ch: dict, sender: dict, msg: dict, entities: list) -> tuple:
+    with conn.transaction(), conn.cursor() as cur:
+        channel_id, _, _ = upsert_row(cur, "channels", {"telegram_id": ch["telegram_id"]}, {
+            "title": ch["title"], "username": ch["username"], "is_private": ch["is_private"],
+            "is_adults": ch["is_adults"], "type": ch["type"], "description": ch["description"],
+            "members_count": ch["members_count"]})
+        sender_id = None
+        if sender.get("telegram_id"):
+            sender_id, _, _ = upsert_row(cur, "senders", {"telegram_id": sender["telegram_id"]}, {
+                "username": sender["username"], "display_name": sender["display_name"], "is_bot": sender["is_bot"]})
+        message_id, created, changed = upsert_row(
+            cur, "messages", {"telegram_id": msg["telegram_id"], "channel_id": channel_id},
+            {"sender_id": sender_id, "message_type": msg["message_type"], "content_text": msg["content_text"],
+             "media_file_path": msg["media_file_path"], "views": msg["views"], "forwards": msg["forwards"],
+             "replies_count": msg["replies_count"], "posted_at": msg["posted_at"]})
+        if entities:
+            cur.execute("DELETE FROM message_entities WHERE message_id = %s", (message_id,))
+            for ent in entities:
+                cur.execute("INSERT INTO message_entities (message_id, entity_type, entity_value, created_at, "
+                            "updated_at) VALUES (%s, %s, %s, now(), now())",
+                            (message_id, ent["entity_type"], ent["entity_value"]))
+    return created, changed
+
+def run_per_row(dsn: str, batches: list, workers: int) -> dict:
+    local = threading.local()
+
+    def work(batch):
+        if not hasattr(local, "conn"):
+            local.conn = psycopg.connect(dsn)
+        return per_row_import(local.conn, batch)
+
+    return timed(batches, workers, work)
+
+# ---------------------------
+# Service
+# ---------------------------
+def run_service(dsn: str, batches: list, workers: int, port: int) -> dict:
+    loop = asyncio.new_event_loop()
+    service = IngestService(dsn, workers, token=BENCH_TOKEN)
+    server = loop.run_until_complete(service.start("127.0.0.1", port))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    local = threading.local()
+    url = f"http://127.0.0.1:{port}/api/messages/import"
+    headers = {"Authorization": f"Bearer {BENCH_TOKEN}", "Content-Type": "application/json"}
+
+    def work(batch):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        r = local.session.post(url, data=json.dumps(batch), headers=headers, timeout=120)
+        r.raise_for_status()
+        return r.json()
+
+    try:
+        return timed(batches, workers, work)
+    finally:
+        server.close()
+        asyncio.run_coroutine_threadsafe(service.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+# ---------------------------
+# Driver
+# ---------------------------
+def timed(batches: list, workers: int, work) -> dict:
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(work, batches))
+    elapsed = time.perf_counter() - t0
+    payloads = sum(len(b) for b in batches)
+    totals = {k: sum(r[k] for r in results) for k in ("created", "updated", "skipped")}
+    return {"seconds": round(elapsed, 2), "payloads_per_s": round(payloads / elapsed), **totals}
+
+def truncate(dsn: str):
+    with psycopg.connect(dsn) as conn:
+        conn.execute("TRUNCATE message_entities, messages, senders, channels, import_batches RESTART IDENTITY CASCADE")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN)
+    parser.add_argument("--payloads", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=50, help="Payloads per request (BATCH_SIZE in main.py)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests / database connections")
+    parser.add_argument("--port", type=int, default=18081)
+    args = parser.parse_args()
+
+    payloads = synthetic_payloads(args.payloads)
+    batches = [payloads[i:i + args.batch] for i in range(0, len(payloads), args.batch)]
+    print(f"{len(payloads)} payloads, {len(batches)} requests of {args.batch}, {args.workers} workers")
+
+    for name, run in (("per-row", lambda: run_per_row(args.dsn, batches, args.workers)),
+                      ("service", lambda: run_service(args.dsn, batches, args.workers, args.port))):
+        truncate(args.dsn)
+        first = run()
+        second = run()
+        print(f"{name:8} insert: {first}")
+        print(f"{name:8} repeat: {second}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Load test of an import endpoint with the payloads fetch_channel_messages builds.
+
+Run from the crawler directory:
+
+    python -m bench.loadtest [--url URL] [--batch 50,200] [--concurrency 1,4,16] [--rate 0]
+                             [--entities -1] [--duration 20] [--save FILE]
+
+Payloads come from MessageBatch over synthetic channel messages (see
+bench.fakes), so their structure matches what the crawler uploads. Every
+request carries new message ids, and the crawler's headers including its
+Idempotency-Key. --entities N gives every message exactly N hashtag
+entities; the default -1 keeps the channels' natural mix.
+
+One run is made per combination of --batch, --concurrency and --entities.
+By default each of the --concurrency workers sends its next request as soon
+as the previous one returns. With --rate R, requests are due every 1/R
+seconds instead. The workers then only cap how many are in flight, and
+latency is measured from the due time, so a saturated endpoint shows up as
+queueing rather than as a lower request rate.
+
+Without --url an in-process FakeImportServer is the target (--fake-latency,
+--fake-error-rate), so the tool also runs offline.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import requests
+
+import main
+from bench.fakes import FakeImportServer, SyntheticChannel
+
+POOL_CHANNELS = 20
+POOL_MESSAGES = 200  # Per channel; payloads are reused with fresh ids
+
+# ---------------------------
+# Payloads
+# ---------------------------
+def with_entities(msg, n: int):
+    """Replace the message's entities with exactly n hashtags appended to its text"""
+    tags = [f"#tag{i}" for i in range(n)]
+    text = (msg.message or "").rstrip()
+    offset = len(text) + 1 if text else 0
+    entities = []
+    for tag in tags:
+        entities.append(main.MessageEntityHashtag(offset=offset, length=len(tag)))
+        offset += len(tag) + 1
+    msg.message = msg._text = " ".join(([text] if text else []) + tags)
+    msg.entities = entities or None
+    return msg
+
+def payload_pool(entities: int, seed: int) -> List[Dict[str, Any]]:
+    """Import payloads of POOL_CHANNELS synthetic channels, built the way fetch_channel_messages does"""
+    pool = []
+    for c in range(POOL_CHANNELS):
+        channel = SyntheticChannel(2000 + c, f"load_channel_{c}", POOL_MESSAGES, seed=seed)
+        batch = main.MessageBatch()
+        for msg_id in range(POOL_MESSAGES, 0, -1):
+            msg = channel.message(msg_id)
+            if msg is not None:
+                batch.add(with_entities(msg, entities) if entities >= 0 else msg)
+        batch.sort()
+        pool.extend(batch.payloads(channel.entity, False))
+    return pool
+
+class PayloadSource:
+    """Batches cut from the pool in turn, with message ids never sent before"""
+
+    def __init__(self, pool: List[Dict[str, Any]]):
+        self.pool = pool
+        self.position = itertools.count()
+        self.ids = itertools.count(int(time.time() * 1000))  # New rows on every run, also against a real backend
+
+    def batch(self, size: int) -> List[Dict[str, Any]]:
+        start = next(self.position) * size
+        return [{**p, "message": {**p["message"], "telegram_id": next(self.ids)}}
+                for p in (self.pool[(start + i) % len(self.pool)] for i in range(size))]
+
+# ---------------------------
+# Driver
+# ---------------------------
+def run_level(url: str, token: str, source: PayloadSource, batch: int, concurrency: int, rate: float,
+              duration: float, max_requests: int, timeout: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    outcomes: Counter = Counter()
+    totals = Counter()
+    lock = threading.Lock()
+    sequence = itertools.count()
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def worker():
+        session = requests.Session()
+        while True:
+            k = next(sequence)
+            if max_requests and k >= max_requests:
+                return
+            due = started + k / rate if rate else time.perf_counter()
+            if due >= deadline:
+                return
+            payloads = source.batch(batch)
+            body = json.dumps(payloads, ensure_ascii=False).encode("utf-8")
+            headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json",
+                       "User-Agent": "TelegramCrawler/1.0", "Idempotency-Key": main.idempotency_key(payloads)}
+            if due > time.perf_counter():
+                time.sleep(due - time.perf_counter())
+            try:
+                r = session.post(url, data=body, headers=headers, timeout=timeout)
+                outcome = str(r.status_code)
+                rows = len(payloads) if r.status_code == 200 else 0
+            except requests.RequestException as e:
+                outcome, rows = e.__class__.__name__, 0
+            latency = time.perf_counter() - due
+            with lock:
+                latencies.append(latency)
+                outcomes[outcome] += 1
+                totals["rows"] += rows
+                totals["bytes"] += len(body)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    n = len(latencies)
+
+    def pct(q: float) -> float:
+        return round(latencies[min(n - 1, int(q * n))] * 1000, 1) if n else 0.0
+
+    errors = {k: v for k, v in outcomes.items() if k != "200"}
+    return {
+        "batch": batch, "concurrency": concurrency, "rate": rate,
+        "requests": n, "errors": errors, "error_rate": round(sum(errors.values()) / n, 4) if n else 0.0,
+        "seconds": round(elapsed, 2),
+        "requests_per_s": round(n / elapsed, 1) if elapsed else 0.0,
+        "rows_per_s": round(totals["rows"] / elapsed, 1) if elapsed else 0.0,
+        "bytes_per_request": round(totals["bytes"] / n) if n else 0,
+        "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99), "max_ms": pct(1.0),
+    }
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def main_load():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="import endpoint (default: an in-process fake)")
+    parser.add_argument("--token", default=main.IMPORT_TOKEN)
+    parser.add_argument("--batch", type=int_list, default=[main.BATCH_SIZE], help="payloads per request, e.g. 50,200")
+    parser.add_argument("--concurrency", type=int_list, default=[4], help="workers / max requests in flight")
+    parser.add_argument("--entities", type=int_list, default=[-1], help="hashtags per message (-1: natural mix)")
+    parser.add_argument("--rate", type=float, default=0.0, help="requests per second (0: as fast as answered)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per run")
+    parser.add_argument("--requests", type=int, default=0, help="stop a run after this many requests")
+    parser.add_argument("--timeout", type=float, default=main.REQUEST_TIMEOUT)
+    parser.add_argument("--fake-latency", type=float, default=0.01, help="seconds per request of the fake target")
+    parser.add_argument("--fake-error-rate", type=float, default=0.0, help="share of 503s from the fake target")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        server = FakeImportServer(latency=args.fake_latency, error_rate=args.fake_error_rate, seed=args.seed)
+        url = f"{server.start()}/messages/import"
+    print(f"Target {url}")
+
+    results = []
+    try:
+        for entities in args.entities:
+            source = PayloadSource(payload_pool(entities, args.seed))
+            for batch, concurrency in itertools.product(args.batch, args.concurrency):
+                r = run_level(url, args.token, source, batch, concurrency, args.rate, args.duration,
+                              args.requests, args.timeout)
+                r["entities"] = entities
+                results.append(r)
+                errors = ", ".join(f"{k} {v}" for k, v in sorted(r["errors"].items())) or "none"
+                print(f"batch {batch:5}  conc {concurrency:3}  entities {'mix' if entities < 0 else entities:>3}  "
+                      f"{r['requests_per_s']:8.1f} req/s  {r['rows_per_s']:9.1f} rows/s  "
+                      f"p50 {r['p50_ms']:8.1f}ms  p95 {r['p95_ms']:8.1f}ms  p99 {r['p99_ms']:8.1f}ms  "
+                      f"errors {errors}")
+    finally:
+        if server is not None:
+            server.stop()
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main_load()
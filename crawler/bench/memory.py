@@ -0,0 +1,89 @@
+"""Per-message memory of the crawl pipeline, before and after MessageBatch.
+
+Run from the crawler directory:
+
+    python -m bench.memory [--messages 5000]
+
+"Before" is what fetch_channel_messages held for a page until upload: the
+Telethon messages plus one payload dict per message. "After" is the
+MessageBatch that replaces both; payload dicts now only exist while a page
+is being sent.
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from telethon.tl import types
+
+import main
+
+WORDS = ["sale", "new", "video", "today", "channel", "join", "free", "link", "photo", "update", "best", "watch"]
+
+def synthetic_messages(n: int, seed: int = 1) -> list:
+    """Channel posts shaped like iter_messages output: text with links/mentions/hashtags and counters"""
+    rnd = random.Random(seed)
+    chat = types.Channel(id=100, title="Bench", photo=types.ChatPhotoEmpty(), date=None,
+                         username="bench", broadcast=True, access_hash=1)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    msgs = []
+    for i in range(1, n + 1):
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(5, 60))]
+        extras = ["#" + rnd.choice(WORDS), "@" + rnd.choice(WORDS) + "_chan", "https://t.me/" + rnd.choice(WORDS) + "_x"]
+        text = " ".join(words + extras)
+        entities, pos = [], len(" ".join(words)) + 1
+        for extra, cls in zip(extras, (types.MessageEntityHashtag, types.MessageEntityMention, types.MessageEntityUrl)):
+            entities.append(cls(offset=pos, length=len(extra)))
+            pos += len(extra) + 1
+        msg = types.Message(
+            id=i, peer_id=types.PeerChannel(100), date=start + timedelta(minutes=i), message=text,
+            entities=entities, views=rnd.randint(0, 10 ** 6), forwards=rnd.randint(0, 500),
+            replies=types.MessageReplies(replies=rnd.randint(0, 50), replies_pts=i), post=True,
+        )
+        msg._text = text  # What the client's parse mode sets on received messages
+        msg._chat = chat
+        msgs.append(msg)
+    return msgs
+
+def measure(build):
+    """(result, bytes still allocated by `build` after it returns)"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def to_batch(msgs) -> main.MessageBatch:
+    batch = main.MessageBatch()
+    for msg in msgs:
+        batch.add(msg)
+    batch.sort()
+    return batch
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+    n = args.messages
+    chat = types.Channel(id=100, title="Bench", photo=types.ChatPhotoEmpty(), date=None,
+                         username="bench", broadcast=True, access_hash=1)
+
+    msgs, telethon_bytes = measure(lambda: synthetic_messages(n))
+    payloads, payload_bytes = measure(lambda: [main.build_payload(m, chat, False) for m in msgs])
+    batch, batch_bytes = measure(lambda: to_batch(msgs))
+    del payloads, msgs
+    page, page_bytes = measure(lambda: to_batch(synthetic_messages(main.BATCH_SIZE)).payloads(chat, False))
+
+    before = telethon_bytes + payload_bytes
+    print(f"{n} messages, bytes per message:")
+    print(f"  Telethon Message objects   {telethon_bytes / n:8.0f}")
+    print(f"  payload dicts              {payload_bytes / n:8.0f}")
+    print(f"  before (held until upload) {before / n:8.0f}")
+    print(f"  after  (MessageBatch)      {batch_bytes / n:8.0f}   {before / max(batch_bytes, 1):.1f}x smaller")
+    print(f"  upload-time payloads of one {main.BATCH_SIZE}-message page: {page_bytes / 1024:.0f} KiB (transient)")
+
+if __name__ == "__main__":
+    main_bench()
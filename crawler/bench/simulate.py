@@ -0,0 +1,457 @@
+"""Discrete-event simulation of the crawl scheduler against a model of Telegram's limits.
+
+Run from the crawler directory:
+
+    python -m bench.simulate [--hours 24] [--accounts 2] [--channels 60] [--posts-per-hour 2]
+                             [--strategy 'NAME:KEY=VALUE,...'] [--save FILE]
+
+main.main("crawl", loop_interval) runs unchanged. That covers run_account,
+the ClientPool, the RPC limiter, the circuit breaker and the upload buffer.
+It runs on an event loop whose clock only moves when every task is waiting,
+so an hour of sleeping costs nothing. main's time source follows the same
+clock.
+
+Telegram is modelled by SimTelegramClient. Channels post on a Poisson
+schedule. Each account has a hidden request budget, with a tighter one for
+ResolveUsername. Overdrawing it answers FloodWait, doubling for repeated
+offences within an hour, and calls made during a wait get the remaining
+seconds. Generic RPC errors, auth key loss and import API outages are
+injected as configured. Uploads go to an in-process FakeImportServer, which
+stamps the virtual time each message first arrives.
+
+Each --strategy overrides main.py constants (and loop_interval) for one run.
+The strategies run in separate processes on the same channel population and
+fault schedule. For each strategy the report gives:
+- coverage of the posts made during the run and of the newest backlog posts
+- freshness lag from post to upload
+- total account suspension and quarantined accounts
+- floods and RPCs
+"""
+import argparse
+import ast
+import asyncio
+import bisect
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import selectors
+import tempfile
+import time
+import types
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from telethon.errors import AuthKeyUnregisteredError, FloodWaitError, RpcCallFailError
+
+import main
+from bench.fakes import FakeImportServer, FakeTelegramClient, SyntheticChannel
+
+EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()  # Virtual time 0
+BACKLOG_WINDOW = 50  # Newest pre-existing posts per channel counted for backlog coverage
+
+# ---------------------------
+# Virtual clock
+# ---------------------------
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0  # Seconds since the start of the run
+
+    def advance(self, seconds: float):
+        self.now += max(0.0, seconds)
+
+    def time(self) -> float:
+        return EPOCH + self.now
+
+class VirtualSelector(selectors.DefaultSelector):
+    """Never waits for a timer: when nothing is ready, the clock jumps to the next one"""
+
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        if timeout is None:
+            return super().select(None)  # No timers at all; only another thread can wake the loop
+        events = super().select(0)
+        if not events:
+            self.clock.advance(timeout)
+        return events
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock):
+        super().__init__(VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self) -> float:
+        return self.clock.now
+
+def use_virtual_time(clock: VirtualClock):
+    """Point main's time module at the virtual clock"""
+    fake = types.ModuleType("time")
+    fake.__dict__.update(time.__dict__)
+    fake.time = clock.time
+    fake.monotonic = lambda: clock.now
+    fake.time_ns = lambda: int(clock.time() * 1e9)
+    main.time = fake
+
+# ---------------------------
+# Channels
+# ---------------------------
+class SimChannel(SyntheticChannel):
+    """A synthetic channel whose messages appear at their post times on the virtual clock"""
+
+    def __init__(self, channel_id: int, username: str, times: List[float], clock: VirtualClock, seed: int = 1):
+        self.times = times  # Post time of message id i + 1, ascending; backlog posts are negative
+        self.clock = clock
+        super().__init__(channel_id, username, 0, seed)
+
+    @property
+    def size(self) -> int:
+        return bisect.bisect_right(self.times, self.clock.now)
+
+    @size.setter
+    def size(self, value):
+        pass  # Grows with the clock
+
+    def message(self, msg_id: int):
+        msg = super().message(msg_id)
+        if msg is not None:
+            msg.date = datetime.fromtimestamp(EPOCH + self.times[msg_id - 1], tz=timezone.utc)
+        return msg
+
+def channel_population(args, clock: VirtualClock) -> List[SimChannel]:
+    """Channels with lognormal posting rates and `--backlog` posts made before the run, same for every seed"""
+    rnd = random.Random(args.seed)
+    duration = args.hours * 3600
+    channels = []
+    for i in range(args.channels):
+        rate = args.posts_per_hour * rnd.lognormvariate(0, 1) / 3600
+        times = sorted(-rnd.uniform(0, 30 * 86400) for _ in range(args.backlog))
+        t = 0.0
+        while True:
+            t += rnd.expovariate(rate)
+            if t >= duration:
+                break
+            times.append(t)
+        channels.append(SimChannel(10_000 + i, f"sim_channel_{i}", times, clock, args.seed))
+    return channels
+
+# ---------------------------
+# Telegram model
+# ---------------------------
+class TelegramModel:
+    """Hidden per-account limits and injected faults, shared by the simulated clients"""
+
+    def __init__(self, clock: VirtualClock, args):
+        self.clock = clock
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.accounts: Dict[str, Dict[str, Any]] = {}
+        self.metrics: Counter = Counter()
+
+    def account(self, session_name: str) -> Dict[str, Any]:
+        if session_name not in self.accounts:
+            # Drawn from the session name, so every strategy loses the same accounts at the same time
+            lost = (random.Random(f"{self.args.seed}:{session_name}").expovariate(self.args.auth_loss_per_day / 86400)
+                    if self.args.auth_loss_per_day else math.inf)
+            self.accounts[session_name] = {"tokens": float(self.args.tg_burst), "updated": self.clock.now,
+                                           "resolves": [], "flood_until": 0.0, "strikes": 0,
+                                           "last_flood": -math.inf, "auth_lost_at": lost}
+        return self.accounts[session_name]
+
+    def authorized(self, session_name: str) -> bool:
+        return self.clock.now < self.account(session_name)["auth_lost_at"]
+
+    def check(self, session_name: str, request: str):
+        """Raise what Telegram would answer to `request` now, if not a result"""
+        now = self.clock.now
+        a = self.account(session_name)
+        if not self.authorized(session_name):
+            self.metrics["auth_errors"] += 1
+            raise AuthKeyUnregisteredError(request=None)
+        if now < a["flood_until"]:
+            self.metrics["floods"] += 1
+            raise FloodWaitError(request=None, capture=math.ceil(a["flood_until"] - now))
+
+        a["tokens"] = min(self.args.tg_burst, a["tokens"] + (now - a["updated"]) * self.args.tg_rate)
+        a["updated"] = now
+        over = a["tokens"] < 1
+        if request == "ResolveUsername":
+            a["resolves"] = [t for t in a["resolves"] if t > now - 3600]
+            over = over or len(a["resolves"]) >= self.args.resolve_per_hour
+            if not over:
+                a["resolves"].append(now)
+        if over:
+            a["strikes"] = a["strikes"] + 1 if now - a["last_flood"] < 3600 else 0
+            a["last_flood"] = now
+            seconds = int(min(self.args.flood_max, self.args.flood_seconds * 2 ** a["strikes"]))
+            a["flood_until"] = now + seconds
+            self.metrics["floods"] += 1
+            raise FloodWaitError(request=None, capture=seconds)
+        a["tokens"] -= 1
+
+        if self.args.rpc_error_rate and self.rnd.random() < self.args.rpc_error_rate:
+            self.metrics["rpc_errors"] += 1
+            raise RpcCallFailError(request=None)
+
+class SimTelegramClient(FakeTelegramClient):
+    """FakeTelegramClient answering through the TelegramModel of its account"""
+
+    def __init__(self, session_name: str, channels: List[SimChannel], model: TelegramModel, latency: float):
+        super().__init__(channels, latency=latency)
+        self.session_name = session_name
+        self.model = model
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        self.rpcs[request] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.model.check(self.session_name, request)
+
+    async def start(self):
+        if not self.model.authorized(self.session_name):
+            raise AuthKeyUnregisteredError(request=None)
+        self.connected = True
+
+    async def is_user_authorized(self) -> bool:
+        return self.model.authorized(self.session_name)
+
+# ---------------------------
+# Import API
+# ---------------------------
+class SimResponse:
+    def __init__(self, status: int, body: Any, headers: Dict[str, str]):
+        self.status_code = status
+        self.headers = headers
+        self.content = json.dumps(body).encode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+class SimImportServer(FakeImportServer):
+    """FakeImportServer called in-process in place of main.http_post, with outage windows on the virtual clock.
+
+    Like the real upload, which runs in a worker thread, a request waits out
+    its latency without blocking the loop; other tasks run meanwhile.
+    """
+
+    def __init__(self, clock: VirtualClock, latency: float, outages: List[tuple], error_rate: float = 0.0,
+                 seed: int = 1):
+        super().__init__(error_rate=error_rate, seed=seed)
+        self.clock = clock
+        self.api_latency = latency
+        self.outages = outages  # (start, end) seconds
+        self.first_seen: Dict[tuple, float] = {}
+
+    async def post(self, url: str, headers=None, timeout=None, **kwargs) -> SimResponse:
+        if any(start <= self.clock.now < end for start, end in self.outages):
+            self.metrics["outage_requests"] += 1
+            await asyncio.sleep(min(timeout or 0, 5.0))  # Connection refused by the proxy after a short wait
+            raise main.ConnectionError("simulated outage")
+        await asyncio.sleep(self.api_latency)
+        raw = kwargs["data"] if "data" in kwargs else json.dumps(kwargs.get("json")).encode("utf-8")
+        return SimResponse(*self.handle(url.split("//", 1)[-1].split("/", 1)[-1], headers or {}, raw))
+
+    def import_batch(self, payloads: List[Dict[str, Any]], key: Optional[str]) -> Dict[str, Any]:
+        for p in payloads:
+            ident = (p.get("channel", {}).get("telegram_id"), p.get("message", {}).get("telegram_id"))
+            self.first_seen.setdefault(ident, self.clock.now)
+        return super().import_batch(payloads, key)
+
+def parse_outages(specs: List[str]) -> List[tuple]:
+    """'START_HOUR:MINUTES' -> (start, end) seconds"""
+    outages = []
+    for spec in specs:
+        start, minutes = spec.split(":")
+        outages.append((float(start) * 3600, float(start) * 3600 + float(minutes) * 60))
+    return outages
+
+# ---------------------------
+# Simulation
+# ---------------------------
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def suspended_seconds(intervals: List[tuple], end: float) -> float:
+    """Length of the union of (start, wake) intervals, clipped to the run"""
+    total, covered = 0.0, 0.0
+    for start, wake in sorted(intervals):
+        start, wake = max(start, covered), min(wake, end)
+        if wake > start:
+            total += wake - start
+            covered = wake
+    return total
+
+def simulate(args, name: str, overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """One run of main.main("crawl") on the virtual clock; returns the strategy's report"""
+    started = time.perf_counter()
+    workdir = tempfile.mkdtemp(prefix=f"crawler-sim-{name}-")
+    os.chdir(workdir)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+    random.seed(args.seed)
+
+    loop_interval = overrides.pop("loop_interval", args.interval)
+    for key, value in overrides.items():
+        setattr(main, key, value)
+
+    clock = VirtualClock()
+    use_virtual_time(clock)
+    duration = args.hours * 3600
+    channels = channel_population(args, clock)
+    model = TelegramModel(clock, args)
+    server = SimImportServer(clock, args.api_latency, parse_outages(args.outage), args.api_error_rate, args.seed)
+    main.http_post = server.post
+    main.archive = None
+    main.METRICS_PORT, main.METRICS_FILE = 0, ""
+
+    main.ACCOUNTS = [{"session": f"sim{i}", "api_id": 0, "api_hash": ""} for i in range(args.accounts)]
+    by_account: Dict[str, List[SimChannel]] = {}
+    for i, channel in enumerate(channels):
+        by_account.setdefault(main.ACCOUNTS[i % args.accounts]["session"], []).append(channel)
+    for session_name, owned in by_account.items():
+        main.save_json(main.CHANNELS_TEMPLATE.format(session_name), [{"username": c.username} for c in owned])
+    main.client_pool = main.ClientPool(
+        lambda account: SimTelegramClient(account["session"], by_account.get(account["session"], []), model,
+                                          args.latency))
+
+    suspensions: List[tuple] = []
+    suspend_account = main.suspend_account
+
+    def record_suspension(session_name: str, secs: int) -> float:
+        wake_ts = suspend_account(session_name, secs)
+        suspensions.append((session_name, clock.time(), wake_ts))
+        return wake_ts
+
+    main.suspend_account = record_suspension
+
+    async def run():
+        try:
+            await asyncio.wait_for(main.main("crawl", loop_interval, on_cycle=lambda: None), duration)
+        except asyncio.TimeoutError:
+            pass
+
+    loop = VirtualTimeLoop(clock)
+    try:
+        loop.run_until_complete(run())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+    finally:
+        loop.close()
+    clock.now = duration  # Posts after the last event still count as missed
+
+    lags, posted, uploaded, backlog, backlog_uploaded = [], 0, 0, 0, 0
+    for channel in channels:
+        before = bisect.bisect_left(channel.times, 0.0)  # Backlog posts are the lowest ids
+        for msg_id in range(max(1, before - BACKLOG_WINDOW + 1), len(channel.times) + 1):
+            if channel.message(msg_id) is None:
+                continue  # Deleted
+            seen = server.first_seen.get((channel.channel_id, msg_id))
+            if msg_id <= before:
+                backlog += 1
+                backlog_uploaded += seen is not None
+            else:
+                posted += 1
+                if seen is not None:
+                    uploaded += 1
+                    lags.append(seen - channel.times[msg_id - 1])
+
+    intervals: Dict[str, List[tuple]] = {}
+    for session_name, start, wake in suspensions:
+        intervals.setdefault(session_name, []).append((start - EPOCH, wake - EPOCH))
+    quarantined = main.load_quarantined()
+    pools = main.client_pool.summary()
+
+    return {
+        "strategy": name,
+        "overrides": {**overrides, "loop_interval": loop_interval},
+        "posted": posted,
+        "coverage": round(uploaded / posted, 4) if posted else 0.0,
+        "backlog_coverage": round(backlog_uploaded / backlog, 4) if backlog else 0.0,
+        "lag_p50_min": round(percentile(lags, 0.5) / 60, 1),
+        "lag_p95_min": round(percentile(lags, 0.95) / 60, 1),
+        "lag_max_min": round(max(lags, default=0) / 60, 1),
+        "suspended_hours": round(sum(suspended_seconds(v, duration) for v in intervals.values()) / 3600, 2),
+        "suspensions": len(suspensions),
+        "quarantined": sorted(quarantined),
+        "quarantined_hours": round(sum(duration - (q.get("since", EPOCH) - EPOCH)
+                                       for q in quarantined.values()) / 3600, 2),
+        "floods": model.metrics["floods"],
+        "rpc_errors": model.metrics["rpc_errors"],
+        "rpcs": sum(p.get("rpc_calls", 0) for p in pools.values()),
+        "upload_requests": server.metrics["requests"],
+        "outage_requests": server.metrics["outage_requests"],
+        "buffered": main.upload_breaker.metrics["buffered"],
+        "wall_seconds": round(time.perf_counter() - started, 1),
+    }
+
+def parse_strategy(spec: str, parser: argparse.ArgumentParser) -> tuple:
+    """'NAME:KEY=VALUE,KEY=VALUE' -> (name, overrides); values are Python literals"""
+    name, _, rest = spec.partition(":")
+    overrides = {}
+    for item in filter(None, (s.strip() for s in rest.split(","))):
+        key, _, value = item.partition("=")
+        key = key.strip()
+        if key != "loop_interval" and not (key.isupper() and hasattr(main, key)):
+            parser.error(f"unknown setting {key!r} in strategy {name!r}")
+        try:
+            overrides[key] = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            parser.error(f"bad value for {key} in strategy {name!r}: {value!r}")
+    return name.strip(), overrides
+
+def main_sim():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=24.0, help="simulated time")
+    parser.add_argument("--accounts", type=int, default=2)
+    parser.add_argument("--channels", type=int, default=60)
+    parser.add_argument("--posts-per-hour", type=float, default=2.0, help="median posting rate of a channel")
+    parser.add_argument("--backlog", type=int, default=200, help="posts per channel before the run")
+    parser.add_argument("--interval", type=float, default=300.0, help="loop_interval between crawl cycles")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per Telegram RPC")
+    parser.add_argument("--tg-rate", type=float, default=1.0, help="sustained RPCs/s Telegram tolerates per account")
+    parser.add_argument("--tg-burst", type=float, default=30.0)
+    parser.add_argument("--resolve-per-hour", type=int, default=200, help="ResolveUsername calls per account-hour")
+    parser.add_argument("--flood-seconds", type=float, default=30.0, help="first FloodWait; doubles per repeat")
+    parser.add_argument("--flood-max", type=float, default=6 * 3600.0)
+    parser.add_argument("--rpc-error-rate", type=float, default=0.0, help="probability of an RPC error per call")
+    parser.add_argument("--auth-loss-per-day", type=float, default=0.0, help="auth key losses per account-day")
+    parser.add_argument("--api-latency", type=float, default=0.2, help="seconds per import API request")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="probability of a 503 per request")
+    parser.add_argument("--outage", action="append", default=[], metavar="START_HOUR:MINUTES",
+                        help="import API down from START_HOUR for MINUTES (repeatable)")
+    parser.add_argument("--strategy", action="append", default=[], metavar="NAME:KEY=VALUE,...",
+                        help="main.py constants (or loop_interval) to override; repeatable, default: current")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="keep the crawler's info logging")
+    parser.add_argument("--save", metavar="FILE", help="write the reports as JSON")
+    args = parser.parse_args()
+
+    strategies = [parse_strategy(s, parser) for s in args.strategy] or [("current", {})]
+    save = os.path.abspath(args.save) if args.save else None
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(min(len(strategies), os.cpu_count() or 1), mp_context=ctx) as pool:
+        futures = [pool.submit(simulate, args, name, overrides) for name, overrides in strategies]
+        results = [f.result() for f in futures]
+
+    print(f"{args.hours:g}h, {args.accounts} accounts, {args.channels} channels, "
+          f"{results[0]['posted']} posts during the run")
+    for r in results:
+        print(f"{r['strategy']:16} coverage {r['coverage']:7.2%}  backlog {r['backlog_coverage']:7.2%}  "
+              f"lag p50 {r['lag_p50_min']:6.1f}m p95 {r['lag_p95_min']:6.1f}m  "
+              f"suspended {r['suspended_hours']:6.2f}h ({r['suspensions']})  floods {r['floods']:5}  "
+              f"rpcs {r['rpcs']:6}  quarantined {len(r['quarantined'])}  [{r['wall_seconds']}s]")
+
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main_sim()
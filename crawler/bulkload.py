@@ -0,0 +1,279 @@
+"""Bulk loader for crawler batches, straight into the backend's Postgres schema.
+
+Import payloads (the items send_to_api posts, e.g. replayed from the local
+archive) are streamed with COPY into temporary staging tables and merged into
+channels, senders, messages and message_entities with a handful of set-based
+statements per load, instead of the per-row updateOrCreate calls of
+MessageController::import. The merge keeps the controller's semantics: photo
+urls are only overwritten when non-empty, a message is matched on
+(telegram_id, channel_id), and entities are replaced when the payload has any.
+
+    python bulkload.py [--dsn URL] [--batch N] ARCHIVE_DIR_OR_FILE ...
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import psycopg
+
+from archive import MessageArchive
+
+logger = logging.getLogger(__name__)
+
+# Defaults match backend/.env
+DEFAULT_DSN = os.environ.get("CRAWLER_DATABASE_URL", "postgresql://root@127.0.0.1:5432/backend")
+LOAD_BATCH_SIZE = 5000  # Payloads per transaction
+
+# ---------------------------
+# Staging
+# ---------------------------
+STAGING_DDL = """
+CREATE TEMP TABLE stage_channels (
+    seq int, telegram_id bigint, title text, username text, type text, is_private boolean,
+    is_adults boolean, description text, members_count int, photo_url text
+) ON COMMIT DROP;
+CREATE TEMP TABLE stage_senders (
+    seq int, telegram_id bigint, username text, display_name text, is_bot boolean, photo_url text
+) ON COMMIT DROP;
+CREATE TEMP TABLE stage_messages (
+    seq int, telegram_id bigint, channel_tid bigint, sender_tid bigint, message_type text,
+    content_text text, media_file_path text, views int, forwards int, replies_count int,
+    posted_at text, has_entities boolean
+) ON COMMIT DROP;
+CREATE TEMP TABLE stage_entities (
+    seq int, entity_type text, entity_value text
+) ON COMMIT DROP;
+"""
+
+def copy_rows(cur, table: str, columns: str, rows: Iterable[tuple]):
+    with cur.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+
+def stage_payloads(cur, payloads: List[Dict[str, Any]]):
+    channels, senders, messages, entities = [], [], [], []
+    for seq, item in enumerate(payloads):
+        ch = item.get("channel") or {}
+        msg = item.get("message") or {}
+        sender = item.get("sender") or {}
+        if not ch.get("telegram_id") or not msg.get("telegram_id"):
+            continue
+
+        channels.append((seq, ch["telegram_id"], ch.get("title"), ch.get("username"), ch.get("type"),
+                         bool(ch.get("is_private", False)), bool(ch.get("is_adults", False)),
+                         ch.get("description"), ch.get("members_count"), ch.get("photo_url")))
+        if sender.get("telegram_id"):
+            senders.append((seq, sender["telegram_id"], sender.get("username"), sender.get("display_name"),
+                            bool(sender.get("is_bot", False)), sender.get("photo_url")))
+        item_entities = [e for e in item.get("entities") or [] if e.get("entity_type") and e.get("entity_value")]
+        messages.append((seq, msg["telegram_id"], ch["telegram_id"], sender.get("telegram_id") or None,
+                         msg.get("message_type") or "text", msg.get("content_text"), msg.get("media_file_path"),
+                         msg.get("views") or 0, msg.get("forwards") or 0, msg.get("replies_count") or 0,
+                         msg.get("posted_at"), bool(item.get("entities"))))
+        entities.extend((seq, e["entity_type"], e["entity_value"]) for e in item_entities)
+
+    copy_rows(cur, "stage_channels", "seq, telegram_id, title, username, type, is_private, is_adults, "
+                                     "description, members_count, photo_url", channels)
+    copy_rows(cur, "stage_senders", "seq, telegram_id, username, display_name, is_bot, photo_url", senders)
+    copy_rows(cur, "stage_messages", "seq, telegram_id, channel_tid, sender_tid, message_type, content_text, "
+                                     "media_file_path, views, forwards, replies_count, posted_at, has_entities",
+              messages)
+    copy_rows(cur, "stage_entities", "seq, entity_type, entity_value", entities)
+    return len(messages)
+
+# ---------------------------
+# Set-based merge
+# ---------------------------
+# The latest payload wins when a batch holds the same row twice (DISTINCT ON ... seq DESC)
+MERGE_CHANNELS = """
+INSERT INTO channels (telegram_id, title, username, type, is_private, is_adults, description,
+                      members_count, photo_url, created_at, updated_at)
+SELECT DISTINCT ON (telegram_id) telegram_id, COALESCE(title, ''), username, COALESCE(type, 'channel'),
+       is_private, is_adults, description, members_count, NULLIF(photo_url, ''), now(), now()
+FROM stage_channels
+ORDER BY telegram_id, seq DESC
+ON CONFLICT (telegram_id) DO UPDATE SET
+    title = EXCLUDED.title, username = EXCLUDED.username, type = EXCLUDED.type,
+    is_private = EXCLUDED.is_private, is_adults = EXCLUDED.is_adults, description = EXCLUDED.description,
+    members_count = EXCLUDED.members_count, photo_url = COALESCE(EXCLUDED.photo_url, channels.photo_url),
+    updated_at = now()
+WHERE (channels.title, channels.username, channels.type, channels.is_private, channels.is_adults,
+       channels.description, channels.members_count, channels.photo_url)
+      IS DISTINCT FROM
+      (EXCLUDED.title, EXCLUDED.username, EXCLUDED.type, EXCLUDED.is_private, EXCLUDED.is_adults,
+       EXCLUDED.description, EXCLUDED.members_count, COALESCE(EXCLUDED.photo_url, channels.photo_url))
+"""
+
+MERGE_SENDERS = """
+INSERT INTO senders (telegram_id, username, display_name, is_bot, photo_url, created_at, updated_at)
+SELECT DISTINCT ON (telegram_id) telegram_id, username, display_name, is_bot, NULLIF(photo_url, ''), now(), now()
+FROM stage_senders
+ORDER BY telegram_id, seq DESC
+ON CONFLICT (telegram_id) DO UPDATE SET
+    username = EXCLUDED.username, display_name = EXCLUDED.display_name, is_bot = EXCLUDED.is_bot,
+    photo_url = COALESCE(EXCLUDED.photo_url, senders.photo_url), updated_at = now()
+WHERE (senders.username, senders.display_name, senders.is_bot, senders.photo_url)
+      IS DISTINCT FROM
+      (EXCLUDED.username, EXCLUDED.display_name, EXCLUDED.is_bot, COALESCE(EXCLUDED.photo_url, senders.photo_url))
+"""
+
+# Messages are matched on (telegram_id, channel_id) like the controller; a
+# telegram_id owned by another channel is left alone and counted as skipped.
+MERGE_MESSAGES = """
+INSERT INTO messages (telegram_id, channel_id, sender_id, message_type, content_text, media_file_path,
+                      views, forwards, replies_count, posted_at, created_at, updated_at)
+SELECT DISTINCT ON (m.telegram_id) m.telegram_id, c.id, s.id, m.message_type, m.content_text, m.media_file_path,
+       m.views, m.forwards, m.replies_count, m.posted_at::timestamp, now(), now()
+FROM stage_messages m
+JOIN channels c ON c.telegram_id = m.channel_tid
+LEFT JOIN senders s ON s.telegram_id = m.sender_tid
+WHERE m.posted_at IS NOT NULL
+ORDER BY m.telegram_id, m.seq DESC
+ON CONFLICT (telegram_id) DO UPDATE SET
+    sender_id = EXCLUDED.sender_id, message_type = EXCLUDED.message_type, content_text = EXCLUDED.content_text,
+    media_file_path = EXCLUDED.media_file_path, views = EXCLUDED.views, forwards = EXCLUDED.forwards,
+    replies_count = EXCLUDED.replies_count, posted_at = EXCLUDED.posted_at, updated_at = now()
+WHERE messages.channel_id = EXCLUDED.channel_id
+  AND (messages.sender_id, messages.message_type, messages.content_text, messages.media_file_path,
+       messages.views, messages.forwards, messages.replies_count, messages.posted_at)
+      IS DISTINCT FROM
+      (EXCLUDED.sender_id, EXCLUDED.message_type, EXCLUDED.content_text, EXCLUDED.media_file_path,
+       EXCLUDED.views, EXCLUDED.forwards, EXCLUDED.replies_count, EXCLUDED.posted_at)
+RETURNING (xmax = 0) AS inserted
+"""
+
+# Entities of every message whose payload carried some are replaced
+REPLACE_ENTITIES = """
+CREATE TEMP TABLE stage_touched ON COMMIT DROP AS
+SELECT msg.id AS message_id, sm.seq
+FROM (SELECT DISTINCT ON (telegram_id) telegram_id, channel_tid, seq, has_entities
+      FROM stage_messages ORDER BY telegram_id, seq DESC) sm
+JOIN channels c ON c.telegram_id = sm.channel_tid
+JOIN messages msg ON msg.telegram_id = sm.telegram_id AND msg.channel_id = c.id
+WHERE sm.has_entities;
+
+DELETE FROM message_entities WHERE message_id IN (SELECT message_id FROM stage_touched);
+
+INSERT INTO message_entities (message_id, entity_type, entity_value, created_at, updated_at)
+SELECT t.message_id, LEFT(e.entity_type, 255), LEFT(e.entity_value, 255), now(), now()
+FROM stage_entities e JOIN stage_touched t ON t.seq = e.seq;
+"""
+
+SELECT_BATCH = "SELECT created, updated, skipped FROM import_batches WHERE idempotency_key = %s"
+SELECT_ACKNOWLEDGED = "SELECT idempotency_key FROM import_batches WHERE idempotency_key = ANY(%s)"
+INSERT_BATCH = """
+INSERT INTO import_batches (idempotency_key, created, updated, skipped, created_at, updated_at)
+VALUES (%s, %s, %s, %s, now(), now())
+ON CONFLICT (idempotency_key) DO NOTHING
+"""
+
+class BulkLoader:
+    """Loads import payloads into Postgres, one transaction per `load` call"""
+
+    def __init__(self, dsn: str = DEFAULT_DSN):
+        self.conn = psycopg.connect(dsn)
+
+    def load(self, payloads: List[Dict[str, Any]], key: Optional[str] = None) -> Dict[str, Any]:
+        """Same counts as the import endpoint: created, updated and skipped.
+
+        With an idempotency key, a batch already recorded in import_batches is
+        not loaded again and its stored counts are returned with duplicate=True.
+        """
+        with self.conn.transaction(), self.conn.cursor() as cur:
+            if key:
+                cur.execute(SELECT_BATCH, (key,))
+                row = cur.fetchone()
+                if row:
+                    return {"created": row[0], "updated": row[1], "skipped": row[2], "duplicate": True}
+
+            cur.execute(STAGING_DDL)
+            staged = stage_payloads(cur, payloads)
+            cur.execute(MERGE_CHANNELS)
+            cur.execute(MERGE_SENDERS)
+            cur.execute(MERGE_MESSAGES)
+            results = [row[0] for row in cur.fetchall()]
+            cur.execute(REPLACE_ENTITIES)
+
+            created = sum(1 for inserted in results if inserted)
+            updated = len(results) - created
+            counts = {"created": created, "updated": updated, "skipped": len(payloads) - created - updated}
+            if key:
+                cur.execute(INSERT_BATCH, (key, created, updated, counts["skipped"]))
+
+        return {**counts, "staged": staged}
+
+    def record_batch(self, key: str, counts: Dict[str, int]):
+        """Remember a batch that was loaded in pieces, so a resend is answered as a duplicate"""
+        with self.conn.transaction(), self.conn.cursor() as cur:
+            cur.execute(INSERT_BATCH, (key, counts["created"], counts["updated"], counts["skipped"]))
+
+    def acknowledged(self, keys: List[str]) -> List[str]:
+        """Which of `keys` were recorded by a load or record_batch"""
+        with self.conn.transaction(), self.conn.cursor() as cur:
+            cur.execute(SELECT_ACKNOWLEDGED, (keys,))
+            return [row[0] for row in cur.fetchall()]
+
+    def close(self):
+        self.conn.close()
+
+# ---------------------------
+# Sources
+# ---------------------------
+def iter_payloads(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Payloads from archive directories (see MessageArchive) or .jsonl/.jsonl.gz/.json files"""
+    for path in paths:
+        if os.path.isdir(path):
+            archive = MessageArchive(path)
+            for _, _, folder in archive.partitions():
+                yield from archive.read_partition(folder)
+        elif path.endswith(".json"):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            yield from (data if isinstance(data, list) else [data])
+        else:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+def chunked(items: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def main():
+    parser = argparse.ArgumentParser(description="Load crawler batches into Postgres with COPY and set-based upserts")
+    parser.add_argument("paths", nargs="+", help="archive directories or payload files")
+    parser.add_argument("--dsn", default=DEFAULT_DSN, help="Postgres connection URL (env CRAWLER_DATABASE_URL)")
+    parser.add_argument("--batch", type=int, default=LOAD_BATCH_SIZE, help="payloads per transaction")
+    args = parser.parse_args()
+
+    loader = BulkLoader(args.dsn)
+    totals = {"created": 0, "updated": 0, "skipped": 0}
+    rows = 0
+    started = time.monotonic()
+    try:
+        for chunk in chunked(iter_payloads(args.paths), args.batch):
+            result = loader.load(chunk)
+            rows += len(chunk)
+            for key in totals:
+                totals[key] += result[key]
+            elapsed = time.monotonic() - started
+            logger.info(f"Loaded {rows} payloads ({rows / elapsed:.0f}/s): "
+                        + ", ".join(f"{k} {v}" for k, v in totals.items()))
+    finally:
+        loader.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,219 @@
+"""Standalone ingest service for the crawler's /api/messages/import contract.
+
+Accepts exactly what send_to_api posts (a payload object or a list of them,
+Bearer token, optional Idempotency-Key) and answers like
+MessageController::import with {"status", "created", "updated", "skipped", "failed"}.
+Each request is written with BulkLoader: COPY into staging tables and a few
+multi-row upserts, instead of several queries per message. It also answers
+/api/messages/import/acks from import_batches, like MessageController::acks.
+
+To use it, point LARAVEL_API at http://HOST:PORT/api/messages/import and
+LARAVEL_ACKS_API at http://HOST:PORT/api/messages/import/acks. The counters,
+tombstones and replies routes are not served here and stay on Laravel.
+
+    python ingest.py [--host 0.0.0.0] [--port 8081] [--dsn URL] [--connections 4] [--token TOKEN]
+
+The bearer token comes from IMPORT_TOKEN in the environment, like the
+backend's, or --token.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from bulkload import DEFAULT_DSN, BulkLoader
+
+logger = logging.getLogger(__name__)
+
+IMPORT_TOKEN = os.environ.get("IMPORT_TOKEN", "")
+INGEST_HOST = os.environ.get("INGEST_HOST", "0.0.0.0")
+INGEST_PORT = int(os.environ.get("INGEST_PORT", "8081"))
+INGEST_CONNECTIONS = 4  # Postgres connections, i.e. requests written concurrently
+MAX_BODY_BYTES = 64 * 1024 * 1024
+IMPORT_PATHS = ("/api/messages/import", "/messages/import")
+ACK_PATHS = ("/api/messages/import/acks", "/messages/import/acks")
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+           411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class IngestService:
+    """Minimal HTTP/1.1 server (keep-alive, Content-Length bodies) in front of a pool of BulkLoaders"""
+
+    def __init__(self, dsn: str = DEFAULT_DSN, connections: int = INGEST_CONNECTIONS, token: str = IMPORT_TOKEN):
+        self.dsn = dsn
+        self.token = token
+        self.loaders: asyncio.Queue = asyncio.Queue()
+        self.connections = connections
+        self.metrics = {"requests": 0, "payloads": 0, "created": 0, "updated": 0, "skipped": 0, "failed": 0}
+
+    async def start(self, host: str = INGEST_HOST, port: int = INGEST_PORT) -> asyncio.AbstractServer:
+        for _ in range(self.connections):
+            self.loaders.put_nowait(await asyncio.to_thread(BulkLoader, self.dsn))
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f"Ingest service listening on {host}:{port} with {self.connections} database connections")
+        return server
+
+    async def close(self):
+        while not self.loaders.empty():
+            self.loaders.get_nowait().close()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                if "chunked" in headers.get("transfer-encoding", "").lower():
+                    status, body = 411, {"error": "Content-Length required"}
+                    keep_alive = False
+                else:
+                    length = int(headers.get("content-length", "0") or 0)
+                    if length > MAX_BODY_BYTES:
+                        status, body = 413, {"error": "Payload too large"}
+                        keep_alive = False
+                    else:
+                        raw = await reader.readexactly(length) if length else b""
+                        status, body = await self.dispatch(method, path.split("?", 1)[0], headers, raw)
+                        keep_alive = headers.get("connection", "").lower() != "close"
+
+                data = json.dumps(body).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            logger.debug(f"Connection dropped: {e}")
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, headers: Dict[str, str], raw: bytes) -> Tuple[int, Dict[str, Any]]:
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", **self.metrics}
+        if method != "POST" or path not in IMPORT_PATHS + ACK_PATHS:
+            return 404, {"error": "Not found"}
+
+        auth = headers.get("authorization", "")
+        if not auth.startswith("Bearer ") or auth[7:] != self.token:
+            return 401, {"error": "Unauthorized"}
+
+        try:
+            payload = json.loads(raw) if raw else None
+        except json.JSONDecodeError:
+            payload = None
+        if path in ACK_PATHS:
+            keys = [k for k in payload.get("keys") or [] if isinstance(k, str)] if isinstance(payload, dict) else []
+            if not keys:
+                return 400, {"error": "Empty payload"}
+            try:
+                return 200, {"status": "ok", "acknowledged": await self.acknowledged(keys)}
+            except Exception as e:
+                logger.error(f"Ack lookup failed for {len(keys)} keys: {e}")
+                return 500, {"error": "Ack lookup failed"}
+        if not payload:
+            return 400, {"error": "Empty payload"}
+
+        # Normalize: accept single object or array
+        if isinstance(payload, dict):
+            payload = [payload]
+        try:
+            return 200, await self.import_payloads(payload, headers.get("idempotency-key"))
+        except Exception as e:
+            # Database unreachable: 5xx makes the crawler buffer the batch and retry later
+            logger.error(f"Import failed for {len(payload)} payloads: {e}")
+            return 500, {"error": "Import failed"}
+
+    async def import_payloads(self, payloads: list, key: Optional[str] = None) -> Dict[str, Any]:
+        self.metrics["requests"] += 1
+        self.metrics["payloads"] += len(payloads)
+        items = [p for p in payloads if isinstance(p, dict)]
+        loader = await self.loaders.get()
+        try:
+            result = await asyncio.to_thread(load_isolating_errors, loader, items, key)
+        finally:
+            if loader.conn.closed:
+                loader = await asyncio.to_thread(BulkLoader, self.dsn)
+            self.loaders.put_nowait(loader)
+
+        response = {"status": "ok", "created": result["created"], "updated": result["updated"],
+                    "skipped": result["skipped"] + len(payloads) - len(items), "failed": result.get("failed", 0)}
+        if result.get("duplicate"):
+            response["duplicate"] = True
+        for k in ("created", "updated", "skipped", "failed"):
+            self.metrics[k] += response[k]
+        return response
+
+    async def acknowledged(self, keys: list) -> list:
+        """The given idempotency keys that import_batches has recorded"""
+        loader = await self.loaders.get()
+        try:
+            return await asyncio.to_thread(loader.acknowledged, keys)
+        finally:
+            if loader.conn.closed:
+                loader = await asyncio.to_thread(BulkLoader, self.dsn)
+            self.loaders.put_nowait(loader)
+
+def load_isolating_errors(loader: BulkLoader, items: list, key: Optional[str] = None) -> Dict[str, Any]:
+    """Load a batch; when it fails, bisect it so only the failing payloads are left out.
+
+    The controller wraps each item in its own try/catch, so one bad message never
+    costs the rest of the request. Halves are loaded without the idempotency key,
+    which is recorded at the end only if no payload failed, so a resend retries them.
+    """
+    try:
+        return loader.load(items, key)
+    except Exception as e:
+        if loader.conn.closed:
+            raise
+        if len(items) <= 1:
+            logger.warning(f"Failed to load payload: {e}")
+            return {"created": 0, "updated": 0, "skipped": 0, "failed": len(items)}
+
+    mid = len(items) // 2
+    left = load_isolating_errors(loader, items[:mid])
+    right = load_isolating_errors(loader, items[mid:])
+    counts = {k: left.get(k, 0) + right.get(k, 0) for k in ("created", "updated", "skipped", "failed")}
+    if key and not counts["failed"]:
+        loader.record_batch(key, counts)
+    return counts
+
+async def serve(host: str, port: int, dsn: str, connections: int, token: str):
+    service = IngestService(dsn, connections, token)
+    server = await service.start(host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Bulk ingest service for the /api/messages/import contract")
+    parser.add_argument("--host", default=INGEST_HOST)
+    parser.add_argument("--port", type=int, default=INGEST_PORT)
+    parser.add_argument("--dsn", default=DEFAULT_DSN, help="Postgres connection URL (env CRAWLER_DATABASE_URL)")
+    parser.add_argument("--connections", type=int, default=INGEST_CONNECTIONS)
+    parser.add_argument("--token", default=IMPORT_TOKEN, help="bearer token of the crawler (env IMPORT_TOKEN)")
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("no token: set IMPORT_TOKEN or pass --token")
+    try:
+        asyncio.run(serve(args.host, args.port, args.dsn, args.connections, args.token))
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user")
@@ -1,21 +1,41 @@
+import argparse
 import asyncio
+import bisect
+import fcntl
+import hashlib
 import json
+import multiprocessing
 import os
+import queue
 import random
+import re
+import socket
+import sqlite3
+import threading
 import time
 import logging
+from array import array
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 import requests
 from requests.exceptions import RequestException, ConnectionError, Timeout
-from telethon import TelegramClient
+from telethon import TelegramClient, events, utils
 from telethon.errors import (
     FloodWaitError, UsernameInvalidError, UsernameNotOccupiedError,
     ChannelPrivateError, ChatAdminRequiredError, AuthKeyUnregisteredError,
-    SessionPasswordNeededError, RPCError
+    SessionPasswordNeededError, RPCError, UserDeactivatedError, UserDeactivatedBanError
 )
-from telethon.tl.types import MessageEntityHashtag, MessageEntityUrl, MessageEntityMention
+from telethon.tl.types import MessageEntityHashtag, MessageEntityUrl, MessageEntityMention, PeerChannel
+
+import metrics
+import tracing
+from archive import ARCHIVE_DIR, MessageArchive
+from recording import RecordingClient
 
 # Setup logging
 logging.basicConfig(
@@ -39,13 +59,23 @@ ACCOUNTS = [
     {"session": "anon5", "api_id": 22893596, "api_hash": "099e03188484d2041f7168abd7db8c8f"},
 ]
 LARAVEL_API = "https://api-searchkid.zakari.site/api/messages/import"
+LARAVEL_ACKS_API = "https://api-searchkid.zakari.site/api/messages/import/acks"
+LARAVEL_COUNTERS_API = "https://api-searchkid.zakari.site/api/messages/counters"
+LARAVEL_TOMBSTONES_API = "https://api-searchkid.zakari.site/api/messages/tombstones"
+LARAVEL_REPLIES_API = "https://api-searchkid.zakari.site/api/messages/replies"
 IMPORT_TOKEN = "loveyoutenthousand"
 
 # File names
 SUSPENDED_FILE = "suspended.json"
+QUARANTINED_FILE = "quarantined.json"
 FAILED_FILE = "failed_channels.json"
 LAST_ID_TEMPLATE = "last_id_{}.json"
 CHANNELS_TEMPLATE = "{}_channels.json"
+COUNTERS_TEMPLATE = "counters_{}.json"
+PHOTOS_TEMPLATE = "photos_{}.json"
+LEDGER_TEMPLATE = "ledger_{}.json"
+SWEEP_TEMPLATE = "sweep_{}.json"
+PENDING_TEMPLATE = "pending_{}.json"  # Upload batches sent but not yet reflected in last_ids
 
 # Behavior - More conservative to avoid bans
 BATCH_SIZE = 50  # Reduced from 100
@@ -58,10 +88,155 @@ MAX_DELAY_BETWEEN_MESSAGES = 0.5
 API_REQUEST_DELAY = 1.0  # Delay after each API request
 MAX_MESSAGES_PER_CHANNEL = 1000  # Limit messages per channel per run
 
+# Engagement refresh (views/forwards/replies/edits of recent messages)
+REFRESH_WINDOW = 300  # Most recent messages per channel kept for refresh
+REFRESH_MAX_AGE_DAYS = 14  # Stop refreshing messages posted before this
+REFRESH_BATCH_SIZE = 100  # Ids per get_messages call (Telegram max is 100)
+
+# Deletion sweep
+SWEEP_BATCH_SIZE = 100  # Ids per get_messages call
+SWEEP_BATCHES_PER_CHANNEL = 5  # Cursor batches per channel per sweep run
+SWEEP_PRIORITY_SIZE = 100  # Recent/popular ids checked first on every run
+
+# Gap fill
+GAP_BATCH_SIZE = 100  # Missing ids per get_messages call
+GAP_MAX_IDS_PER_CHANNEL = 500  # Missing ids fetched per channel per run
+
+# Reply threads (message_replies edges and discussion-group comments)
+REPLY_PARENT_BATCH_SIZE = 100  # Unknown parent ids per get_messages call
+COMMENTS_MAX_PER_POST = 200  # Newest comments fetched per channel post
+
+# Live ingestion (joined channels receive updates, the rest are polled)
+LIVE_FLUSH_INTERVAL = 5.0  # Max seconds an update waits before it is uploaded
+LIVE_CATCHUP_INTERVAL = 900  # Seconds between min_id catch-up polls of joined channels
+LIVE_POLL_INTERVAL = 1800  # Seconds between polls of channels the account has not joined
+LIVE_WATCHDOG_INTERVAL = 10  # Seconds between connection checks
+
+# Client pool (one connection per account, kept across crawl cycles)
+POOL_HEALTH_INTERVAL = 300  # Seconds between health pings in daemon/live mode
+POOL_RECONNECT_ATTEMPTS = 5
+POOL_RECONNECT_BASE_DELAY = 5.0  # Doubled after every failed reconnect attempt
+POOL_RECONNECT_MAX_DELAY = 300.0
+
+# Per-account pacing. Channels of one account are crawled concurrently over the
+# same connection; every Telegram request waits for the account's rate limiter.
+CHANNEL_CONCURRENCY = 3  # Channels crawled at once per account
+ACCOUNT_RPC_RATE = 2.0  # Telegram requests per second per account
+ACCOUNT_RPC_BURST = 5
+
+# Multi-process supervisor (--workers)
+SUPERVISOR_RESTART_DELAY = 10.0  # Seconds before a crashed shard is restarted
+SUPERVISOR_MAX_RESTARTS = 5  # Per shard, after which the shard stays down
+
+# Multi-node coordination (channel leases). Disabled unless a store path is set,
+# e.g. a SQLite file on a volume whose POSIX locks every node honours (see SqliteLeaseStore).
+LEASE_STORE_PATH = os.environ.get("CRAWLER_LEASE_STORE", "")
+NODE_ID = os.environ.get("CRAWLER_NODE_ID", socket.gethostname())
+LEASE_TTL = 120  # Seconds a channel lease lasts without a heartbeat
+
+# Profile photos (channel and sender avatars). Disabled unless MEDIA_PUBLIC_URL
+# is set to the URL under which MEDIA_CACHE_DIR is served.
+MEDIA_PUBLIC_URL = ""  # e.g. "https://api-searchkid.zakari.site/avatars"
+MEDIA_CACHE_DIR = "media_cache"
+MEDIA_CACHE_MAX_BYTES = 512 * 1024 * 1024  # Least recently used files are evicted above this
+MEDIA_DOWNLOAD_CONCURRENCY = 2  # Parallel photo downloads per account
+
+# Channel discovery (t.me links, @mentions and forward headers -> new channels)
+DISCOVERY_FRONTIER_FILE = "discovery_frontier.json"  # Candidate -> reference counts, shared by all accounts
+DISCOVERY_SEEN_FILE = "discovery_seen.bloom"  # Bloom filter of candidates already resolved
+DISCOVERY_FRONTIER_MAX = 50000  # Least referenced candidates are dropped above this
+DISCOVERY_BLOOM_BITS = 1 << 23  # 1 MiB, ~1% false positives at 800k names
+DISCOVERY_BLOOM_HASHES = 7
+DISCOVERY_MIN_REFS = 2  # Candidates referenced less often are not resolved yet
+DISCOVERY_RESOLVE_PER_RUN = 10  # Username resolutions per account per run (ResolveUsername is tightly limited)
+MIN_DELAY_BETWEEN_RESOLVES = 5.0
+MAX_DELAY_BETWEEN_RESOLVES = 15.0
+IDLE_BUDGET_SECONDS = 300  # Time an account may spend on low-priority work after its channels
+
+# Failed channel retries: class -> (first backoff, max backoff) in seconds, doubled per failure
+RETRY_BACKOFF = {
+    "transient": (600, 6 * 3600),  # API/RPC errors
+    "flood": (3600, 24 * 3600),
+    "not_found": (6 * 3600, 7 * 86400),
+    "private": (12 * 3600, 14 * 86400),
+}
+RETRY_RETIRE_AFTER = 5  # not_found/private failures after which a channel is retired for good
+RETRY_VALIDATIONS_PER_RUN = 10  # Failed channels re-validated per account per run
+
+# Import API backpressure. Consecutive failures open the circuit; while it is
+# open uploads go to a per-account buffer file that is replayed in order later.
+BREAKER_FAILURE_THRESHOLD = 5  # Consecutive 5xx/429/timeouts that open the circuit
+BREAKER_COOLDOWN = 30.0  # First open period, doubled on every re-open
+BREAKER_MAX_COOLDOWN = 600.0
+BREAKER_MAX_RETRY_AFTER = 3600.0  # Cap on a server supplied Retry-After
+RETRY_BUDGET_MAX = 10.0  # Retries available to all uploaders together
+RETRY_BUDGET_EARN = 0.2  # Retry tokens earned back per successful request
+UPLOAD_BUFFER_TEMPLATE = "upload_buffer_{}.jsonl"
+UPLOAD_BUFFER_MAX_BYTES = 256 * 1024 * 1024  # Beyond this uploads fail instead of buffering
+
+# Local archive of every import batch (see archive.py: ARCHIVE_DIR, CRAWLER_ARCHIVE_DIR)
+ARCHIVE_COMPACT_INTERVAL = 600  # Seconds between background compaction passes
+
+# Fixture recording of raw Telegram responses for offline replay (see recording.py).
+# Disabled unless CRAWLER_RECORD_DIR is set.
+RECORD_DIR = os.environ.get("CRAWLER_RECORD_DIR", "")
+
+# Metrics in the Prometheus text format (see metrics.py): served over HTTP in daemon
+# mode, written to a file after a one-shot run. Port 0 / '' disables either.
+METRICS_HOST = os.environ.get("CRAWLER_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("CRAWLER_METRICS_PORT", "9464"))
+METRICS_FILE = os.environ.get("CRAWLER_METRICS_FILE", "metrics.prom")
+
+# Chrome trace-event spans of the crawl stages (see tracing.py). Disabled unless
+# CRAWLER_TRACE_FILE is set; TRACE_SAMPLE is the share of channel crawls traced.
+TRACE_FILE = os.environ.get("CRAWLER_TRACE_FILE", "")
+TRACE_SAMPLE = float(os.environ.get("CRAWLER_TRACE_SAMPLE", "1.0"))
+
 # ---------------------------
 # Stats
 # ---------------------------
-stats = {"public": {"channels": 0, "messages": 0, "created": 0, "updated": 0, "errors": 0}}
+stats = {
+    "public": {"channels": 0, "messages": 0, "created": 0, "updated": 0, "errors": 0},
+    "refresh": {"channels": 0, "checked": 0, "updated": 0, "errors": 0},
+    "sweep": {"channels": 0, "checked": 0, "deleted": 0, "errors": 0},
+    "gaps": {"channels": 0, "missing": 0, "filled": 0, "absent": 0, "errors": 0},
+    "live": {"channels": 0, "messages": 0, "created": 0, "updated": 0, "errors": 0},
+}
+
+# ---------------------------
+# Metrics
+# ---------------------------
+stage_seconds = metrics.Histogram(
+    "crawler_stage_seconds", "Time spent per stage: get_entity, history_fetch (one page), transform, send_to_api",
+    ("stage", "account"))
+state_save_seconds = metrics.Histogram("crawler_state_save_seconds", "Time to write a JSON state file", ("file",))
+messages_total = metrics.Counter("crawler_messages_total", "Messages fetched from Telegram", ("account", "channel"))
+upload_bytes_total = metrics.Counter("crawler_upload_bytes_total", "Request bytes sent to the import API, retries included",
+                                     ("account", "channel"))
+flood_wait_seconds_total = metrics.Counter("crawler_flood_wait_seconds_total", "FloodWait seconds imposed by Telegram",
+                                           ("account", "channel"))
+errors_total = metrics.Counter("crawler_errors_total", "Channel and upload failures by kind", ("account", "channel", "kind"))
+api_requests_total = metrics.Counter("crawler_api_requests_total", "Import API requests by outcome", ("endpoint", "outcome"))
+channels_in_progress = metrics.Gauge("crawler_channels_in_progress", "Channels being crawled right now", ("account",))
+media_downloads_pending = metrics.Gauge("crawler_media_downloads_pending", "Profile photo downloads queued", ("account",))
+
+def _per_account(value: Callable[[str], float]) -> Dict[tuple, float]:
+    return {(a["session"],): value(a["session"]) for a in ACCOUNTS}
+
+def _buffer_bytes(session_name: str) -> float:
+    path = UPLOAD_BUFFER_TEMPLATE.format(session_name)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+metrics.Gauge("crawler_rpc_queue_depth", "Telegram requests waiting for the account's rate limiter", ("account",),
+              callback=lambda: {(name,): limiter.waiting for name, limiter in client_pool.limiters.items()})
+metrics.Gauge("crawler_upload_buffer_bytes", "Uploads buffered on disk while the import API is unavailable",
+              ("account",), callback=lambda: _per_account(_buffer_bytes))
+metrics.Gauge("crawler_pending_upload_batches", "Batches sent but not yet reflected in last_ids", ("account",),
+              callback=lambda: _per_account(lambda s: len(load_pending_for(s))))
+metrics.Gauge("crawler_account_suspended_seconds", "Remaining FloodWait suspension of the account", ("account",),
+              callback=lambda: _per_account(lambda s: max(0.0, load_suspended().get(s, 0) - now_ts())))
+metrics.Gauge("crawler_api_circuit_open", "1 while the import API circuit breaker is open",
+              callback=lambda: {(): 0 if upload_breaker.available() else 1})
 
 # ---------------------------
 # JSON helpers with better error handling
@@ -81,15 +256,26 @@ def load_json(path: str, default: Any):
         logger.error(f"Error loading {path}: {e}")
     return default
 
+@contextmanager
+def file_lock(path: str):
+    """Exclusive inter-process lock for read-modify-write of a shared state file"""
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def save_json(path: str, data: Any):
     try:
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(path) if os.path.dirname(path) else '.', exist_ok=True)
         
         tmp = path + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        os.replace(tmp, path)
+        with state_save_seconds.time(file=os.path.basename(path)), tracing.span("save_json", "state", file=path):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, path)
         logger.debug(f"Saved data to {path}")
     except Exception as e:
         logger.error(f"Error saving to {path}: {e}")
@@ -114,6 +300,13 @@ def is_account_suspended(session_name: str) -> tuple[bool, float]:
         return True, suspended_until
     return False, 0
 
+def load_quarantined() -> Dict[str, Dict[str, Any]]:
+    """Accounts with auth problems. Entries are only removed by hand once the session is fixed."""
+    return load_json(QUARANTINED_FILE, {})
+
+def save_quarantined(data: Dict[str, Dict[str, Any]]):
+    save_json(QUARANTINED_FILE, data)
+
 # ---------------------------
 # Per-account helpers
 # ---------------------------
@@ -125,9 +318,156 @@ def save_last_ids_for(session_name: str, data: Dict[str, int]):
     path = LAST_ID_TEMPLATE.format(session_name)
     save_json(path, data)
 
+def load_counters_for(session_name: str) -> Dict[str, Dict[str, List]]:
+    path = COUNTERS_TEMPLATE.format(session_name)
+    return load_json(path, {})
+
+def save_counters_for(session_name: str, data: Dict[str, Dict[str, List]]):
+    path = COUNTERS_TEMPLATE.format(session_name)
+    save_json(path, data)
+
+def load_photos_for(session_name: str) -> Dict[str, List]:
+    path = PHOTOS_TEMPLATE.format(session_name)
+    return load_json(path, {})
+
+def save_photos_for(session_name: str, data: Dict[str, List]):
+    path = PHOTOS_TEMPLATE.format(session_name)
+    save_json(path, data)
+
+def load_ledger_for(session_name: str) -> Dict[str, Dict[str, List[List[int]]]]:
+    path = LEDGER_TEMPLATE.format(session_name)
+    return load_json(path, {})
+
+def save_ledger_for(session_name: str, data: Dict[str, Dict[str, List[List[int]]]]):
+    path = LEDGER_TEMPLATE.format(session_name)
+    save_json(path, data)
+
+def load_sweep_for(session_name: str) -> Dict[str, Dict[str, int]]:
+    path = SWEEP_TEMPLATE.format(session_name)
+    return load_json(path, {})
+
+def save_sweep_for(session_name: str, data: Dict[str, Dict[str, int]]):
+    path = SWEEP_TEMPLATE.format(session_name)
+    save_json(path, data)
+
+def load_pending_for(session_name: str) -> Dict[str, Dict[str, Any]]:
+    path = PENDING_TEMPLATE.format(session_name)
+    return load_json(path, {})
+
+def save_pending_for(session_name: str, data: Dict[str, Dict[str, Any]]):
+    path = PENDING_TEMPLATE.format(session_name)
+    save_json(path, data)
+
 # ---------------------------
 # Failed channels management
 # ---------------------------
+PERMANENT_CLASSES = ("not_found", "private")
+
+def failure_class(reason: str) -> str:
+    if reason.startswith("flood_"):
+        return "flood"
+    if reason in ("channel_private", "admin_required"):
+        return "private"
+    if reason.startswith(("username_error", "entity_not_found", "no_username")) or reason == "not_found" \
+            or reason.startswith("value_error: No user has"):
+        return "not_found"
+    return "transient"
+
+def retry_delay(cls: str, failures: int) -> float:
+    base, cap = RETRY_BACKOFF[cls]
+    return min(cap, base * 2 ** max(0, failures - 1)) * random.uniform(0.8, 1.2)
+
+def normalize_failed(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill retry fields of entries written before the scheduler existed; they are due at once"""
+    item.setdefault("class", failure_class(item.get("reason", "")))
+    item.setdefault("failures", 1)
+    item.setdefault("next_retry", 0)
+    return item
+
+def parked_channels() -> set:
+    """Usernames kept out of the normal rotation until they re-validate"""
+    return {f.get("username") for f in load_json(FAILED_FILE, [])}
+
+def record_failed_channels(failed_local: List[Dict[str, Any]]):
+    """Merge channel failures into the failed file and schedule their next retry"""
+    with file_lock(FAILED_FILE):
+        global_failed = {f.get("username"): normalize_failed(f) for f in load_json(FAILED_FILE, [])}
+        for f in failed_local:
+            cls = failure_class(f.get("reason", ""))
+            entry = global_failed.get(f["username"])
+            if entry is None:
+                entry = global_failed[f["username"]] = {**f, "class": cls, "failures": 0, "first_failed": int(now_ts())}
+            entry.update({"reason": f.get("reason"), "class": cls, "failures": entry["failures"] + 1})
+            entry["next_retry"] = int(now_ts() + retry_delay(cls, entry["failures"]))
+            if cls in PERMANENT_CLASSES and entry["failures"] >= RETRY_RETIRE_AFTER:
+                entry["retired"] = True
+        save_failed_channels(list(global_failed.values()))
+
+async def revalidate_failed_channels(
+    client: TelegramClient,
+    session_name: str,
+    channels: List[Dict[str, Any]],
+    deadline: float,
+) -> Dict[str, int]:
+    """Cheaply re-check due failed channels of this account (entity lookup plus
+    one message). Channels that pass go back into rotation."""
+    report = {"revalidated": 0, "restored": 0, "retired": 0}
+    own = {ch["username"] for ch in channels}
+
+    # Claim due entries by pushing their retry time out, so no other worker picks them
+    with file_lock(FAILED_FILE):
+        failed = [normalize_failed(f) for f in load_json(FAILED_FILE, [])]
+        due = [f for f in failed if f.get("username") in own and not f.get("retired") and f["next_retry"] <= now_ts()]
+        due.sort(key=lambda f: f["next_retry"])
+        due = due[:RETRY_VALIDATIONS_PER_RUN]
+        for f in due:
+            f["next_retry"] = int(now_ts() + retry_delay(f["class"], f["failures"]))
+        if due:
+            save_failed_channels(failed)
+
+    outcomes: Dict[str, Optional[str]] = {}
+    try:
+        for f in due:
+            if now_ts() >= deadline:
+                break
+            await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_RESOLVES, MAX_DELAY_BETWEEN_RESOLVES))
+            try:
+                entity = await client.get_entity(f["username"])
+                await client.get_messages(entity, limit=1)
+                outcomes[f["username"]] = None
+            except FloodWaitError:
+                raise
+            except Exception as e:
+                result = telegram_error_report(e, session_name, f["username"])
+                if result["status"] == "auth_error":
+                    break
+                outcomes[f["username"]] = result.get("reason", result["status"])
+    finally:
+        with file_lock(FAILED_FILE):
+            kept = []
+            for f in (normalize_failed(f) for f in load_json(FAILED_FILE, [])):
+                username = f.get("username")
+                if username not in outcomes:
+                    kept.append(f)
+                    continue
+                report["revalidated"] += 1
+                reason = outcomes[username]
+                if reason is None:
+                    report["restored"] += 1
+                    logger.info(f"[{session_name}] {username} re-validated after {f['failures']} failures, back in rotation")
+                    continue
+                cls = failure_class(reason)
+                f.update({"reason": reason, "class": cls, "failures": f["failures"] + 1})
+                f["next_retry"] = int(now_ts() + retry_delay(cls, f["failures"]))
+                if cls in PERMANENT_CLASSES and f["failures"] >= RETRY_RETIRE_AFTER:
+                    f["retired"] = True
+                    report["retired"] += 1
+                    logger.warning(f"[{session_name}] {username} retired after {f['failures']} failures: {reason}")
+                kept.append(f)
+            save_failed_channels(kept)
+
+    return report
+
 def save_failed_channels(failed: List[Dict[str, Any]]):
     if failed:
         # Remove duplicates based on username
@@ -175,6 +515,77 @@ def sanitize_text(text: str) -> str:
     # Remove null bytes and control characters except newlines and tabs
     return ''.join(char for char in text if ord(char) >= 32 or char in '\n\t\r')
 
+# ---------------------------
+# Message id ranges ([[start, end], ...], sorted, inclusive)
+# ---------------------------
+def ranges_add(ranges: List[List[int]], ids) -> List[List[int]]:
+    spans = sorted([list(r) for r in ranges] + [[i, i] for i in ids])
+    merged: List[List[int]] = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def ranges_remove(ranges: List[List[int]], ids) -> List[List[int]]:
+    result = [list(r) for r in ranges]
+    for i in sorted(set(ids)):
+        pos = bisect.bisect_right(result, [i, float("inf")]) - 1
+        if pos < 0 or not (result[pos][0] <= i <= result[pos][1]):
+            continue
+        start, end = result[pos]
+        pieces = [p for p in ([start, i - 1], [i + 1, end]) if p[0] <= p[1]]
+        result[pos:pos + 1] = pieces
+    return result
+
+def ranges_contains(ranges: List[List[int]], i: int) -> bool:
+    pos = bisect.bisect_right(ranges, [i, float("inf")]) - 1
+    return pos >= 0 and ranges[pos][0] <= i <= ranges[pos][1]
+
+def ranges_ids_below(ranges: List[List[int]], cursor: int, limit: int) -> List[int]:
+    """Up to `limit` ids strictly below `cursor`, newest first"""
+    ids: List[int] = []
+    for start, end in reversed(ranges):
+        if start >= cursor:
+            continue
+        i = min(end, cursor - 1)
+        while i >= start and len(ids) < limit:
+            ids.append(i)
+            i -= 1
+        if len(ids) >= limit:
+            break
+    return ids
+
+def ranges_missing(covered: List[List[int]], lo: int, hi: int, limit: int) -> List[int]:
+    """Up to `limit` ids in [lo, hi] not covered by `covered`, newest first"""
+    ids: List[int] = []
+    i = hi
+    for start, end in reversed(covered):
+        if end < lo:
+            break
+        while i > end and i >= lo and len(ids) < limit:
+            ids.append(i)
+            i -= 1
+        i = min(i, start - 1)
+        if len(ids) >= limit:
+            return ids
+    while i >= lo and len(ids) < limit:
+        ids.append(i)
+        i -= 1
+    return ids
+
+def ledger_for_channel(ledger: Dict[str, Dict[str, List[List[int]]]], username: str, last_id: int) -> Dict[str, List[List[int]]]:
+    """Ledger entry of known (uploaded) and absent (deleted) ids for a channel.
+
+    Channels crawled before the ledger existed are seeded with [1, last_id] as known.
+    """
+    entry = ledger.get(username)
+    if entry is None:
+        entry = {"known": [[1, last_id]] if last_id > 0 else [], "absent": []}
+        ledger[username] = entry
+    return entry
+
 # ---------------------------
 # Load channels with validation
 # ---------------------------
@@ -199,6 +610,932 @@ def load_account_channels(session_name: str) -> List[Dict[str, Any]]:
     logger.info(f"Loaded {len(valid_channels)} valid channels for {session_name}")
     return valid_channels
 
+# ---------------------------
+# Message transform
+# ---------------------------
+def get_message_text(msg) -> str:
+    text = getattr(msg, "text", getattr(msg, "message", "")) or ""
+    return sanitize_text(text)
+
+def text_hash(text: str) -> str:
+    """Short stable fingerprint of message text, used to detect edits"""
+    return hashlib.blake2b(text.encode("utf-8", "replace"), digest_size=8).hexdigest()
+
+def extract_entities(msg, text: str) -> List[Dict[str, str]]:
+    ent_list = []
+    if getattr(msg, "entities", None) and text:
+        for ent in msg.entities:
+            try:
+                start_pos = getattr(ent, 'offset', 0)
+                length = getattr(ent, 'length', 0)
+
+                if 0 <= start_pos < len(text) and start_pos + length <= len(text):
+                    entity_text = text[start_pos:start_pos + length]
+
+                    if isinstance(ent, MessageEntityHashtag):
+                        ent_list.append({"entity_type": "hashtag", "entity_value": entity_text})
+                    elif isinstance(ent, MessageEntityUrl):
+                        ent_list.append({"entity_type": "url", "entity_value": entity_text})
+                    elif isinstance(ent, MessageEntityMention):
+                        ent_list.append({"entity_type": "mention", "entity_value": entity_text})
+            except Exception as e:
+                logger.debug(f"Entity extraction error: {e}")
+                continue
+    return ent_list
+
+def detect_message_type(msg) -> str:
+    mtype = "text"
+    try:
+        if getattr(msg, "photo", None):
+            mtype = "photo"
+        elif getattr(msg, "video", None):
+            mtype = "video"
+        elif getattr(msg, "document", None):
+            doc = msg.document
+            if hasattr(doc, 'mime_type'):
+                mime = doc.mime_type or ""
+                if mime.startswith('audio/'):
+                    mtype = "audio"
+                elif mime.startswith('video/'):
+                    mtype = "video"
+                else:
+                    mtype = "document"
+            else:
+                mtype = "document"
+        elif getattr(msg, "voice", None):
+            mtype = "voice"
+        elif getattr(msg, "audio", None):
+            mtype = "audio"
+        elif getattr(msg, "sticker", None):
+            mtype = "sticker"
+    except Exception:
+        mtype = "text"
+    return mtype
+
+MESSAGE_TYPES = ("text", "photo", "video", "document", "audio", "voice", "sticker")
+MESSAGE_TYPE_CODES = {t: i for i, t in enumerate(MESSAGE_TYPES)}
+
+def channel_payload(entity, is_adults: bool, media: Optional["MediaStage"] = None) -> Dict[str, Any]:
+    return {
+        "telegram_id": getattr(entity, "id", None),
+        "title": getattr(entity, "title", None),
+        "username": getattr(entity, "username", None),
+        "type": entity.__class__.__name__ if entity else None,
+        "is_private": False,
+        "is_adults": is_adults,
+        "description": getattr(entity, "about", None) if hasattr(entity, "about") else None,
+        "members_count": getattr(entity, "participants_count", None) if hasattr(entity, "participants_count") else None,
+        "photo_url": media.photo_url(entity) if media else None
+    }
+
+class MessageBatch:
+    """Compact column store for one page of converted messages.
+
+    Numeric fields live in typed arrays, message_type is a one-byte code into
+    MESSAGE_TYPES and sender details are stored once per sender. Telethon
+    objects are not referenced after `add`; import payloads are only built
+    when the batch is uploaded.
+    """
+    __slots__ = ("ids", "types", "views", "forwards", "replies", "posted", "edited", "reply_to",
+                 "comment_groups", "sender_ids", "texts", "entities", "forward_from", "senders")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.types = array("B")
+        self.views = array("q")
+        self.forwards = array("q")
+        self.replies = array("q")
+        self.posted = array("q")  # Unix seconds, 0 if unknown
+        self.edited = array("q")
+        self.reply_to = array("q")  # Parent id in the same chat, 0 if none
+        self.comment_groups = array("q")  # Discussion group id if the post has comments, else 0
+        self.sender_ids = array("q")
+        self.texts: List[str] = []
+        self.entities: List[tuple] = []  # ((entity_type, entity_value), ...) per message
+        self.forward_from: List[Optional[str]] = []
+        self.senders: Dict[int, tuple] = {}  # sender id -> (username, display_name, is_bot, photo_url)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, msg, media: Optional["MediaStage"] = None):
+        text = get_message_text(msg)
+        entities = tuple((e["entity_type"], e["entity_value"]) for e in extract_entities(msg, text))
+        msg_date = getattr(msg, "date", None)
+        edit_date = getattr(msg, "edit_date", None)
+        sender_id = int(getattr(msg, "sender_id", 0) or 0)
+        sender = getattr(msg, "sender", None)
+        fwd_chat = getattr(getattr(msg, "forward", None), "chat", None)
+
+        if sender is not None or sender_id not in self.senders:
+            self.senders[sender_id] = (
+                getattr(sender, "username", None) if sender else None,
+                getattr(sender, "first_name", None) if sender else None,
+                bool(getattr(sender, "bot", False)) if sender else False,
+                media.photo_url(sender) if media and sender else None,
+            )
+
+        self.ids.append(msg.id)
+        self.types.append(MESSAGE_TYPE_CODES[detect_message_type(msg)])
+        self.views.append(int(getattr(msg, "views", 0) or 0))
+        self.forwards.append(int(getattr(msg, "forwards", 0) or 0))
+        self.replies.append(get_replies_count(msg))
+        self.posted.append(int(msg_date.timestamp()) if msg_date else 0)
+        self.edited.append(int(edit_date.timestamp()) if edit_date else 0)
+        self.reply_to.append(reply_parent_id(msg) or 0)
+        self.comment_groups.append(msg.replies.channel_id if has_comments(msg) else 0)
+        self.sender_ids.append(sender_id)
+        self.texts.append(text[:10000])  # Limit text length
+        self.entities.append(entities)
+        self.forward_from.append(getattr(fwd_chat, "username", None))
+
+    def sort(self):
+        """Order messages by id, oldest first"""
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        for name in self.__slots__[:-1]:
+            column = getattr(self, name)
+            reordered = [column[i] for i in order]
+            setattr(self, name, array(column.typecode, reordered) if isinstance(column, array) else reordered)
+
+    def payloads(self, entity, is_adults: bool, media: Optional["MediaStage"] = None) -> List[Dict[str, Any]]:
+        """The /messages/import items of the batch; the channel part is shared"""
+        channel = channel_payload(entity, is_adults, media)
+        username = getattr(entity, "username", None)
+        items = []
+        for i, msg_id in enumerate(self.ids):
+            sender_id = self.sender_ids[i]
+            s_username, s_name, s_bot, s_photo = self.senders[sender_id]
+            items.append({
+                "message": {
+                    "telegram_id": msg_id,
+                    "message_type": MESSAGE_TYPES[self.types[i]],
+                    "content_text": self.texts[i],
+                    "media_file_path": f"https://t.me/{username}/{msg_id}" if username else None,
+                    "views": self.views[i],
+                    "forwards": self.forwards[i],
+                    "replies_count": self.replies[i],
+                    "posted_at": str(datetime.fromtimestamp(self.posted[i], timezone.utc)) if self.posted[i] else None,
+                },
+                "channel": channel,
+                "sender": {
+                    "telegram_id": sender_id,
+                    "username": s_username,
+                    "display_name": s_name,
+                    "is_bot": s_bot,
+                    "photo_url": s_photo,
+                },
+                "entities": [{"entity_type": t, "entity_value": v} for t, v in self.entities[i]],
+            })
+        return items
+
+    def counters_row(self, i: int) -> List:
+        """Same row as counters_entry() for message i"""
+        return [self.views[i], self.forwards[i], self.replies[i], self.edited[i],
+                text_hash(self.texts[i]), self.posted[i]]
+
+    def reply_edges(self) -> List[Dict[str, int]]:
+        return [{"telegram_id": msg_id, "reply_to_id": parent}
+                for msg_id, parent in zip(self.ids, self.reply_to) if parent]
+
+    def threads(self) -> List[tuple[int, int]]:
+        """(post id, discussion group id) of posts with comments"""
+        return [(msg_id, group) for msg_id, group in zip(self.ids, self.comment_groups) if group]
+
+def build_payload(msg, entity, is_adults: bool, media: Optional["MediaStage"] = None) -> Dict[str, Any]:
+    """Build the /messages/import item for a single Telethon message"""
+    batch = MessageBatch()
+    batch.add(msg, media)
+    return batch.payloads(entity, is_adults, media)[0]
+
+def telegram_error_report(e: Exception, session_name: str, username: str) -> Dict[str, Any]:
+    """Map a Telethon/lookup exception to a channel report"""
+    report = _telegram_error_report(e, session_name, username)
+    errors_total.inc(account=session_name, channel=username, kind=report["status"])
+    if report["status"] == "flood":
+        flood_wait_seconds_total.inc(report["seconds"], account=session_name, channel=username)
+    return report
+
+def _telegram_error_report(e: Exception, session_name: str, username: str) -> Dict[str, Any]:
+    if isinstance(e, FloodWaitError):
+        secs = int(getattr(e, "seconds", 3600))
+        logger.warning(f"[{session_name}] FloodWait {secs}s for {username}")
+        return {"status": "flood", "seconds": secs}
+
+    if isinstance(e, (UsernameInvalidError, UsernameNotOccupiedError)):
+        return {"status": "not_found", "reason": f"username_error: {str(e)[:100]}"}
+
+    if isinstance(e, ChannelPrivateError):
+        return {"status": "not_found", "reason": "channel_private"}
+
+    if isinstance(e, ChatAdminRequiredError):
+        return {"status": "not_found", "reason": "admin_required"}
+
+    if isinstance(e, AuthKeyUnregisteredError):
+        return {"status": "auth_error", "reason": "auth_key_unregistered"}
+
+    if isinstance(e, (UserDeactivatedError, UserDeactivatedBanError)):
+        return {"status": "auth_error", "reason": "user_deactivated"}
+
+    if isinstance(e, RPCError):
+        return {"status": "rpc_error", "reason": f"rpc: {str(e)[:100]}"}
+
+    if isinstance(e, ValueError):
+        msg = str(e)
+        if "No user has" in msg or "Username not found" in msg:
+            return {"status": "not_found", "reason": f"value_error: {msg[:100]}"}
+        return {"status": "error", "reason": f"value_error: {msg[:100]}"}
+
+    logger.error(f"Unexpected error for {username}: {e}")
+    return {"status": "error", "reason": f"unexpected: {str(e)[:100]}"}
+
+# ---------------------------
+# Engagement counters snapshot
+# ---------------------------
+def counters_entry(msg, content_text: str) -> List:
+    """Compact snapshot row: [views, forwards, replies, edit_ts, text_hash, posted_ts]"""
+    edit_date = getattr(msg, "edit_date", None)
+    msg_date = getattr(msg, "date", None)
+    return [
+        int(getattr(msg, "views", 0) or 0),
+        int(getattr(msg, "forwards", 0) or 0),
+        get_replies_count(msg),
+        int(edit_date.timestamp()) if edit_date else 0,
+        text_hash(content_text),
+        int(msg_date.timestamp()) if msg_date else 0,
+    ]
+
+def prune_counters(snapshot: Dict[str, List]) -> Dict[str, List]:
+    """Keep only the newest REFRESH_WINDOW messages that are younger than REFRESH_MAX_AGE_DAYS"""
+    oldest = now_ts() - REFRESH_MAX_AGE_DAYS * 86400
+    ids = sorted((int(k) for k, v in snapshot.items() if v[5] >= oldest), reverse=True)
+    return {str(i): snapshot[str(i)] for i in ids[:REFRESH_WINDOW]}
+
+def counters_delta(msg, old: List) -> tuple[Optional[Dict[str, Any]], List]:
+    """Compare a re-read message with its snapshot row. Returns (delta or None, new row)."""
+    row = counters_entry(msg, "")
+    row[4] = old[4]
+    delta = {"telegram_id": msg.id}
+
+    for idx, field in enumerate(("views", "forwards", "replies_count")):
+        if row[idx] != old[idx]:
+            delta[field] = row[idx]
+
+    # Only re-read text when Telegram says the message was edited
+    if row[3] != old[3]:
+        text = get_message_text(msg)[:10000]
+        row[4] = text_hash(text)
+        if row[4] != old[4]:
+            delta["content_text"] = text
+            delta["entities"] = extract_entities(msg, text)
+
+    return (delta if len(delta) > 1 else None), row
+
+def remember_uploaded(
+    username: str,
+    payloads: List[Dict[str, Any]],
+    batch_counters: Dict[str, List],
+    last_id: int,
+    counters: Optional[Dict[str, Dict[str, List]]],
+    ledger: Optional[Dict[str, Dict[str, List[List[int]]]]],
+):
+    """Record an acknowledged upload in the counters snapshot and the known-id ledger"""
+    if counters is not None:
+        snapshot = counters.setdefault(username, {})
+        snapshot.update(batch_counters)
+        counters[username] = prune_counters(snapshot)
+
+    if ledger is not None:
+        entry = ledger_for_channel(ledger, username, last_id)
+        entry["known"] = ranges_add(entry["known"], (p["message"]["telegram_id"] for p in payloads))
+
+async def refresh_channel_counters(
+    client: TelegramClient,
+    session_name: str,
+    channel: Dict[str, Any],
+    counters: Dict[str, Dict[str, List]],
+) -> Dict[str, Any]:
+    """Re-read counters for the recent window of a channel and upload only what changed"""
+    username = channel.get("username", "").strip().lstrip('@')
+    snapshot = prune_counters(counters.get(username) or {})
+    report = {"status": "ok", "checked": 0, "updated": 0}
+
+    if not snapshot:
+        return report
+
+    try:
+        await asyncio.sleep(random.uniform(0.5, 1.5))
+        entity = await client.get_entity(username)
+
+        ids = sorted((int(k) for k in snapshot), reverse=True)
+        logger.info(f"[{session_name}] Refreshing {len(ids)} messages of {username}")
+
+        for start in range(0, len(ids), REFRESH_BATCH_SIZE):
+            chunk = ids[start:start + REFRESH_BATCH_SIZE]
+            await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_MESSAGES, MAX_DELAY_BETWEEN_MESSAGES))
+
+            msgs = await client.get_messages(entity, ids=chunk)
+            deltas = []
+            rows = {}
+            threads = []
+            for msg_id, msg in zip(chunk, msgs):
+                # Deleted messages come back as None; they are left for the sweep
+                if msg is None or getattr(msg, "date", None) is None:
+                    continue
+                delta, row = counters_delta(msg, snapshot[str(msg_id)])
+                rows[str(msg_id)] = row
+                if delta:
+                    deltas.append(delta)
+                    if "replies_count" in delta and has_comments(msg):
+                        threads.append((msg.id, msg.replies.channel_id))
+
+            if deltas:
+                updated = await send_counters_to_api(entity.id, deltas, username)
+                if updated is None:
+                    counters[username] = snapshot
+                    return {"status": "error", "reason": "api_error", **report}
+                report["updated"] += updated
+                await asyncio.sleep(API_REQUEST_DELAY)
+
+            # New comments since the last pass
+            if threads:
+                await crawl_comments(client, session_name, entity, threads, bool(channel.get("is_adults", False)))
+
+            snapshot.update(rows)
+            report["checked"] += len(chunk)
+
+        counters[username] = snapshot
+        return report
+
+    except Exception as e:
+        counters[username] = snapshot
+        return telegram_error_report(e, session_name, username)
+
+# ---------------------------
+# Deletion sweep
+# ---------------------------
+async def sweep_channel(
+    client: TelegramClient,
+    session_name: str,
+    channel: Dict[str, Any],
+    ledger: Dict[str, Dict[str, List[List[int]]]],
+    cursors: Dict[str, Dict[str, int]],
+    counters: Dict[str, Dict[str, List]],
+) -> Dict[str, Any]:
+    """Check known ids of a channel by id and send tombstones for deleted ones.
+
+    Recent/popular ids from the counters snapshot are checked first, then the
+    per-channel cursor walks down through the known ids, wrapping to the newest
+    id once the oldest one has been checked.
+    """
+    username = channel.get("username", "").strip().lstrip('@')
+    entry = ledger.get(username)
+    report = {"status": "ok", "checked": 0, "deleted": 0}
+
+    if not entry or not entry["known"]:
+        return report
+
+    state = cursors.setdefault(username, {"cursor": 0, "passes": 0})
+    snapshot = counters.get(username) or {}
+
+    # (ids, cursor after the batch or None for the priority batch)
+    plan: List[tuple[List[int], Optional[int]]] = []
+    hot = sorted(snapshot, key=lambda k: (snapshot[k][0], int(k)), reverse=True)[:SWEEP_PRIORITY_SIZE]
+    hot = [int(k) for k in hot if ranges_contains(entry["known"], int(k))]
+    if hot:
+        plan.append((hot, None))
+
+    cursor = state["cursor"] or entry["known"][-1][1] + 1
+    for _ in range(SWEEP_BATCHES_PER_CHANNEL):
+        ids = ranges_ids_below(entry["known"], cursor, SWEEP_BATCH_SIZE)
+        if not ids:
+            # Whole corpus checked: next run starts a new pass from the newest id
+            plan.append(([], 0))
+            break
+        cursor = ids[-1]
+        plan.append((ids, cursor))
+
+    try:
+        await asyncio.sleep(random.uniform(0.5, 1.5))
+        entity = await client.get_entity(username)
+
+        for ids, next_cursor in plan:
+            if ids:
+                await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_MESSAGES, MAX_DELAY_BETWEEN_MESSAGES))
+                msgs = await client.get_messages(entity, ids=ids)
+                gone = [msg_id for msg_id, msg in zip(ids, msgs) if msg is None]
+
+                if gone:
+                    deleted = await send_tombstones_to_api(entity.id, gone, username)
+                    if deleted is None:
+                        return {"status": "error", "reason": "api_error", **report}
+                    entry["known"] = ranges_remove(entry["known"], gone)
+                    entry["absent"] = ranges_add(entry["absent"], gone)
+                    for msg_id in gone:
+                        snapshot.pop(str(msg_id), None)
+                    report["deleted"] += len(gone)
+                    await asyncio.sleep(API_REQUEST_DELAY)
+
+                report["checked"] += len(ids)
+
+            if next_cursor is not None:
+                if next_cursor == 0:
+                    state["passes"] += 1
+                    logger.info(f"[{session_name}] Sweep pass {state['passes']} of {username} complete")
+                state["cursor"] = next_cursor
+
+        return report
+
+    except Exception as e:
+        return telegram_error_report(e, session_name, username)
+
+# ---------------------------
+# Gap detection and fill
+# ---------------------------
+def find_gaps(entry: Dict[str, List[List[int]]], last_id: int, limit: int) -> List[int]:
+    """Ids between the oldest uploaded id and last_id that were neither uploaded nor found absent"""
+    if not entry or not entry["known"]:
+        return []
+    covered = ranges_add(entry["known"] + entry["absent"], ())
+    return ranges_missing(covered, entry["known"][0][0], max(last_id, entry["known"][-1][1]), limit)
+
+def contiguous_id(entry: Dict[str, List[List[int]]], last_id: int) -> int:
+    """Highest id such that every id above last_id up to it was uploaded or found absent"""
+    for start, end in ranges_add(entry["known"] + entry["absent"], ()):
+        if start <= last_id + 1 <= end:
+            return end
+    return last_id
+
+async def upload_ids(
+    client: TelegramClient,
+    session_name: str,
+    entity: Any,
+    username: str,
+    is_adults: bool,
+    ids: List[int],
+    entry: Dict[str, List[List[int]]],
+    report: Dict[str, Any],
+) -> bool:
+    """Fetch `ids` by id and upload them, recording uploaded and absent ids in the
+    ledger entry and counting them in report["filled"] / report["absent"].
+    False on an API error."""
+    for start in range(0, len(ids), GAP_BATCH_SIZE):
+        chunk = ids[start:start + GAP_BATCH_SIZE]
+        await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_MESSAGES, MAX_DELAY_BETWEEN_MESSAGES))
+
+        msgs = await client.get_messages(entity, ids=chunk)
+        payloads = []
+        absent = []
+        for msg_id, msg in zip(chunk, msgs):
+            if msg is None:
+                absent.append(msg_id)
+                continue
+            try:
+                payloads.append(build_payload(msg, entity, is_adults))
+            except Exception as e:
+                # Left in the gap list; retried on the next run
+                logger.warning(f"Error processing message {msg_id}: {e}")
+
+        if payloads:
+            created, _ = await send_to_api(payloads, session_name, username)
+            if created is None:
+                return False
+            entry["known"] = ranges_add(entry["known"], (p["message"]["telegram_id"] for p in payloads))
+            report["filled"] += len(payloads)
+            await asyncio.sleep(API_REQUEST_DELAY)
+
+        if absent:
+            entry["absent"] = ranges_add(entry["absent"], absent)
+            report["absent"] += len(absent)
+
+    return True
+
+async def fill_channel_gaps(
+    client: TelegramClient,
+    session_name: str,
+    channel: Dict[str, Any],
+    last_ids: Dict[str, int],
+    ledger: Dict[str, Dict[str, List[List[int]]]],
+) -> Dict[str, Any]:
+    """Fetch only the missing ids of a channel by id and upload them"""
+    username = channel.get("username", "").strip().lstrip('@')
+    is_adults = bool(channel.get("is_adults", False))
+    entry = ledger.get(username)
+    missing = find_gaps(entry, int(last_ids.get(username, 0) or 0), GAP_MAX_IDS_PER_CHANNEL)
+    report = {"status": "ok", "missing": len(missing), "filled": 0, "absent": 0}
+
+    if not missing:
+        return report
+
+    try:
+        await asyncio.sleep(random.uniform(0.5, 1.5))
+        entity = await client.get_entity(username)
+        logger.info(f"[{session_name}] Filling {len(missing)} missing ids of {username}")
+
+        if not await upload_ids(client, session_name, entity, username, is_adults, missing, entry, report):
+            return {"status": "error", "reason": "api_error", **report}
+        return report
+
+    except Exception as e:
+        return telegram_error_report(e, session_name, username)
+
+# ---------------------------
+# Reply threads
+# ---------------------------
+def reply_parent_id(msg) -> Optional[int]:
+    """Id of the message `msg` replies to, when that message is in the same chat"""
+    header = getattr(msg, "reply_to", None)
+    if header is None or getattr(header, "reply_to_peer_id", None) is not None:
+        return None
+    return getattr(header, "reply_to_msg_id", None)
+
+async def fetch_reply_parents(
+    client: TelegramClient,
+    entity,
+    is_adults: bool,
+    ids: List[int],
+    media: Optional["MediaStage"] = None,
+) -> List[Dict[str, Any]]:
+    """Fetch reply parents by id, REPLY_PARENT_BATCH_SIZE per request. Deleted parents are skipped."""
+    payloads = []
+    for start in range(0, len(ids), REPLY_PARENT_BATCH_SIZE):
+        msgs = await client.get_messages(entity, ids=ids[start:start + REPLY_PARENT_BATCH_SIZE])
+        for msg in msgs:
+            if msg is None or getattr(msg, "date", None) is None:
+                continue
+            try:
+                payloads.append(build_payload(msg, entity, is_adults, media))
+            except Exception as e:
+                logger.warning(f"Error processing parent message {getattr(msg, 'id', 'unknown')}: {e}")
+    return payloads
+
+def has_comments(msg) -> bool:
+    replies = getattr(msg, "replies", None)
+    return bool(replies and getattr(replies, "comments", False)
+                and getattr(replies, "replies", 0) and getattr(replies, "channel_id", None))
+
+async def crawl_thread(
+    client: TelegramClient,
+    session_name: str,
+    entity,
+    group,
+    post_id: int,
+    is_adults: bool,
+    media: Optional["MediaStage"] = None,
+) -> Optional[tuple[int, int]]:
+    """Upload one post's comments and their reply edges. Returns (comments, replies linked), or None on API error"""
+    await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_MESSAGES, MAX_DELAY_BETWEEN_MESSAGES))
+    comments = [c async for c in client.iter_messages(entity, reply_to=post_id, limit=COMMENTS_MAX_PER_POST)]
+    if not comments:
+        return 0, 0
+
+    fetched = {c.id for c in comments}
+    edges = []
+    missing = set()
+    for c in comments:
+        header = getattr(c, "reply_to", None)
+        parent = getattr(header, "reply_to_msg_id", None)
+        top = getattr(header, "reply_to_top_id", None)
+        if parent and top and parent != top:
+            edges.append({"telegram_id": c.id, "reply_to_id": parent})
+            if parent not in fetched:
+                missing.add(parent)
+        else:
+            edges.append({"telegram_id": c.id, "reply_to_id": post_id, "reply_to_channel_id": entity.id})
+
+    payloads = await fetch_reply_parents(client, group, is_adults, sorted(missing), media)
+    for c in comments:
+        try:
+            payloads.append(build_payload(c, group, is_adults, media))
+        except Exception as e:
+            logger.warning(f"Error processing comment {getattr(c, 'id', 'unknown')}: {e}")
+    if not payloads:
+        return 0, 0
+
+    username = getattr(entity, "username", None) or str(entity.id)
+    created, _ = await send_to_api(payloads, session_name, username)
+    if created is None:
+        return None
+    linked = await send_replies_to_api(group.id, edges, session_name, username)
+    if linked is None:
+        return None
+    await asyncio.sleep(API_REQUEST_DELAY)
+    return len(comments), linked
+
+async def crawl_comments(
+    client: TelegramClient,
+    session_name: str,
+    entity,
+    threads: List[tuple[int, int]],
+    is_adults: bool,
+    media: Optional["MediaStage"] = None,
+) -> Dict[str, int]:
+    """Upload the discussion-group comments of channel posts together with their reply edges.
+
+    Direct comments are linked to the channel post itself; replies to other
+    comments are linked inside the group. A thread that cannot be read or
+    uploaded (private or deleted group, API error) is logged and skipped, so
+    it never fails the channel page it hangs off. Returns counts.
+    """
+    report = {"comments": 0, "replies": 0, "skipped": 0}
+    groups: Dict[int, Any] = {}
+
+    for post_id, group_id in threads:
+        try:
+            if group_id not in groups:
+                groups[group_id] = await client.get_entity(PeerChannel(group_id))
+            done = await crawl_thread(client, session_name, entity, groups[group_id], post_id, is_adults, media)
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            logger.warning(f"[{session_name}] Skipping comments of post {post_id} in group {group_id}: {e}")
+            done = None
+        if done is None:
+            report["skipped"] += 1
+            continue
+        report["comments"] += done[0]
+        report["replies"] += done[1]
+
+    return report
+
+# ---------------------------
+# Channel discovery
+# ---------------------------
+TME_LINK_RE = re.compile(r"(?:https?://)?(?:www\.)?(?:t|telegram)\.me/(?:s/)?([A-Za-z][A-Za-z0-9_]{3,31})(?=[/?#\s]|$)", re.I)
+MENTION_RE = re.compile(r"^@([A-Za-z][A-Za-z0-9_]{3,31})$")
+TME_RESERVED = {"joinchat", "addstickers", "addemoji", "addlist", "share", "proxy", "socks", "iv", "boost", "contact", "login"}
+
+class BloomFilter:
+    """Fixed-size Bloom filter persisted as raw bytes"""
+
+    def __init__(self, bits: int = DISCOVERY_BLOOM_BITS, hashes: int = DISCOVERY_BLOOM_HASHES, data: Optional[bytes] = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data and len(data) == bits // 8 else bytearray(bits // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @classmethod
+    def load(cls, path: str) -> "BloomFilter":
+        try:
+            with open(path, "rb") as f:
+                return cls(data=f.read())
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path: str):
+        with open(path + ".tmp", "wb") as f:
+            f.write(self.data)
+        os.replace(path + ".tmp", path)
+
+def candidate_usernames(entities, forward_from: Optional[str]) -> List[str]:
+    """Public usernames referenced by a message: t.me links, @mentions and the forward source"""
+    names = []
+    for entity_type, value in entities:
+        if entity_type == "url":
+            m = TME_LINK_RE.search(value)
+        elif entity_type == "mention":
+            m = MENTION_RE.match(value)
+        else:
+            m = None
+        if m:
+            names.append(m.group(1))
+
+    if forward_from:
+        names.append(forward_from)
+
+    # Bot usernames always end in "bot"; they are never channels
+    return [n.lower() for n in names if n.lower() not in TME_RESERVED and not n.lower().endswith("bot")]
+
+def registered_usernames() -> set:
+    names = set()
+    for ac in ACCOUNTS:
+        for ch in load_json(CHANNELS_TEMPLATE.format(ac["session"]), []):
+            if isinstance(ch, dict) and ch.get("username"):
+                names.add(ch["username"].strip().lstrip('@').lower())
+    return names
+
+class DiscoveryCollector:
+    """Counts candidate references during a run and merges them into the shared frontier"""
+
+    def __init__(self):
+        self.refs: Counter = Counter()
+        self.adult_refs: Counter = Counter()
+
+    def observe(self, entities, forward_from: Optional[str], source: str, is_adults: bool):
+        for name in set(candidate_usernames(entities, forward_from)):
+            if name != source:
+                self.refs[name] += 1
+                if is_adults:
+                    self.adult_refs[name] += 1
+
+    def flush(self):
+        if not self.refs:
+            return
+        registered = registered_usernames()
+        with file_lock(DISCOVERY_FRONTIER_FILE):
+            frontier = load_json(DISCOVERY_FRONTIER_FILE, {})
+            seen = BloomFilter.load(DISCOVERY_SEEN_FILE)
+            for name, count in self.refs.items():
+                if name in registered or name in seen:
+                    continue
+                entry = frontier.setdefault(name, {"refs": 0, "adult_refs": 0, "first_seen": int(now_ts())})
+                entry["refs"] += count
+                entry["adult_refs"] += self.adult_refs[name]
+            if len(frontier) > DISCOVERY_FRONTIER_MAX:
+                keep = sorted(frontier, key=lambda n: frontier[n]["refs"], reverse=True)[:DISCOVERY_FRONTIER_MAX]
+                frontier = {n: frontier[n] for n in keep}
+            save_json(DISCOVERY_FRONTIER_FILE, frontier)
+        self.refs.clear()
+        self.adult_refs.clear()
+
+def register_channel(session_name: str, username: str, is_adults: bool):
+    path = CHANNELS_TEMPLATE.format(session_name)
+    with file_lock(path):
+        channels = load_json(path, [])
+        channels.append({"username": username, "is_adults": is_adults, "discovered": True})
+        save_json(path, channels)
+
+async def resolve_discovered_channels(client: TelegramClient, session_name: str, deadline: float) -> Dict[str, int]:
+    """Resolve the most referenced frontier candidates and register the public
+    channels among them with this account."""
+    report = {"resolved": 0, "added": 0}
+
+    # Claim the top candidates so other accounts/workers do not resolve them too
+    with file_lock(DISCOVERY_FRONTIER_FILE):
+        frontier = load_json(DISCOVERY_FRONTIER_FILE, {})
+        ranked = sorted((n for n, e in frontier.items() if e["refs"] >= DISCOVERY_MIN_REFS),
+                        key=lambda n: frontier[n]["refs"], reverse=True)
+        claimed = {n: frontier.pop(n) for n in ranked[:DISCOVERY_RESOLVE_PER_RUN]}
+        if claimed:
+            save_json(DISCOVERY_FRONTIER_FILE, frontier)
+
+    done = []
+    try:
+        for name, entry in claimed.items():
+            if now_ts() >= deadline:
+                break
+            await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_RESOLVES, MAX_DELAY_BETWEEN_RESOLVES))
+            try:
+                entity = await client.get_entity(name)
+            except FloodWaitError:
+                raise
+            except Exception as e:
+                result = telegram_error_report(e, session_name, name)
+                if result["status"] == "auth_error":
+                    break
+                if result["status"] == "not_found" or isinstance(e, ValueError):
+                    logger.debug(f"[{session_name}] Discovery candidate {name} rejected: {e}")
+                    done.append(name)
+                # Other errors leave the candidate unresolved; it goes back to the frontier
+                continue
+
+            done.append(name)
+            report["resolved"] += 1
+            if getattr(entity, "broadcast", False) and getattr(entity, "username", None):
+                is_adults = entry["adult_refs"] * 2 > entry["refs"]
+                register_channel(session_name, entity.username, is_adults)
+                report["added"] += 1
+                logger.info(f"[{session_name}] Discovered channel {entity.username} "
+                            f"({entry['refs']} references, adults={is_adults})")
+    finally:
+        with file_lock(DISCOVERY_FRONTIER_FILE):
+            seen = BloomFilter.load(DISCOVERY_SEEN_FILE)
+            for name in done:
+                seen.add(name)
+            seen.save(DISCOVERY_SEEN_FILE)
+
+            # Unresolved claims go back with their counts
+            frontier = load_json(DISCOVERY_FRONTIER_FILE, {})
+            for name, entry in claimed.items():
+                if name in done:
+                    continue
+                current = frontier.setdefault(name, {"refs": 0, "adult_refs": 0, "first_seen": entry["first_seen"]})
+                current["refs"] += entry["refs"]
+                current["adult_refs"] += entry["adult_refs"]
+            save_json(DISCOVERY_FRONTIER_FILE, frontier)
+
+    return report
+
+async def run_idle_tasks(client: TelegramClient, session_name: str, channels: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Low-priority work for the rest of the account's idle budget"""
+    deadline = now_ts() + IDLE_BUDGET_SECONDS
+    report = await revalidate_failed_channels(client, session_name, channels, deadline)
+    report.update(await resolve_discovered_channels(client, session_name, deadline))
+    return report
+
+# ---------------------------
+# Profile photo cache
+# ---------------------------
+class MediaStage:
+    """Downloads channel/sender profile photos in the background, only when
+    their photo id changes, into a content-addressed cache.
+
+    Files are stored as <sha256[:2]>/<sha256>.jpg under MEDIA_CACHE_DIR, so a
+    photo shared by several peers is stored (and served) once. File mtimes
+    double as LRU timestamps for size-bounded eviction. photo_url() never
+    waits: it returns the cached URL, or the previous one (or None) while a
+    download is queued, and the next batch picks up the new URL.
+    """
+
+    def __init__(self, client: TelegramClient, session_name: str):
+        self.client = client
+        self.session_name = session_name
+        self.state = load_photos_for(session_name)  # peer id -> [photo_id, sha256]
+        self.semaphore = asyncio.Semaphore(MEDIA_DOWNLOAD_CONCURRENCY)
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.cache_bytes = self._scan_cache()
+
+    @staticmethod
+    def _relpath(digest: str) -> str:
+        return f"{digest[:2]}/{digest}.jpg"
+
+    def _scan_cache(self) -> int:
+        total = 0
+        for root, _, files in os.walk(MEDIA_CACHE_DIR):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+        return total
+
+    def photo_url(self, peer) -> Optional[str]:
+        photo_id = getattr(getattr(peer, "photo", None), "photo_id", None)
+        peer_id = getattr(peer, "id", None)
+        if not MEDIA_PUBLIC_URL or not photo_id or not peer_id:
+            return None
+
+        key = str(peer_id)
+        known = self.state.get(key)
+        if known and known[0] == photo_id:
+            path = os.path.join(MEDIA_CACHE_DIR, self._relpath(known[1]))
+            if os.path.exists(path):
+                os.utime(path)
+                return f"{MEDIA_PUBLIC_URL}/{self._relpath(known[1])}"
+
+        if key not in self.pending:
+            self.pending[key] = asyncio.create_task(self._download(key, peer, photo_id))
+            media_downloads_pending.set(len(self.pending), account=self.session_name)
+        return f"{MEDIA_PUBLIC_URL}/{self._relpath(known[1])}" if known else None
+
+    async def _download(self, key: str, peer, photo_id: int):
+        try:
+            async with self.semaphore:
+                data = await self.client.download_profile_photo(peer, file=bytes, download_big=False)
+            if not data:
+                return
+            digest = hashlib.sha256(data).hexdigest()
+            path = os.path.join(MEDIA_CACHE_DIR, self._relpath(digest))
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+                self.cache_bytes += len(data)
+                self._evict()
+            self.state[key] = [photo_id, digest]
+        except FloodWaitError as e:
+            logger.warning(f"[{self.session_name}] FloodWait {e.seconds}s on photo download, will retry later")
+        except Exception as e:
+            logger.debug(f"[{self.session_name}] Photo download failed for {key}: {e}")
+        finally:
+            self.pending.pop(key, None)
+            media_downloads_pending.set(len(self.pending), account=self.session_name)
+
+    def _evict(self):
+        if self.cache_bytes <= MEDIA_CACHE_MAX_BYTES:
+            return
+        files = []
+        for root, _, names in os.walk(MEDIA_CACHE_DIR):
+            for name in names:
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        target = int(MEDIA_CACHE_MAX_BYTES * 0.9)
+        for _, size, path in files:
+            if self.cache_bytes <= target:
+                break
+            os.remove(path)
+            self.cache_bytes -= size
+        logger.info(f"[{self.session_name}] Media cache evicted down to {self.cache_bytes} bytes")
+
+    async def close(self, timeout: float = 30.0):
+        """Give queued downloads a bounded amount of time, then persist the photo map"""
+        if self.pending:
+            _, late = await asyncio.wait(list(self.pending.values()), timeout=timeout)
+            for task in late:
+                task.cancel()
+        save_photos_for(self.session_name, self.state)
+
 # ---------------------------
 # Enhanced message fetching with better rate limiting
 # ---------------------------
@@ -207,6 +1544,11 @@ async def fetch_channel_messages(
     session_name: str,
     channel: Dict[str, Any],
     last_ids: Dict[str, int],
+    counters: Optional[Dict[str, Dict[str, List]]] = None,
+    ledger: Optional[Dict[str, Dict[str, List[List[int]]]]] = None,
+    lease: Optional["ChannelLease"] = None,
+    media: Optional[MediaStage] = None,
+    discovery: Optional[DiscoveryCollector] = None,
 ) -> Dict[str, Any]:
     username = channel.get("username", "").strip().lstrip('@')
     is_adults = bool(channel.get("is_adults", False))
@@ -220,16 +1562,20 @@ async def fetch_channel_messages(
     total_fetched = 0
     total_created = 0
     total_updated = 0
+    total_comments = 0
     messages_processed = 0
 
     try:
         # Add delay before getting entity
-        await asyncio.sleep(random.uniform(0.5, 1.5))
+        with tracing.span("sleep", "sleep"):
+            await asyncio.sleep(random.uniform(0.5, 1.5))
         
         try:
-            entity = await client.get_entity(username)
+            with stage_seconds.time(stage="get_entity", account=session_name), tracing.span("get_entity", channel=username):
+                entity = await client.get_entity(username)
         except Exception as e:
             if "No user has" in str(e) or "Username not found" in str(e):
+                errors_total.inc(account=session_name, channel=username, kind="not_found")
                 return {"status": "not_found", "reason": f"entity_not_found: {str(e)[:100]}"}
             raise
 
@@ -243,151 +1589,103 @@ async def fetch_channel_messages(
         while messages_processed < MAX_MESSAGES_PER_CHANNEL:
             try:
                 # Add delay before each batch
-                await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_MESSAGES, MAX_DELAY_BETWEEN_MESSAGES))
+                with tracing.span("sleep", "sleep"):
+                    await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_MESSAGES, MAX_DELAY_BETWEEN_MESSAGES))
                 
-                msgs = []
-                async for m in client.iter_messages(entity, limit=BATCH_SIZE, min_id=last_id):
-                    msgs.append(m)
-                    # Small delay between message processing
-                    if len(msgs) % 10 == 0:
-                        await asyncio.sleep(0.1)
+                # Each message is converted as it arrives and the Telethon object dropped
+                batch = MessageBatch()
+                page_size = 0
+                # Waits for the next message count as fetch time, batch.add as transform time
+                fetch_seconds = transform_seconds = 0.0
+                with tracing.span("history_page", channel=username, min_id=last_id):
+                    mark = time.perf_counter()
+                    async for m in client.iter_messages(entity, limit=BATCH_SIZE, min_id=last_id):
+                        fetch_seconds += time.perf_counter() - mark
+                        page_size += 1
+                        mark = time.perf_counter()
+                        try:
+                            batch.add(m, media)
+                        except Exception as e:
+                            logger.warning(f"Error processing message {getattr(m, 'id', 'unknown')}: {e}")
+                        transform_seconds += time.perf_counter() - mark
+                        # Small delay between message processing
+                        if page_size % 10 == 0:
+                            await asyncio.sleep(0.1)
+                        mark = time.perf_counter()
+                    fetch_seconds += time.perf_counter() - mark
+                m = None
+                stage_seconds.observe(fetch_seconds, stage="history_fetch", account=session_name)
                 
-                if not msgs:
+                if not page_size:
                     break
 
-                msgs.sort(key=lambda m: m.id)
-                payloads = []
-                max_id_in_batch = last_id
-
-                for msg in msgs:
-                    try:
-                        # Get text safely
-                        text = getattr(msg, "text", getattr(msg, "message", "")) or ""
-                        text = sanitize_text(text)
-
-                        # Extract entities
-                        ent_list = []
-                        if getattr(msg, "entities", None) and text:
-                            for ent in msg.entities:
-                                try:
-                                    start_pos = getattr(ent, 'offset', 0)
-                                    length = getattr(ent, 'length', 0)
-                                    
-                                    if 0 <= start_pos < len(text) and start_pos + length <= len(text):
-                                        entity_text = text[start_pos:start_pos + length]
-                                        
-                                        if isinstance(ent, MessageEntityHashtag):
-                                            ent_list.append({"entity_type": "hashtag", "entity_value": entity_text})
-                                        elif isinstance(ent, MessageEntityUrl):
-                                            ent_list.append({"entity_type": "url", "entity_value": entity_text})
-                                        elif isinstance(ent, MessageEntityMention):
-                                            ent_list.append({"entity_type": "mention", "entity_value": entity_text})
-                                except Exception as e:
-                                    logger.debug(f"Entity extraction error: {e}")
-                                    continue
-
-                        # Detect message type more safely
-                        mtype = "text"
-                        try:
-                            if getattr(msg, "photo", None):
-                                mtype = "photo"
-                            elif getattr(msg, "video", None):
-                                mtype = "video"
-                            elif getattr(msg, "document", None):
-                                doc = msg.document
-                                if hasattr(doc, 'mime_type'):
-                                    mime = doc.mime_type or ""
-                                    if mime.startswith('audio/'):
-                                        mtype = "audio"
-                                    elif mime.startswith('video/'):
-                                        mtype = "video"
-                                    else:
-                                        mtype = "document"
-                                else:
-                                    mtype = "document"
-                            elif getattr(msg, "voice", None):
-                                mtype = "voice"
-                            elif getattr(msg, "audio", None):
-                                mtype = "audio"
-                            elif getattr(msg, "sticker", None):
-                                mtype = "sticker"
-                        except Exception:
-                            mtype = "text"
-
-                        # Create media link safely
-                        media_link = None
-                        try:
-                            if getattr(entity, "username", None):
-                                media_link = f"https://t.me/{entity.username}/{msg.id}"
-                        except Exception:
-                            pass
-
-                        # Get message date safely
-                        msg_date = getattr(msg, "date", None)
-                        posted_at = str(msg_date) if msg_date else None
-
-                        payloads.append({
-                            "message": {
-                                "telegram_id": msg.id,
-                                "message_type": mtype,
-                                "content_text": text[:10000],  # Limit text length
-                                "media_file_path": media_link,
-                                "views": int(getattr(msg, "views", 0) or 0),
-                                "forwards": int(getattr(msg, "forwards", 0) or 0),
-                                "replies_count": get_replies_count(msg),
-                                "posted_at": posted_at,
-                            },
-                            "channel": {
-                                "telegram_id": getattr(entity, "id", None),
-                                "title": getattr(entity, "title", None),
-                                "username": getattr(entity, "username", None),
-                                "type": entity.__class__.__name__ if entity else None,
-                                "is_private": False,
-                                "is_adults": is_adults,
-                                "description": getattr(entity, "about", None) if hasattr(entity, "about") else None,
-                                "members_count": getattr(entity, "participants_count", None) if hasattr(entity, "participants_count") else None,
-                                "photo_url": None
-                            },
-                            "sender": {
-                                "telegram_id": int(getattr(msg, "sender_id", 0) or 0),
-                                "username": getattr(msg.sender, "username", None) if getattr(msg, "sender", None) else None,
-                                "display_name": getattr(msg.sender, "first_name", None) if getattr(msg, "sender", None) else None,
-                                "is_bot": bool(getattr(msg.sender, "bot", False)) if getattr(msg, "sender", None) else False,
-                                "photo_url": None
-                            },
-                            "entities": ent_list
-                        })
-
-                        if msg.id > max_id_in_batch:
-                            max_id_in_batch = msg.id
-
-                    except Exception as e:
-                        logger.warning(f"Error processing message {getattr(msg, 'id', 'unknown')}: {e}")
-                        continue
-
-                # Send to Laravel API with retry logic
+                mark = time.perf_counter()
+                with tracing.span("transform", channel=username, messages=page_size):
+                    batch.sort()
+                    max_id_in_batch = max(last_id, batch.ids[-1]) if batch else last_id
+                    batch_counters = {str(msg_id): batch.counters_row(i) for i, msg_id in enumerate(batch.ids)}
+                    if discovery is not None:
+                        for entities, forward_from in zip(batch.entities, batch.forward_from):
+                            discovery.observe(entities, forward_from, username.lower(), is_adults)
+                    payloads = batch.payloads(entity, is_adults, media)
+                stage_seconds.observe(transform_seconds + time.perf_counter() - mark, stage="transform",
+                                      account=session_name)
+                messages_total.inc(page_size, account=session_name, channel=username)
+
+                # Parents outside this batch that were never uploaded go first,
+                # so every reply edge can be resolved on the backend
+                edges = batch.reply_edges()
+                if edges:
+                    known = ledger_for_channel(ledger, username, last_id)["known"] if ledger is not None else []
+                    in_batch = set(batch.ids)
+                    missing = sorted({e["reply_to_id"] for e in edges
+                                      if e["reply_to_id"] not in in_batch and not ranges_contains(known, e["reply_to_id"])})
+                    if missing:
+                        payloads = await fetch_reply_parents(client, entity, is_adults, missing, media) + payloads
+
+                # Send to Laravel API with retry logic. The batch key is recorded first,
+                # so a crash before last_id is saved can be recovered from the ack.
                 if payloads:
-                    created, updated = await send_to_api(payloads, session_name, username)
+                    key = idempotency_key(payloads)
+                    pending = load_pending_for(session_name)
+                    pending[username] = {"key": key, "last_id": max_id_in_batch}
+                    save_pending_for(session_name, pending)
+
+                    created, updated = await send_to_api(payloads, session_name, username, key)
                     if created is None:  # API error
                         return {"status": "error", "reason": "api_error"}
                     
                     total_created += created
                     total_updated += updated
+
+                    if edges and await send_replies_to_api(entity.id, edges, session_name, username) is None:
+                        return {"status": "error", "reason": "api_error"}
+
+                    threads = await crawl_comments(client, session_name, entity, batch.threads(), is_adults, media)
+                    total_comments += threads["comments"]
+
+                    remember_uploaded(username, payloads, batch_counters, last_id, counters, ledger)
                     
                     # Add delay after API request
                     await asyncio.sleep(API_REQUEST_DELAY)
 
-                total_fetched += len(payloads)
-                messages_processed += len(msgs)
+                total_fetched += len(batch)
+                messages_processed += page_size
 
                 # Update last_id
                 if max_id_in_batch > last_id:
                     last_id = max_id_in_batch
                     last_ids[username] = last_id
                     save_last_ids_for(session_name, last_ids)
+                    if lease is not None and not await lease.commit(last_id):
+                        return {"status": "error", "reason": "lease_lost"}
+                if payloads:
+                    pending = load_pending_for(session_name)
+                    pending.pop(username, None)
+                    save_pending_for(session_name, pending)
 
                 # Break if fewer messages than batch size
-                if len(msgs) < BATCH_SIZE:
+                if page_size < BATCH_SIZE:
                     break
                     
             except FloodWaitError as e:
@@ -403,190 +1701,934 @@ async def fetch_channel_messages(
             "status": "ok", 
             "fetched": total_fetched, 
             "created": total_created, 
-            "updated": total_updated
+            "updated": total_updated,
+            "comments": total_comments,
         })
         return report
 
-    except FloodWaitError as e:
-        secs = int(getattr(e, "seconds", 3600))
-        logger.warning(f"[{session_name}] FloodWait {secs}s for {username}")
-        return {"status": "flood", "seconds": secs}
-    
-    except (UsernameInvalidError, UsernameNotOccupiedError) as e:
-        return {"status": "not_found", "reason": f"username_error: {str(e)[:100]}"}
-    
-    except ChannelPrivateError:
-        return {"status": "not_found", "reason": "channel_private"}
-    
-    except ChatAdminRequiredError:
-        return {"status": "not_found", "reason": "admin_required"}
-    
-    except AuthKeyUnregisteredError:
-        return {"status": "auth_error", "reason": "auth_key_unregistered"}
-    
-    except RPCError as e:
-        return {"status": "rpc_error", "reason": f"rpc: {str(e)[:100]}"}
-    
-    except ValueError as e:
-        msg = str(e)
-        if "No user has" in msg or "Username not found" in msg:
-            return {"status": "not_found", "reason": f"value_error: {msg[:100]}"}
-        return {"status": "error", "reason": f"value_error: {msg[:100]}"}
-    
     except Exception as e:
-        logger.error(f"Unexpected error in fetch_channel_messages: {e}")
-        return {"status": "error", "reason": f"unexpected: {str(e)[:100]}"}
+        return telegram_error_report(e, session_name, username)
+
+# ---------------------------
+# Local archive
+# ---------------------------
+archive: Optional[MessageArchive] = MessageArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+
+async def archive_batch(payloads: List[Dict[str, Any]], username: str):
+    """Write a batch to the archive in a worker thread; gzip would otherwise stall the event loop"""
+    if archive is None or not payloads:
+        return
+    try:
+        await asyncio.to_thread(archive.write, payloads)
+    except Exception as e:
+        logger.error(f"Archive write failed for {username}: {e}")
+
+async def archive_compaction_loop(interval: float = ARCHIVE_COMPACT_INTERVAL):
+    """Compact the archive in a worker thread every `interval` seconds"""
+    while True:
+        try:
+            report = await asyncio.to_thread(archive.compact_all)
+            if report["files"]:
+                logger.info(f"Archive: compacted {report['files']} files in {report['partitions']} partitions")
+        except Exception as e:
+            logger.error(f"Archive compaction failed: {e}")
+        await asyncio.sleep(interval)
 
 # ---------------------------
 # API communication with retry logic
 # ---------------------------
-async def send_to_api(payloads: List[Dict], session_name: str, username: str) -> tuple[int, int]:
-    """Send payloads to Laravel API with retry logic. Returns (created, updated) or (None, None) on error."""
-    
-    for attempt in range(3):  # 3 retry attempts
+class CircuitBreaker:
+    """Health of the import API shared by every uploader in the process.
+
+    BREAKER_FAILURE_THRESHOLD consecutive failures, or any Retry-After, open
+    the circuit. After the cooldown one probe request decides whether it
+    closes again. Retries spend tokens from a shared budget that successful
+    requests earn back, so a struggling backend sees little extra traffic.
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+        self.probing = False
+        self.tokens = RETRY_BUDGET_MAX
+        self.metrics = {"trips": 0, "rejected": 0, "retries": 0, "retries_denied": 0, "buffered": 0, "replayed": 0}
+
+    def available(self) -> bool:
+        if self.open_until == 0.0:
+            return True
+        return now_ts() >= self.open_until and not self.probing
+
+    def allow(self) -> bool:
+        """Whether a request may go out now; the first one after a cooldown is the probe"""
+        if not self.available():
+            self.metrics["rejected"] += 1
+            return False
+        if self.open_until:
+            self.probing = True
+        return True
+
+    def record_success(self):
+        if self.open_until:
+            logger.info("Import API recovered, circuit closed")
+        self.failures = 0
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+        self.probing = False
+        self.tokens = min(RETRY_BUDGET_MAX, self.tokens + RETRY_BUDGET_EARN)
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        self.failures += 1
+        if retry_after or self.probing or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            self.trip(retry_after)
+
+    def trip(self, retry_after: Optional[float] = None):
+        delay = min(retry_after, BREAKER_MAX_RETRY_AFTER) if retry_after else self.cooldown
+        if not retry_after:
+            self.cooldown = min(BREAKER_MAX_COOLDOWN, self.cooldown * 2)
+        self.open_until = now_ts() + delay
+        self.probing = False
+        self.metrics["trips"] += 1
+        logger.warning(f"Import API unhealthy after {self.failures} failures, uploads paused for {delay:.0f}s")
+
+    def spend_retry(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.metrics["retries"] += 1
+            return True
+        self.metrics["retries_denied"] += 1
+        return False
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.metrics, "open": not self.available(), "retry_tokens": round(self.tokens, 1)}
+
+upload_breaker = CircuitBreaker()
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After as seconds; the header is either delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now_ts())
+    except (TypeError, ValueError):
+        return None
+
+async def http_post(url: str, **kwargs) -> requests.Response:
+    """requests.post in a worker thread, so an upload does not stall the other
+    channel workers or Telethon's connection"""
+    return await asyncio.to_thread(requests.post, url, **kwargs)
+
+async def api_post(url: str, body: Any, username: str, key: Optional[str] = None,
+                   account: str = "") -> tuple[str, Optional[Dict[str, Any]]]:
+    """POST through the circuit breaker. Returns ("ok", response), ("rejected", None)
+    for requests the API refused (4xx), or ("unavailable", None).
+
+    The breaker is shared and unlocked: call this from the event loop only."""
+    endpoint = urlsplit(url).path
+    data = json.dumps(body).encode("utf-8")  # Serialized once; every attempt sends the same bytes
+    headers = {
+        "Authorization": f"Bearer {IMPORT_TOKEN}", 
+        "Content-Type": "application/json",
+        "User-Agent": "TelegramCrawler/1.0"
+    }
+    if key:
+        # The same key on every attempt lets the backend skip batches it already applied
+        headers["Idempotency-Key"] = key
+
+    for attempt in range(3):  # 3 attempts, retries permitting
+        if not upload_breaker.allow():
+            api_requests_total.inc(endpoint=endpoint, outcome="circuit_open")
+            return "unavailable", None
+
+        retry_after = None
+        upload_bytes_total.inc(len(data), account=account, channel=username)
         try:
-            headers = {
-                "Authorization": f"Bearer {IMPORT_TOKEN}", 
-                "Content-Type": "application/json",
-                "User-Agent": "TelegramCrawler/1.0"
-            }
-            
-            resp = requests.post(
-                LARAVEL_API, 
+            resp = await http_post(
+                url, 
                 headers=headers, 
-                json=payloads, 
+                data=data, 
                 timeout=REQUEST_TIMEOUT
             )
+            api_requests_total.inc(endpoint=endpoint, outcome=str(resp.status_code))
             
             if resp.status_code == 200:
+                upload_breaker.record_success()
                 try:
-                    jr = resp.json() if resp.content else {}
-                    created = int(jr.get("created", 0) or 0)
-                    updated = int(jr.get("updated", 0) or 0)
-                    return created, updated
+                    return "ok", (resp.json() if resp.content else {})
                 except json.JSONDecodeError:
                     logger.warning(f"Invalid JSON response from API for {username}")
-                    return 0, 0
-            else:
-                logger.warning(f"API returned status {resp.status_code} for {username}")
-                if attempt < 2:  # Don't sleep on last attempt
-                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
-                continue
-                
+                    return "ok", {}
+
+            logger.warning(f"API returned status {resp.status_code} for {username}")
+            if resp.status_code < 500 and resp.status_code not in (408, 429):
+                # The backend is up and refused this request; retrying will not help
+                upload_breaker.record_success()
+                return "rejected", None
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            upload_breaker.record_failure(retry_after)
+
         except (ConnectionError, Timeout) as e:
+            api_requests_total.inc(endpoint=endpoint, outcome=e.__class__.__name__)
             logger.warning(f"API connection error for {username} (attempt {attempt + 1}): {e}")
-            if attempt < 2:
-                await asyncio.sleep(2 ** attempt)
-            continue
+            upload_breaker.record_failure()
         except RequestException as e:
+            api_requests_total.inc(endpoint=endpoint, outcome=e.__class__.__name__)
             logger.error(f"API request error for {username}: {e}")
-            return None, None
+            upload_breaker.record_failure()
+            return "unavailable", None
         except Exception as e:
+            api_requests_total.inc(endpoint=endpoint, outcome=e.__class__.__name__)
             logger.error(f"Unexpected API error for {username}: {e}")
-            return None, None
+            upload_breaker.record_failure()
+            return "unavailable", None
+
+        if attempt == 2 or not upload_breaker.spend_retry():
+            break
+        await asyncio.sleep(2 ** attempt)  # Exponential backoff
     
-    logger.error(f"API failed after 3 attempts for {username}")
-    return None, None
+    logger.error(f"API failed for {username}")
+    return "unavailable", None
+
+def buffer_upload(session_name: str, url: str, body: Any, key: Optional[str] = None) -> bool:
+    path = UPLOAD_BUFFER_TEMPLATE.format(session_name)
+    if os.path.exists(path) and os.path.getsize(path) >= UPLOAD_BUFFER_MAX_BYTES:
+        logger.error(f"[{session_name}] Upload buffer full, not buffering")
+        return False
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"url": url, "body": body, "key": key}, ensure_ascii=False) + "\n")
+    upload_breaker.metrics["buffered"] += 1
+    return True
+
+_draining: set = set()
+
+async def drain_upload_buffer(session_name: str) -> int:
+    """Replay buffered uploads in order while the API accepts them. Returns the number delivered."""
+    path = UPLOAD_BUFFER_TEMPLATE.format(session_name)
+    if session_name in _draining or not os.path.exists(path) or not upload_breaker.available():
+        return 0
+
+    _draining.add(session_name)
+    done = 0
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    status, _ = await api_post(record["url"], record["body"], f"buffer:{session_name}", record.get("key"),
+                                            session_name)
+                    if status == "unavailable":
+                        break
+                    if status == "rejected":
+                        logger.error(f"[{session_name}] Buffered upload to {record['url']} rejected, dropped")
+                done += 1
+
+        # Uploads buffered meanwhile were appended after the lines read above
+        with open(path, encoding="utf-8") as f:
+            rest = f.readlines()[done:]
+        if rest:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines(rest)
+            os.replace(path + ".tmp", path)
+        else:
+            os.remove(path)
+    finally:
+        _draining.discard(session_name)
+
+    if done:
+        upload_breaker.metrics["replayed"] += done
+        logger.info(f"[{session_name}] Replayed {done} buffered uploads")
+    return done
+
+async def post_to_api(
+    url: str,
+    body: Any,
+    username: str,
+    buffer: Optional[str] = None,
+    key: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """POST a JSON body to the Laravel API with retry logic. Returns the decoded response or None on error.
+
+    With `buffer` (a session name) the body is appended to that account's
+    upload buffer instead when the API is unavailable, or when older buffered
+    uploads are still waiting, and {"buffered": True} is returned.
+    """
+    if buffer is not None:
+        path = UPLOAD_BUFFER_TEMPLATE.format(buffer)
+        if os.path.exists(path):
+            await drain_upload_buffer(buffer)
+        if os.path.exists(path) or not upload_breaker.available():
+            return {"buffered": True} if buffer_upload(buffer, url, body, key) else None
+
+    status, jr = await api_post(url, body, username, key, buffer or "")
+    if status != "ok":
+        errors_total.inc(account=buffer or "", channel=username, kind=f"api_{status}")
+    if status == "unavailable" and buffer is not None and buffer_upload(buffer, url, body, key):
+        return {"buffered": True}
+    return jr
+
+def idempotency_key(payloads: List[Dict]) -> str:
+    """Deterministic key of an import batch: channel, id range and a digest of the content"""
+    ids = [p["message"]["telegram_id"] for p in payloads]
+    digest = hashlib.blake2b(json.dumps(payloads, sort_keys=True, ensure_ascii=False).encode("utf-8"),
+                             digest_size=8).hexdigest()
+    return f"{payloads[0]['channel']['telegram_id']}:{min(ids)}-{max(ids)}:{digest}"
+
+async def send_to_api(payloads: List[Dict], session_name: str, username: str,
+                      key: Optional[str] = None) -> tuple[int, int]:
+    """Send payloads to Laravel API with retry logic. Returns (created, updated) or (None, None) on error."""
+    await archive_batch(payloads, username)
+    with stage_seconds.time(stage="send_to_api", account=session_name), \
+            tracing.span("upload", "upload", channel=username, payloads=len(payloads)):
+        jr = await post_to_api(LARAVEL_API, payloads, username, buffer=session_name, key=key or idempotency_key(payloads))
+    if jr is None:
+        return None, None
+    try:
+        if int(jr.get("failed", 0) or 0):
+            # The backend did not record the key, so re-sending the batch retries the failed rows
+            logger.warning(f"API failed to import {jr['failed']} of {len(payloads)} messages for {username}")
+            return None, None
+        return int(jr.get("created", 0) or 0), int(jr.get("updated", 0) or 0)
+    except (TypeError, ValueError, AttributeError):
+        return 0, 0
+
+async def send_counters_to_api(channel_id: int, deltas: List[Dict], username: str) -> Optional[int]:
+    """Send counter/edit deltas for one channel. Returns number of updated rows or None on error."""
+    jr = await post_to_api(LARAVEL_COUNTERS_API, {"channel": {"telegram_id": channel_id}, "messages": deltas}, username)
+    if jr is None:
+        return None
+    try:
+        return int(jr.get("updated", 0) or 0)
+    except (TypeError, ValueError, AttributeError):
+        return 0
+
+async def send_tombstones_to_api(channel_id: int, ids: List[int], username: str) -> Optional[int]:
+    """Report deleted message ids of one channel. Returns number of deleted rows or None on error."""
+    jr = await post_to_api(LARAVEL_TOMBSTONES_API, {"channel": {"telegram_id": channel_id}, "ids": ids}, username)
+    if jr is None:
+        return None
+    try:
+        return int(jr.get("deleted", 0) or 0)
+    except (TypeError, ValueError, AttributeError):
+        return 0
+
+async def send_replies_to_api(channel_id: int, edges: List[Dict], session_name: str, username: str) -> Optional[int]:
+    """Upload reply edges of one chat in one request. Returns number of linked edges or None on error."""
+    jr = await post_to_api(LARAVEL_REPLIES_API, {"channel": {"telegram_id": channel_id}, "edges": edges},
+                           username, buffer=session_name)
+    if jr is None:
+        return None
+    try:
+        return int(jr.get("created", 0) or 0)
+    except (TypeError, ValueError, AttributeError):
+        return 0
+
+async def recover_pending_uploads(session_name: str, last_ids: Dict[str, int]):
+    """Advance cursors for batches the API applied before the crawler could save them"""
+    pending = load_pending_for(session_name)
+    if not pending:
+        return
+
+    jr = await post_to_api(LARAVEL_ACKS_API, {"keys": [p["key"] for p in pending.values()]}, session_name)
+    if jr is None:
+        return  # Unknown; the batches are simply fetched and sent again
+    acked = set(jr.get("acknowledged") or [])
+
+    for username, p in pending.items():
+        if p["key"] in acked and p["last_id"] > int(last_ids.get(username, 0) or 0):
+            last_ids[username] = p["last_id"]
+            logger.info(f"[{session_name}] {username} cursor recovered to {p['last_id']} from acknowledged batch")
+    save_last_ids_for(session_name, last_ids)
+    save_pending_for(session_name, {})
 
 # ---------------------------
-# Enhanced account runner
+# Client pool
 # ---------------------------
-async def run_account(account: Dict[str, Any]) -> Dict[str, Any]:
-    session_name = account["session"]
-    api_id = account["api_id"]
-    api_hash = account["api_hash"]
+AUTH_ERRORS = (AuthKeyUnregisteredError, SessionPasswordNeededError, UserDeactivatedError, UserDeactivatedBanError)
+
+def create_client(account: Dict[str, Any]) -> TelegramClient:
+    # Create client with better settings
+    client = TelegramClient(
+        account["session"], 
+        account["api_id"], 
+        account["api_hash"],
+        connection_retries=3,
+        auto_reconnect=True,
+        timeout=30
+    )
+    return RecordingClient(client, RECORD_DIR) if RECORD_DIR else client
+
+class RpcLimiter:
+    """Token bucket pacing the Telegram requests of one account, shared by all its channels"""
+
+    def __init__(self, rate: float = ACCOUNT_RPC_RATE, burst: float = ACCOUNT_RPC_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.calls = 0
+        self.wait_seconds = 0.0
+        self.waiting = 0  # Requests queued for a token
+
+    async def wait(self):
+        self.calls += 1
+        if self.rate <= 0:
+            return
+        # The lock queues waiters, so requests go out in arrival order
+        self.waiting += 1
+        try:
+            async with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens < 1:
+                    delay = (1 - self.tokens) / self.rate
+                    self.wait_seconds += delay
+                    await asyncio.sleep(delay)
+                    self.tokens = 1
+                    self.updated = time.monotonic()
+                self.tokens -= 1
+        finally:
+            self.waiting -= 1
+
+def pace_client(client: TelegramClient, limiter: RpcLimiter):
+    """Route every request of the client (iter_messages pages, get_entity, ...) through the limiter"""
+    call = client._call
+
+    async def paced_call(sender, request, ordered=False, flood_sleep_threshold=None):
+        await limiter.wait()
+        return await call(sender, request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold)
+
+    client._call = paced_call
+
+class ClientPool:
+    """Keeps one started TelegramClient per account across crawl cycles.
+
+    Clients are started on first use and handed out again while connected,
+    so session load, auth checks and Telethon's entity cache survive between
+    cycles. A health loop pings every client, reconnects with exponential
+    backoff and quarantines accounts whose authorization is gone. A
+    quarantined client still in use by a run (and its channel workers) is
+    only disconnected once that run releases it.
+    """
+
+    def __init__(self, factory: Callable[[Dict[str, Any]], TelegramClient] = create_client):
+        self.factory = factory
+        self.clients: Dict[str, TelegramClient] = {}
+        self.accounts: Dict[str, Dict[str, Any]] = {}
+        self.metrics: Dict[str, Dict[str, float]] = {}
+        self.limiters: Dict[str, RpcLimiter] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._health_task: Optional[asyncio.Task] = None
+        self.users: Counter = Counter()  # Runs holding each account's client
+        self._retired: Dict[str, TelegramClient] = {}  # Quarantined, disconnected on the last release
+        self._disconnects: set = set()
+
+    def _metrics_for(self, session_name: str) -> Dict[str, float]:
+        return self.metrics.setdefault(session_name, {
+            "connects": 0, "reconnects": 0, "connect_seconds_total": 0.0, "connect_seconds_last": 0.0,
+            "pings_ok": 0, "pings_failed": 0, "connected_since": 0.0, "uptime_seconds": 0.0,
+        })
+
+    def _mark_connected(self, session_name: str, started: float):
+        m = self._metrics_for(session_name)
+        latency = time.monotonic() - started
+        m["connects"] += 1
+        m["connect_seconds_total"] += latency
+        m["connect_seconds_last"] = latency
+        m["connected_since"] = now_ts()
+        logger.info(f"[{session_name}] Connected in {latency:.2f}s")
+
+    def _mark_disconnected(self, session_name: str):
+        m = self._metrics_for(session_name)
+        if m["connected_since"]:
+            m["uptime_seconds"] += now_ts() - m["connected_since"]
+            m["connected_since"] = 0.0
+
+    def quarantine(self, session_name: str, reason: str):
+        logger.error(f"[{session_name}] Quarantined: {reason}")
+        with file_lock(QUARANTINED_FILE):
+            quarantined = load_quarantined()
+            quarantined[session_name] = {"since": now_ts(), "reason": reason}
+            save_quarantined(quarantined)
+        client = self.clients.pop(session_name, None)
+        if client:
+            self._mark_disconnected(session_name)
+            if self.users[session_name]:
+                # Other channel workers may be mid-request on it
+                self._retired[session_name] = client
+            else:
+                self._disconnect(session_name, client)
+
+    def _disconnect(self, session_name: str, client: TelegramClient):
+        task = asyncio.create_task(self._close_client(session_name, client))
+        self._disconnects.add(task)
+        task.add_done_callback(self._disconnects.discard)
+
+    async def _close_client(self, session_name: str, client: TelegramClient):
+        try:
+            await client.disconnect()
+            logger.info(f"[{session_name}] Client disconnected")
+        except Exception as e:
+            logger.warning(f"[{session_name}] Error disconnecting client: {e}")
+
+    async def acquire(self, account: Dict[str, Any]) -> tuple[Optional[TelegramClient], Optional[Dict[str, Any]]]:
+        """Return a connected client for the account. Returns (client, None) or (None, skip/error result)."""
+        session_name = account["session"]
+        quarantined = load_quarantined().get(session_name)
+        if quarantined:
+            logger.info(f"[{session_name}] Quarantined since {iso_from_ts(quarantined.get('since', 0))}: "
+                        f"{quarantined.get('reason')}")
+            return None, {"skipped": True, "reason": "quarantined"}
+
+        self.accounts[session_name] = account
+        async with self._locks.setdefault(session_name, asyncio.Lock()):
+            client = self.clients.get(session_name)
+            if client is not None:
+                if client.is_connected():
+                    self.users[session_name] += 1
+                    return client, None
+                if await self._reconnect(session_name):
+                    self.users[session_name] += 1
+                    return self.clients[session_name], None
+                return None, {"error": "reconnect_failed"}
+
+            client = self.factory(account)
+            pace_client(client, self.limiters.setdefault(session_name, RpcLimiter()))
+            started = time.monotonic()
+            try:
+                await client.start()
+                logger.info(f"[{session_name}] Client started successfully")
+            except AuthKeyUnregisteredError:
+                logger.error(f"[{session_name}] Auth key unregistered - session invalid")
+                self.quarantine(session_name, "auth_key_unregistered")
+                return None, {"error": "auth_key_unregistered"}
+            except SessionPasswordNeededError:
+                logger.error(f"[{session_name}] 2FA required")
+                self.quarantine(session_name, "2fa_required")
+                return None, {"error": "2fa_required"}
+            except AUTH_ERRORS as e:
+                self.quarantine(session_name, e.__class__.__name__)
+                return None, {"error": e.__class__.__name__}
+            except Exception as e:
+                logger.error(f"[{session_name}] Failed to start client: {e}")
+                return None, {"error": str(e)}
+
+            self.clients[session_name] = client
+            self._mark_connected(session_name, started)
+            self.users[session_name] += 1
+            return client, None
+
+    async def _reconnect(self, session_name: str) -> bool:
+        client = self.clients.get(session_name)
+        if client is None:
+            return False
+        self._mark_disconnected(session_name)
+        delay = POOL_RECONNECT_BASE_DELAY
+
+        for attempt in range(1, POOL_RECONNECT_ATTEMPTS + 1):
+            started = time.monotonic()
+            try:
+                if not client.is_connected():
+                    await client.connect()
+                if not await client.is_user_authorized():
+                    self.quarantine(session_name, "not_authorized")
+                    return False
+                self._metrics_for(session_name)["reconnects"] += 1
+                self._mark_connected(session_name, started)
+                return True
+            except AUTH_ERRORS as e:
+                self.quarantine(session_name, e.__class__.__name__)
+                return False
+            except Exception as e:
+                logger.warning(f"[{session_name}] Reconnect attempt {attempt} failed: {e}. Next in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, POOL_RECONNECT_MAX_DELAY)
+
+        logger.error(f"[{session_name}] Giving up reconnecting after {POOL_RECONNECT_ATTEMPTS} attempts")
+        return False
+
+    async def check_health(self):
+        """Ping every pooled client once, reconnecting or quarantining as needed"""
+        for session_name in list(self.clients):
+            client = self.clients.get(session_name)
+            if client is None:
+                continue
+            m = self._metrics_for(session_name)
+            try:
+                if not client.is_connected():
+                    raise ConnectionError("disconnected")
+                await client.get_me()
+                m["pings_ok"] += 1
+            except AUTH_ERRORS as e:
+                m["pings_failed"] += 1
+                self.quarantine(session_name, e.__class__.__name__)
+            except FloodWaitError as e:
+                # The connection is fine, the account is just rate limited
+                m["pings_ok"] += 1
+                logger.debug(f"[{session_name}] Health ping hit FloodWait {e.seconds}s")
+            except Exception as e:
+                m["pings_failed"] += 1
+                logger.warning(f"[{session_name}] Health ping failed: {e}")
+                async with self._locks.setdefault(session_name, asyncio.Lock()):
+                    await self._reconnect(session_name)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(POOL_HEALTH_INTERVAL)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"Client pool health check error: {e}")
+
+    def start_health_checks(self):
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    def release(self, session_name: str):
+        """Hand a client back after a run. The connection stays open for the next cycle."""
+        logger.debug(f"[{session_name}] Client returned to pool")
+        self.users[session_name] = max(0, self.users[session_name] - 1)
+        if not self.users[session_name] and session_name in self._retired:
+            self._disconnect(session_name, self._retired.pop(session_name))
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for session_name, m in self.metrics.items():
+            uptime = m["uptime_seconds"] + (now_ts() - m["connected_since"] if m["connected_since"] else 0)
+            limiter = self.limiters.get(session_name) or RpcLimiter()
+            result[session_name] = {
+                "connects": m["connects"],
+                "reconnects": m["reconnects"],
+                "avg_connect_seconds": round(m["connect_seconds_total"] / m["connects"], 3) if m["connects"] else 0.0,
+                "last_connect_seconds": round(m["connect_seconds_last"], 3),
+                "pings_ok": m["pings_ok"],
+                "pings_failed": m["pings_failed"],
+                "uptime_seconds": round(uptime, 1),
+                "rpc_calls": limiter.calls,
+                "rpc_wait_seconds": round(limiter.wait_seconds, 1),
+            }
+        return result
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for session_name, client in list(self.clients.items()):
+            self._mark_disconnected(session_name)
+            try:
+                await client.disconnect()
+                logger.info(f"[{session_name}] Client disconnected")
+            except Exception as e:
+                logger.warning(f"Error disconnecting client: {e}")
+        self.clients.clear()
+        for session_name, client in list(self._retired.items()):
+            self._disconnect(session_name, client)
+        self._retired.clear()
+        await asyncio.gather(*self._disconnects, return_exceptions=True)
+
+client_pool = ClientPool()
+
+# ---------------------------
+# Channel leases (multi-node coordination)
+# ---------------------------
+class SqliteLeaseStore:
+    """Shared store for channel leases and fenced cursors.
+
+    Every acquisition of a channel bumps its fencing token. A cursor write
+    carries the writer's token and is only accepted while that token holds
+    an unexpired lease, so a node that lost its lease (paused, partitioned) cannot move
+    the cursor after another node took over. The same tables work on any SQL database.
+
+    SQLite serializes writers with POSIX byte-range locks on the file, in its
+    default rollback-journal mode (WAL needs shared memory and only works on
+    one host). Across hosts the file must therefore sit on a filesystem whose
+    locks all nodes honour, e.g. NFSv4 or NFSv3 with a working lockd; without
+    that the store is only safe for the processes of a single host.
+
+    The methods block (up to 30 s on a locked database); ChannelLease and
+    acquire_channel_lease call them through asyncio.to_thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()  # One connection, used from worker threads one call at a time
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS leases (
+            channel TEXT PRIMARY KEY, node TEXT NOT NULL, token INTEGER NOT NULL, expires_at REAL NOT NULL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS cursors (
+            channel TEXT PRIMARY KEY, last_id INTEGER NOT NULL, token INTEGER NOT NULL, updated_at REAL NOT NULL)""")
+
+    def acquire(self, channel: str, node: str, ttl: float) -> Optional[int]:
+        """Take the lease if it is free, expired or already ours. Returns the new fencing token or None."""
+        with self.lock:
+            return self._acquire(channel, node, ttl)
+
+    def _acquire(self, channel: str, node: str, ttl: float) -> Optional[int]:
+        now = now_ts()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute("SELECT node, token, expires_at FROM leases WHERE channel = ?", (channel,)).fetchone()
+            if row and row[0] != node and row[2] > now:
+                self.db.execute("ROLLBACK")
+                return None
+            token = (row[1] if row else 0) + 1
+            self.db.execute(
+                "INSERT INTO leases (channel, node, token, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(channel) DO UPDATE SET node = excluded.node, token = excluded.token, "
+                "expires_at = excluded.expires_at",
+                (channel, node, token, now + ttl))
+            self.db.execute("COMMIT")
+            if row and row[0] != node:
+                logger.info(f"Took over expired lease on {channel} from {row[0]}")
+            return token
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def renew(self, channel: str, node: str, token: int, ttl: float) -> bool:
+        with self.lock:
+            cur = self.db.execute(
+                "UPDATE leases SET expires_at = ? WHERE channel = ? AND node = ? AND token = ?",
+                (now_ts() + ttl, channel, node, token))
+            return cur.rowcount == 1
+
+    def release(self, channel: str, node: str, token: int):
+        # The row (and its token) stays so the next holder gets a higher token
+        with self.lock:
+            self.db.execute(
+                "UPDATE leases SET expires_at = 0 WHERE channel = ? AND node = ? AND token = ?",
+                (channel, node, token))
+
+    def load_cursor(self, channel: str) -> int:
+        with self.lock:
+            row = self.db.execute("SELECT last_id FROM cursors WHERE channel = ?", (channel,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def commit_cursor(self, channel: str, last_id: int, token: int) -> bool:
+        """Advance the cursor if `token` still holds the channel's lease"""
+        with self.lock:
+            return self._commit_cursor(channel, last_id, token)
+
+    def _commit_cursor(self, channel: str, last_id: int, token: int) -> bool:
+        now = now_ts()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # Checked against the lease, not the last cursor write: a newer holder
+            # that has not committed yet must still fence out the old one
+            held = self.db.execute("SELECT 1 FROM leases WHERE channel = ? AND token = ? AND expires_at > ?",
+                                   (channel, token, now)).fetchone()
+            if not held:
+                self.db.execute("ROLLBACK")
+                return False
+            self.db.execute(
+                "INSERT INTO cursors (channel, last_id, token, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(channel) DO UPDATE SET last_id = MAX(cursors.last_id, excluded.last_id), "
+                "token = excluded.token, updated_at = excluded.updated_at",
+                (channel, last_id, token, now))
+            self.db.execute("COMMIT")
+            return True
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+class ChannelLease:
+    """A held channel lease with a background heartbeat"""
+
+    def __init__(self, store: SqliteLeaseStore, channel: str, node: str, token: int, cursor: int = 0):
+        self.store = store
+        self.channel = channel
+        self.node = node
+        self.token = token
+        self.lost = False
+        self.cursor = cursor  # Shared cursor when the lease was taken
+        self._task = asyncio.create_task(self._heartbeat())
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(LEASE_TTL / 3)
+            try:
+                renewed = await asyncio.to_thread(self.store.renew, self.channel, self.node, self.token, LEASE_TTL)
+            except Exception as e:
+                # Without a renewal the lease may expire and pass to another node
+                logger.warning(f"Lease renewal on {self.channel} failed: {e}")
+                renewed = False
+            if not renewed:
+                self.lost = True
+                logger.warning(f"Lease on {self.channel} lost (token {self.token})")
+                return
+
+    async def commit(self, last_id: int) -> bool:
+        try:
+            if not self.lost and await asyncio.to_thread(self.store.commit_cursor, self.channel, last_id, self.token):
+                return True
+        except Exception as e:
+            logger.warning(f"Cursor commit for {self.channel} failed: {e}")
+        self.lost = True
+        logger.warning(f"Cursor commit for {self.channel} rejected (token {self.token})")
+        return False
+
+    async def release(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        if not self.lost:
+            try:
+                await asyncio.to_thread(self.store.release, self.channel, self.node, self.token)
+            except Exception as e:
+                # The lease then simply expires after LEASE_TTL
+                logger.warning(f"Lease release on {self.channel} failed: {e}")
+
+_lease_store: Optional[SqliteLeaseStore] = None
+
+async def acquire_channel_lease(username: str) -> tuple[bool, Optional[ChannelLease]]:
+    """Returns (may_crawl, lease). Without a configured store every channel may be crawled without a lease."""
+    global _lease_store
+    if not LEASE_STORE_PATH:
+        return True, None
+    if _lease_store is None:
+        _lease_store = await asyncio.to_thread(SqliteLeaseStore, LEASE_STORE_PATH)
+
+    # Worker processes on one host must not share a lease holder id
+    node = f"{NODE_ID}:{os.getpid()}"
+    channel = username.lower()
+    token = await asyncio.to_thread(_lease_store.acquire, channel, node, LEASE_TTL)
+    if token is None:
+        return False, None
+    cursor = await asyncio.to_thread(_lease_store.load_cursor, channel)
+    return True, ChannelLease(_lease_store, channel, node, token, cursor)
 
-    # Check suspension
+# ---------------------------
+# Enhanced account runner
+# ---------------------------
+def check_account_ready(session_name: str) -> tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Suspension and channel checks shared by all modes. Returns (channels, None) or ([], skip result)."""
     is_suspended, suspended_until = is_account_suspended(session_name)
     if is_suspended:
         remain = int(suspended_until - now_ts())
         logger.info(f"[{session_name}] SUSPENDED until {iso_from_ts(suspended_until)} (remaining {remain}s)")
-        return {"skipped": True, "reason": "suspended"}
+        return [], {"skipped": True, "reason": "suspended"}
 
-    # Load channels
     channels = load_account_channels(session_name)
     if not channels:
         logger.info(f"[{session_name}] No channels found")
-        return {"skipped": True, "reason": "no_channels"}
+        return [], {"skipped": True, "reason": "no_channels"}
+
+    return channels, None
+
+def suspend_account(session_name: str, secs: int) -> float:
+    # Add some buffer time
+    wake_ts = now_ts() + secs + random.randint(60, 300)
+    with file_lock(SUSPENDED_FILE):
+        suspended = load_suspended()
+        suspended[session_name] = wake_ts
+        save_suspended(suspended)
+    return wake_ts
+
+async def run_account(account: Dict[str, Any]) -> Dict[str, Any]:
+    session_name = account["session"]
 
-    # Load last IDs
+    # Check suspension and load channels
+    channels, skip = check_account_ready(session_name)
+    if skip:
+        return skip
+
+    # Load last IDs, counter snapshots and the known-id ledger
     last_ids = load_last_ids_for(session_name)
+    counters = load_counters_for(session_name)
+    ledger = load_ledger_for(session_name)
 
-    # Create client with better settings
-    client = TelegramClient(
-        session_name, 
-        api_id, 
-        api_hash,
-        connection_retries=3,
-        auto_reconnect=True,
-        timeout=30
-    )
-    
-    try:
-        await client.start()
-        logger.info(f"[{session_name}] Client started successfully")
-    except AuthKeyUnregisteredError:
-        logger.error(f"[{session_name}] Auth key unregistered - session invalid")
-        return {"error": "auth_key_unregistered"}
-    except SessionPasswordNeededError:
-        logger.error(f"[{session_name}] 2FA required")
-        return {"error": "2fa_required"}
-    except Exception as e:
-        logger.error(f"[{session_name}] Failed to start client: {e}")
-        return {"error": str(e)}
+    with tracing.span("connect", "account", account=session_name):
+        client, error = await client_pool.acquire(account)
+    if error:
+        return error
+
+    # Failed channels stay out of the rotation until the retry scheduler re-validates them
+    parked = parked_channels()
+    account_channels = channels
+    channels = [ch for ch in channels if ch["username"] not in parked]
+    if len(channels) < len(account_channels):
+        logger.info(f"[{session_name}] {len(account_channels) - len(channels)} failed channels parked for retry")
+
+    # Uploads buffered during a backend outage go out before new ones
+    await drain_upload_buffer(session_name)
+    await recover_pending_uploads(session_name, last_ids)
 
     logger.info(f"[{session_name}] Processing {len(channels)} channels")
+    media = MediaStage(client, session_name)
+    discovery = DiscoveryCollector()
 
     failed_local: List[Dict[str, Any]] = []
     account_counts = {"channels": 0, "messages": 0, "created": 0, "updated": 0}
-    
-    try:
-        for i, ch in enumerate(channels):
-            ch.setdefault("_attempts", 0)
-            username = ch.get("username", "<unknown>")
-            
+    stopped = False
+
+    def count_ok(report: Dict[str, Any]):
+        account_counts["channels"] += 1
+        account_counts["messages"] += report.get("fetched", 0)
+        account_counts["created"] += report.get("created", 0)
+        account_counts["updated"] += report.get("updated", 0)
+
+    async def crawl_channel(i: int, ch: Dict[str, Any]):
+        nonlocal stopped
+        ch.setdefault("_attempts", 0)
+        username = ch.get("username", "<unknown>")
+
+        may_crawl, lease = await acquire_channel_lease(username)
+        if not may_crawl:
+            logger.info(f"[{session_name}] {username} is leased by another node, skipping")
+            return
+        channels_in_progress.inc(account=session_name)
+        try:
+            if lease is not None:
+                # Another node may have moved the shared cursor further
+                last_ids[username] = max(int(last_ids.get(username, 0) or 0), lease.cursor)
+
             # Progress logging
             logger.info(f"[{session_name}] Processing channel {i+1}/{len(channels)}: {username}")
 
             # Delay between channels
             delay = random.uniform(MIN_DELAY_BETWEEN_CHANNELS, MAX_DELAY_BETWEEN_CHANNELS)
-            await asyncio.sleep(delay)
+            with tracing.span("sleep", "sleep"):
+                await asyncio.sleep(delay)
 
-            report = await fetch_channel_messages(client, session_name, ch, last_ids)
+            report = await fetch_channel_messages(client, session_name, ch, last_ids, counters, ledger, lease, media, discovery)
 
             if report.get("status") == "ok":
-                fetched = report.get("fetched", 0)
-                created = report.get("created", 0)
-                updated = report.get("updated", 0)
-                account_counts["channels"] += 1
-                account_counts["messages"] += fetched
-                account_counts["created"] += created
-                account_counts["updated"] += updated
-                logger.info(f"[{session_name}] {username} -> fetched {fetched} (created {created}, updated {updated})")
+                count_ok(report)
+                logger.info(f"[{session_name}] {username} -> fetched {report.get('fetched', 0)} "
+                            f"(created {report.get('created', 0)}, updated {report.get('updated', 0)})")
 
             elif report.get("status") == "flood":
                 secs = report.get("seconds", 3600)
-                # Add some buffer time
-                wake_ts = now_ts() + secs + random.randint(60, 300)
-                
-                suspended = load_suspended()
-                suspended[session_name] = wake_ts
-                save_suspended(suspended)
-                
+                wake_ts = suspend_account(session_name, secs)
+
                 # Save channel for retry
                 failed_local.append({
-                    "username": username, 
-                    "is_adults": bool(ch.get("is_adults", False)), 
+                    "username": username,
+                    "is_adults": bool(ch.get("is_adults", False)),
                     "reason": f"flood_{secs}s"
                 })
-                
+
                 logger.warning(f"[{session_name}] FloodWait {secs}s on {username}. Account suspended until {iso_from_ts(wake_ts)}")
-                break  # Stop processing for this account
+                stopped = True  # Stop processing for this account
 
-            elif report.get("status") in ["not_found", "auth_error"]:
+            elif report.get("status") == "auth_error":
+                if not stopped:
+                    client_pool.quarantine(session_name, report.get("reason", "auth_error"))
+                stopped = True  # The account itself is unusable
+
+            elif report.get("reason") == "lease_lost":
+                # Another node owns the channel now; it is not a channel failure
+                logger.warning(f"[{session_name}] {username} -> lease lost, leaving it to the new holder")
+
+            elif report.get("status") == "not_found":
                 failed_local.append({
-                    "username": username, 
-                    "is_adults": bool(ch.get("is_adults", False)), 
+                    "username": username,
+                    "is_adults": bool(ch.get("is_adults", False)),
                     "reason": report.get("reason", "not_found")
                 })
                 logger.info(f"[{session_name}] {username} -> {report.get('reason', 'not_found')}")
@@ -595,11 +2637,11 @@ async def run_account(account: Dict[str, Any]) -> Dict[str, Any]:
                 # Handle other errors with retry logic
                 reason = report.get("reason", "unknown")
                 ch["_attempts"] = ch.get("_attempts", 0) + 1
-                
+
                 if ch["_attempts"] >= MAX_ATTEMPTS:
                     failed_local.append({
-                        "username": username, 
-                        "is_adults": bool(ch.get("is_adults", False)), 
+                        "username": username,
+                        "is_adults": bool(ch.get("is_adults", False)),
                         "reason": reason
                     })
                     logger.warning(f"[{session_name}] {username} permanently failed: {reason}")
@@ -608,56 +2650,93 @@ async def run_account(account: Dict[str, Any]) -> Dict[str, Any]:
                     # Retry with exponential backoff
                     backoff = random.randint(5, 15) + (ch["_attempts"] * 10)
                     logger.info(f"[{session_name}] {username} error: {reason}. Retrying after {backoff}s")
-                    await asyncio.sleep(backoff)
-                    
+                    with tracing.span("sleep", "sleep", backoff=backoff):
+                        await asyncio.sleep(backoff)
+                    if stopped:
+                        return
+
                     # Single retry attempt
-                    retry_report = await fetch_channel_messages(client, session_name, ch, last_ids)
+                    retry_report = await fetch_channel_messages(client, session_name, ch, last_ids, counters, ledger, lease, media, discovery)
                     if retry_report.get("status") == "ok":
-                        fetched = retry_report.get("fetched", 0)
-                        created = retry_report.get("created", 0)
-                        updated = retry_report.get("updated", 0)
-                        account_counts["channels"] += 1
-                        account_counts["messages"] += fetched
-                        account_counts["created"] += created
-                        account_counts["updated"] += updated
-                        logger.info(f"[{session_name}] {username} (retry) -> fetched {fetched}")
+                        count_ok(retry_report)
+                        logger.info(f"[{session_name}] {username} (retry) -> fetched {retry_report.get('fetched', 0)}")
                     else:
                         failed_local.append({
-                            "username": username, 
-                            "is_adults": bool(ch.get("is_adults", False)), 
+                            "username": username,
+                            "is_adults": bool(ch.get("is_adults", False)),
                             "reason": f"retry_failed: {reason}"
                         })
                         logger.warning(f"[{session_name}] {username} retry failed")
                         stats["public"]["errors"] += 1
+        finally:
+            channels_in_progress.dec(account=session_name)
+            if lease is not None:
+                await lease.release()
+
+    # CHANNEL_CONCURRENCY workers take channels in order; the account's RpcLimiter
+    # paces their requests, so overlapping sleeps and uploads no longer cost throughput
+    pending_channels = iter(enumerate(channels))
+
+    async def channel_worker():
+        for i, ch in pending_channels:
+            if stopped:
+                break
+            # A channel is traced as a whole or not at all
+            with tracing.span("channel", sample=TRACE_SAMPLE, account=session_name, channel=ch.get("username")):
+                await crawl_channel(i, ch)
+
+    workers = [asyncio.create_task(channel_worker(), name=f"{session_name}/worker-{n}")
+               for n in range(min(CHANNEL_CONCURRENCY, len(channels)))]
+    
+    try:
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        discovery.flush()
+
+        if not stopped:
+            try:
+                idle = await run_idle_tasks(client, session_name, account_channels)
+                logger.info(f"[{session_name}] Idle work: " + ", ".join(f"{k} {v}" for k, v in idle.items()))
+            except FloodWaitError as e:
+                flood_wait_seconds_total.inc(int(getattr(e, "seconds", 3600)), account=session_name, channel="")
+                wake_ts = suspend_account(session_name, int(getattr(e, "seconds", 3600)))
+                logger.warning(f"[{session_name}] FloodWait during idle work. Account suspended until {iso_from_ts(wake_ts)}")
+            except Exception as e:
+                # Idle work is optional; the channel results above still count
+                logger.error(f"[{session_name}] Idle work failed: {e}")
 
     except Exception as e:
         logger.error(f"[{session_name}] Unexpected error in run_account: {e}")
         return {"error": f"unexpected: {str(e)}"}
     finally:
         # Cleanup
+        try:
+            await media.close()
+        except Exception as e:
+            logger.error(f"Error saving photo cache state: {e}")
+
         try:
             save_last_ids_for(session_name, last_ids)
         except Exception as e:
             logger.error(f"Error saving last IDs: {e}")
-        
+
         try:
-            await client.disconnect()
-            logger.info(f"[{session_name}] Client disconnected")
+            save_counters_for(session_name, counters)
+            save_ledger_for(session_name, ledger)
         except Exception as e:
-            logger.warning(f"Error disconnecting client: {e}")
+            logger.error(f"Error saving counters/ledger: {e}")
+        
+        client_pool.release(session_name)
 
     # Update failed channels file
     if failed_local:
         try:
-            global_failed = load_json(FAILED_FILE, [])
-            existing_usernames = {f.get("username") for f in global_failed}
-            
-            for f in failed_local:
-                if f.get("username") not in existing_usernames:
-                    global_failed.append(f)
-                    existing_usernames.add(f.get("username"))
-            
-            save_failed_channels(global_failed)
+            record_failed_channels(failed_local)
         except Exception as e:
             logger.error(f"Error updating failed channels: {e}")
 
@@ -668,53 +2747,776 @@ async def run_account(account: Dict[str, Any]) -> Dict[str, Any]:
     return {"skipped": False, "counts": account_counts, "failed_count": len(failed_local)}
 
 # ---------------------------
-# Main entry point
+# Maintenance runners (refresh, sweep)
 # ---------------------------
-async def main():
-    logger.info("=== Telegram Crawler Starting ===")
-    
+async def run_account_pass(
+    account: Dict[str, Any],
+    mode: str,
+    select: Callable[[Dict[str, Any]], bool],
+    process: Callable[[TelegramClient, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+    save: Callable[[], None],
+) -> Dict[str, Any]:
+    """Run `process` over the selected channels of an account with the usual
+    suspension, flood and error handling. Each channel is processed under its
+    lease, so nodes sharing a lease store never work the same channel at once.
+    Numeric report fields are summed into stats[mode]."""
+    session_name = account["session"]
+
+    channels, skip = check_account_ready(session_name)
+    if skip:
+        return skip
+
+    channels = [ch for ch in channels if select(ch)]
+    if not channels:
+        logger.info(f"[{session_name}] Nothing to {mode}")
+        return {"skipped": True, "reason": f"nothing_to_{mode}"}
+
+    client, error = await client_pool.acquire(account)
+    if error:
+        return error
+
+    logger.info(f"[{session_name}] Running {mode} on {len(channels)} channels")
+    account_counts = {k: 0 for k in stats[mode] if k != "errors"}
+    failed_count = 0
+
     try:
-        for account in ACCOUNTS:
-            session_name = account["session"]
-            logger.info(f"--- Processing Account: {session_name} ---")
-            
-            result = await run_account(account)
-            
-            if result.get("skipped"):
-                reason = result.get("reason", "unknown")
-                logger.info(f"[{session_name}] Skipped: {reason}")
-            elif result.get("error"):
-                logger.error(f"[{session_name}] Error: {result['error']}")
+        for ch in channels:
+            username = ch["username"]
+            may_crawl, lease = await acquire_channel_lease(username)
+            if not may_crawl:
+                logger.info(f"[{session_name}] {username} is leased by another node, skipping {mode}")
+                continue
+            try:
+                await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_CHANNELS, MAX_DELAY_BETWEEN_CHANNELS))
+                report = await process(client, ch)
+            finally:
+                if lease is not None:
+                    await lease.release()
+
+            if report.get("status") == "ok":
+                account_counts["channels"] += 1
+                for key in account_counts:
+                    if key != "channels":
+                        account_counts[key] += report.get(key, 0)
+                logger.info(f"[{session_name}] {username} {mode} -> "
+                            + ", ".join(f"{k} {report.get(k, 0)}" for k in account_counts if k != "channels"))
+            elif report.get("status") == "flood":
+                wake_ts = suspend_account(session_name, report.get("seconds", 3600))
+                logger.warning(f"[{session_name}] FloodWait during {mode}. Account suspended until {iso_from_ts(wake_ts)}")
+                break
+            elif report.get("status") == "auth_error":
+                client_pool.quarantine(session_name, report.get("reason", "auth_error"))
+                break
+            else:
+                failed_count += 1
+                stats[mode]["errors"] += 1
+                logger.info(f"[{session_name}] {username} {mode} -> {report.get('reason', 'unknown')}")
+
+    except Exception as e:
+        logger.error(f"[{session_name}] Unexpected error in {mode}: {e}")
+        return {"error": f"unexpected: {str(e)}"}
+    finally:
+        try:
+            save()
+        except Exception as e:
+            logger.error(f"Error saving {mode} state: {e}")
+
+        client_pool.release(session_name)
+
+    for key in account_counts:
+        stats[mode][key] += account_counts[key]
+
+    return {"skipped": False, "counts": account_counts, "failed_count": failed_count}
+
+async def run_account_refresh(account: Dict[str, Any]) -> Dict[str, Any]:
+    session_name = account["session"]
+    counters = load_counters_for(session_name)
+
+    return await run_account_pass(
+        account, "refresh",
+        select=lambda ch: bool(counters.get(ch["username"])),
+        process=lambda client, ch: refresh_channel_counters(client, session_name, ch, counters),
+        save=lambda: save_counters_for(session_name, counters),
+    )
+
+async def run_account_sweep(account: Dict[str, Any]) -> Dict[str, Any]:
+    session_name = account["session"]
+    counters = load_counters_for(session_name)
+    ledger = load_ledger_for(session_name)
+    cursors = load_sweep_for(session_name)
+
+    def save():
+        save_ledger_for(session_name, ledger)
+        save_sweep_for(session_name, cursors)
+        save_counters_for(session_name, counters)
+
+    return await run_account_pass(
+        account, "sweep",
+        select=lambda ch: bool((ledger.get(ch["username"]) or {}).get("known")),
+        process=lambda client, ch: sweep_channel(client, session_name, ch, ledger, cursors, counters),
+        save=save,
+    )
+
+async def run_account_gaps(account: Dict[str, Any]) -> Dict[str, Any]:
+    session_name = account["session"]
+    last_ids = load_last_ids_for(session_name)
+    ledger = load_ledger_for(session_name)
+
+    return await run_account_pass(
+        account, "gaps",
+        select=lambda ch: bool(find_gaps(ledger.get(ch["username"]), int(last_ids.get(ch["username"], 0) or 0), 1)),
+        process=lambda client, ch: fill_channel_gaps(client, session_name, ch, last_ids, ledger),
+        save=lambda: save_ledger_for(session_name, ledger),
+    )
+
+# ---------------------------
+# Live ingestion
+# ---------------------------
+class TelethonUpdateSource:
+    """Feeds new-message and edit events of the given chats into a queue as
+    (kind, peer_id, message) tuples. Any object with the same start/stop
+    interface can stand in for it, e.g. a fake source replaying messages."""
+
+    def __init__(self, client: TelegramClient, chats: List[Any]):
+        self.client = client
+        self.chats = chats
+        self._handler = None
+
+    async def start(self, queue: asyncio.Queue):
+        async def on_update(event):
+            kind = "edit" if isinstance(event, events.MessageEdited.Event) else "new"
+            await queue.put((kind, event.chat_id, event.message))
+
+        self._handler = on_update
+        self.client.add_event_handler(on_update, events.NewMessage(chats=self.chats))
+        self.client.add_event_handler(on_update, events.MessageEdited(chats=self.chats))
+
+    async def stop(self):
+        if self._handler:
+            self.client.remove_event_handler(self._handler)
+            self._handler = None
+
+async def resolve_joined_channels(client: TelegramClient, channels: List[Dict[str, Any]]) -> Dict[int, tuple[Any, Dict[str, Any]]]:
+    """Map peer id -> (entity, channel) for account channels that are in the dialog list"""
+    wanted = {ch["username"].lower(): ch for ch in channels}
+    joined = {}
+    async for dialog in client.iter_dialogs():
+        entity = dialog.entity
+        uname = (getattr(entity, "username", None) or "").lower()
+        if getattr(dialog, "is_channel", False) and uname in wanted:
+            joined[utils.get_peer_id(entity)] = (entity, wanted[uname])
+    return joined
+
+async def upload_live_batch(
+    session_name: str,
+    entity: Any,
+    channel: Dict[str, Any],
+    msgs: List[Any],
+    last_ids: Dict[str, int],
+    counters: Dict[str, Dict[str, List]],
+    ledger: Dict[str, Dict[str, List[List[int]]]],
+    media: Optional[MediaStage] = None,
+    lease: Optional[ChannelLease] = None,
+) -> Optional[tuple[int, int]]:
+    username = channel["username"]
+    is_adults = bool(channel.get("is_adults", False))
+    last_id = int(last_ids.get(username, 0) or 0)
+    batch = MessageBatch()
+
+    for msg in msgs:
+        try:
+            batch.add(msg, media)
+        except Exception as e:
+            logger.warning(f"Error processing message {getattr(msg, 'id', 'unknown')}: {e}")
+
+    if not batch:
+        return 0, 0
+
+    batch.sort()
+    batch_counters = {str(msg_id): batch.counters_row(i) for i, msg_id in enumerate(batch.ids)}
+    payloads = batch.payloads(entity, is_adults, media)
+
+    created, updated = await send_to_api(payloads, session_name, username)
+    if created is None:
+        # Not in the ledger, so the cursor stays below them and the catch-up fetches them
+        stats["live"]["errors"] += 1
+        return None
+
+    # The cursor only moves over ids without gaps below them. Events after a
+    # reconnect are ahead of it until the catch-up has fetched what was missed.
+    remember_uploaded(username, payloads, batch_counters, last_id, counters, ledger)
+    cursor = contiguous_id(ledger_for_channel(ledger, username, last_id), last_id)
+    if cursor > last_id:
+        last_ids[username] = cursor
+        save_last_ids_for(session_name, last_ids)
+        if lease is not None and not await lease.commit(cursor):
+            logger.warning(f"[{session_name}] {username} -> lease lost, leaving it to the new holder")
+
+    stats["live"]["messages"] += len(payloads)
+    messages_total.inc(len(payloads), account=session_name, channel=username)
+    stats["live"]["created"] += created
+    stats["live"]["updated"] += updated
+    return created, updated
+
+async def consume_live_updates(
+    queue: asyncio.Queue,
+    session_name: str,
+    joined: Dict[int, tuple[Any, Dict[str, Any]]],
+    last_ids: Dict[str, int],
+    counters: Dict[str, Dict[str, List]],
+    ledger: Dict[str, Dict[str, List[List[int]]]],
+    media: Optional[MediaStage] = None,
+    leases: Optional[Dict[str, ChannelLease]] = None,
+):
+    """Collect updates for up to LIVE_FLUSH_INTERVAL seconds or BATCH_SIZE
+    messages, then upload them per channel. A later edit replaces an earlier
+    version of the same message within one flush. Channels whose lease was
+    lost are dropped."""
+    leases = leases or {}
+    loop = asyncio.get_running_loop()
+    pending: Dict[int, Dict[int, Any]] = {}
+    size = 0
+    deadline = None
+
+    while True:
+        timeout = None if deadline is None else max(0.0, deadline - loop.time())
+        try:
+            kind, peer_id, msg = await asyncio.wait_for(queue.get(), timeout)
+            if peer_id in joined and getattr(msg, "id", None):
+                pending.setdefault(peer_id, {})[msg.id] = msg
+                size += 1
+                if deadline is None:
+                    deadline = loop.time() + LIVE_FLUSH_INTERVAL
+            if size < BATCH_SIZE and (deadline is None or loop.time() < deadline):
+                continue
+        except asyncio.TimeoutError:
+            pass
+
+        for peer_id, msgs in pending.items():
+            entity, channel = joined[peer_id]
+            lease = leases.get(channel["username"])
+            if lease is not None and lease.lost:
+                continue
+            await upload_live_batch(session_name, entity, channel, list(msgs.values()), last_ids, counters, ledger,
+                                    media, lease)
+        pending = {}
+        size = 0
+        deadline = None
+
+async def live_catch_up(
+    client: TelegramClient,
+    session_name: str,
+    channel: Dict[str, Any],
+    last_ids: Dict[str, int],
+    counters: Dict[str, Dict[str, List]],
+    ledger: Dict[str, Dict[str, List[List[int]]]],
+    media: Optional[MediaStage] = None,
+    lease: Optional[ChannelLease] = None,
+) -> Dict[str, Any]:
+    """Poll a channel from its cursor, then fetch by id every id between the
+    cursor and the newest uploaded id that is still missing: messages posted
+    while disconnected, below live events that were uploaded first, and
+    older messages a newest-first page skipped. The cursor ends on the
+    highest id without gaps below it."""
+    username = channel["username"]
+    mark = int(last_ids.get(username, 0) or 0)
+    report = await fetch_channel_messages(client, session_name, channel, last_ids, counters, ledger, lease, media)
+    if report.get("status") != "ok":
+        return report
+
+    entry = ledger_for_channel(ledger, username, mark)
+    newest = entry["known"][-1][1] if entry["known"] else mark
+    missing = ranges_missing(ranges_add(entry["known"] + entry["absent"], ()), mark + 1, newest, GAP_MAX_IDS_PER_CHANNEL)
+    report.update(filled=0, absent=0)
+    if missing:
+        try:
+            entity = await client.get_entity(username)
+            logger.info(f"[{session_name}] Catching up {len(missing)} missed ids of {username}")
+            if not await upload_ids(client, session_name, entity, username, bool(channel.get("is_adults", False)),
+                                    missing, entry, report):
+                return {"status": "error", "reason": "api_error"}
+        except Exception as e:
+            return telegram_error_report(e, session_name, username)
+
+    # Ids beyond GAP_MAX_IDS_PER_CHANNEL are fetched on the next catch-up
+    last_ids[username] = contiguous_id(entry, mark)
+    save_last_ids_for(session_name, last_ids)
+    if lease is not None and last_ids[username] > mark and not await lease.commit(last_ids[username]):
+        return {"status": "error", "reason": "lease_lost"}
+    return report
+
+async def live_poll_loop(
+    client: TelegramClient,
+    session_name: str,
+    channels: List[Dict[str, Any]],
+    last_ids: Dict[str, int],
+    counters: Dict[str, Dict[str, List]],
+    ledger: Dict[str, Dict[str, List[List[int]]]],
+    interval: float,
+    wake: Optional[asyncio.Event] = None,
+    media: Optional[MediaStage] = None,
+    leases: Optional[Dict[str, ChannelLease]] = None,
+):
+    """Catch up channels (see live_catch_up) every `interval` seconds, or
+    immediately when `wake` is set (after a reconnect). Channels whose lease
+    was lost are skipped."""
+    leases = leases or {}
+    while True:
+        for ch in channels:
+            lease = leases.get(ch["username"])
+            if lease is not None and lease.lost:
+                continue
+            report = await live_catch_up(client, session_name, ch, last_ids, counters, ledger, media, lease)
+            if report.get("status") == "ok":
+                stats["live"]["messages"] += report.get("fetched", 0) + report.get("filled", 0)
+                stats["live"]["created"] += report.get("created", 0)
+                stats["live"]["updated"] += report.get("updated", 0)
+            elif report.get("reason") == "lease_lost":
+                logger.warning(f"[{session_name}] {ch['username']} -> lease lost, leaving it to the new holder")
+            elif report.get("status") == "flood":
+                # Updates keep arriving while polling waits out the flood
+                wake_ts = suspend_account(session_name, report.get("seconds", 3600))
+                logger.warning(f"[{session_name}] FloodWait while polling. Polling paused until {iso_from_ts(wake_ts)}")
+                await asyncio.sleep(max(0.0, wake_ts - now_ts()))
+            else:
+                stats["live"]["errors"] += 1
+                logger.info(f"[{session_name}] {ch['username']} poll -> {report.get('reason', 'unknown')}")
+            await asyncio.sleep(random.uniform(MIN_DELAY_BETWEEN_CHANNELS, MAX_DELAY_BETWEEN_CHANNELS))
+
+        save_counters_for(session_name, counters)
+        save_ledger_for(session_name, ledger)
+        if media is not None:
+            save_photos_for(session_name, media.state)
+
+        try:
+            if wake is None:
+                await asyncio.sleep(interval)
             else:
-                counts = result.get("counts", {})
-                failed_count = result.get("failed_count", 0)
-                logger.info(f"[{session_name}] Completed - Channels: {counts.get('channels', 0)}, "
-                           f"Messages: {counts.get('messages', 0)}, Failed: {failed_count}")
+                await asyncio.wait_for(wake.wait(), interval)
+                wake.clear()
+                logger.info(f"[{session_name}] Catching up after reconnect")
+        except asyncio.TimeoutError:
+            pass
+
+async def live_watchdog(client: TelegramClient, session_name: str, reconnected: asyncio.Event):
+    was_connected = True
+    while True:
+        await asyncio.sleep(LIVE_WATCHDOG_INTERVAL)
+        connected = client.is_connected()
+        if connected and not was_connected:
+            logger.info(f"[{session_name}] Connection restored")
+            reconnected.set()
+        elif was_connected and not connected:
+            logger.warning(f"[{session_name}] Connection lost")
+        was_connected = connected
+
+async def lease_live_channels(
+    session_name: str,
+    channels: List[Dict[str, Any]],
+    last_ids: Dict[str, int],
+    leases: Dict[str, ChannelLease],
+) -> List[Dict[str, Any]]:
+    """Channels this node may follow, with their leases added to `leases`.
+    The leases are held (and heartbeated) for the whole live run."""
+    kept = []
+    for ch in channels:
+        username = ch["username"]
+        may_crawl, lease = await acquire_channel_lease(username)
+        if not may_crawl:
+            logger.info(f"[{session_name}] {username} is leased by another node, not followed")
+            continue
+        if lease is not None:
+            leases[username] = lease
+            last_ids[username] = max(int(last_ids.get(username, 0) or 0), lease.cursor)
+        kept.append(ch)
+    return kept
+
+async def run_account_live(account: Dict[str, Any], source_factory=TelethonUpdateSource) -> Dict[str, Any]:
+    """Receive updates for joined channels and poll the others until cancelled"""
+    session_name = account["session"]
+
+    channels, skip = check_account_ready(session_name)
+    if skip:
+        return skip
 
-            # Longer delay between accounts
-            delay = random.uniform(3.0, 8.0)
+    last_ids = load_last_ids_for(session_name)
+    counters = load_counters_for(session_name)
+    ledger = load_ledger_for(session_name)
+
+    with tracing.span("connect", "account", account=session_name):
+        client, error = await client_pool.acquire(account)
+    if error:
+        return error
+
+    source = None
+    media = MediaStage(client, session_name)
+    tasks: List[asyncio.Task] = []
+    leases: Dict[str, ChannelLease] = {}
+    try:
+        channels = await lease_live_channels(session_name, channels, last_ids, leases)
+        joined = await resolve_joined_channels(client, channels)
+        joined_names = {ch["username"] for _, ch in joined.values()}
+        joined_channels = [ch for ch in channels if ch["username"] in joined_names]
+        polled_channels = [ch for ch in channels if ch["username"] not in joined_names]
+        stats["live"]["channels"] += len(channels)
+        logger.info(f"[{session_name}] Live: {len(joined_channels)} joined channels, {len(polled_channels)} polled")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        source = source_factory(client, [entity for entity, _ in joined.values()])
+        await source.start(queue)
+
+        reconnected = asyncio.Event()
+        tasks.append(asyncio.create_task(consume_live_updates(
+            queue, session_name, joined, last_ids, counters, ledger, media, leases)))
+        tasks.append(asyncio.create_task(live_watchdog(client, session_name, reconnected)))
+        if joined_channels:
+            # Startup catch-up plus periodic/reconnect polls cover updates missed while disconnected
+            tasks.append(asyncio.create_task(live_poll_loop(
+                client, session_name, joined_channels, last_ids, counters, ledger, LIVE_CATCHUP_INTERVAL, reconnected,
+                media, leases)))
+        if polled_channels:
+            tasks.append(asyncio.create_task(live_poll_loop(
+                client, session_name, polled_channels, last_ids, counters, ledger, LIVE_POLL_INTERVAL,
+                media=media, leases=leases)))
+
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception():
+                logger.error(f"[{session_name}] Live task failed: {task.exception()}")
+                return {"error": f"live: {task.exception()}"}
+        return {"skipped": False, "counts": {}, "failed_count": 0}
+
+    except Exception as e:
+        logger.error(f"[{session_name}] Unexpected error in live mode: {e}")
+        return {"error": f"unexpected: {str(e)}"}
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if source:
+            await source.stop()
+        for lease in leases.values():
+            await lease.release()
+
+        try:
+            await media.close(timeout=5.0)
+        except Exception as e:
+            logger.error(f"Error saving photo cache state: {e}")
+
+        try:
+            save_last_ids_for(session_name, last_ids)
+            save_counters_for(session_name, counters)
+            save_ledger_for(session_name, ledger)
+        except Exception as e:
+            logger.error(f"Error saving live state: {e}")
+
+        client_pool.release(session_name)
+
+# ---------------------------
+# Main entry point
+# ---------------------------
+MODES = {
+    "crawl": run_account,
+    "refresh": run_account_refresh,
+    "sweep": run_account_sweep,
+    "gaps": run_account_gaps,
+    "live": run_account_live,
+}
+
+def log_account_result(session_name: str, result: Dict[str, Any]):
+    if result.get("skipped"):
+        reason = result.get("reason", "unknown")
+        logger.info(f"[{session_name}] Skipped: {reason}")
+    elif result.get("error"):
+        logger.error(f"[{session_name}] Error: {result['error']}")
+    else:
+        counts = result.get("counts", {})
+        failed_count = result.get("failed_count", 0)
+        logger.info(f"[{session_name}] Completed - "
+                    + ", ".join(f"{k.capitalize()}: {v}" for k, v in counts.items())
+                    + f", Failed: {failed_count}")
+
+async def run_cycle(mode: str):
+    runner = MODES[mode]
+
+    if mode == "live":
+        # Live accounts run side by side until interrupted
+        results = await asyncio.gather(*(runner(account) for account in ACCOUNTS))
+        for account, result in zip(ACCOUNTS, results):
+            log_account_result(account["session"], result)
+        return
+
+    for account in ACCOUNTS:
+        session_name = account["session"]
+        logger.info(f"--- Processing Account: {session_name} ---")
+
+        with tracing.span("account", "account", account=session_name, mode=mode):
+            result = await runner(account)
+        log_account_result(session_name, result)
+
+        # Longer delay between accounts
+        delay = random.uniform(3.0, 8.0)
+        with tracing.span("sleep", "sleep"):
             await asyncio.sleep(delay)
 
+async def main(mode: str = "crawl", loop_interval: float = 0, on_cycle: Optional[Callable[[], None]] = None):
+    logger.info(f"=== Telegram Crawler Starting ({mode}) ===")
+    on_cycle = on_cycle or (lambda: log_summary(mode))
+    compaction = asyncio.create_task(archive_compaction_loop()) if archive is not None else None
+    daemon = bool(loop_interval) or mode == "live"
+    metrics_server = await metrics.serve(METRICS_HOST, METRICS_PORT) if daemon and METRICS_PORT else None
+    if TRACE_FILE:
+        tracing.start(TRACE_FILE)
+
+    try:
+        if daemon:
+            client_pool.start_health_checks()
+
+        while True:
+            await run_cycle(mode)
+            on_cycle()
+            tracing.flush()
+            if not loop_interval or mode == "live":
+                break
+            logger.info(f"Next {mode} cycle in {loop_interval:.0f}s")
+            await asyncio.sleep(loop_interval)
+
     except KeyboardInterrupt:
         logger.info("Interrupted by user")
-        return
     except Exception as e:
         logger.error(f"Unexpected error in main: {e}")
-        return
-
-    # Final summary
+    finally:
+        if compaction is not None:
+            compaction.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        await client_pool.close()
+        tracing.stop()
+        if not daemon and METRICS_FILE:
+            try:
+                metrics.write_file(METRICS_FILE)
+            except OSError as e:
+                logger.error(f"Error writing metrics to {METRICS_FILE}: {e}")
+
+def log_summary(mode: str, totals: Optional[Dict[str, Dict[str, int]]] = None,
+                pools: Optional[Dict[str, Dict[str, float]]] = None):
+    totals = totals if totals is not None else stats
+    pools = pools if pools is not None else client_pool.summary()
     logger.info("\n" + "="*50)
     logger.info("📊 FINAL SUMMARY:")
-    logger.info(f"Channels processed: {stats['public']['channels']}")
-    logger.info(f"Messages fetched: {stats['public']['messages']}")
-    logger.info(f"Records created: {stats['public']['created']}")
-    logger.info(f"Records updated: {stats['public']['updated']}")
-    logger.info(f"Errors encountered: {stats['public']['errors']}")
+    if mode == "refresh":
+        logger.info(f"Channels refreshed: {totals['refresh']['channels']}")
+        logger.info(f"Messages checked: {totals['refresh']['checked']}")
+        logger.info(f"Records updated: {totals['refresh']['updated']}")
+        logger.info(f"Errors encountered: {totals['refresh']['errors']}")
+    elif mode == "sweep":
+        logger.info(f"Channels swept: {totals['sweep']['channels']}")
+        logger.info(f"Messages checked: {totals['sweep']['checked']}")
+        logger.info(f"Deletions found: {totals['sweep']['deleted']}")
+        logger.info(f"Errors encountered: {totals['sweep']['errors']}")
+    elif mode == "gaps":
+        logger.info(f"Channels checked: {totals['gaps']['channels']}")
+        logger.info(f"Missing ids found: {totals['gaps']['missing']}")
+        logger.info(f"Messages filled: {totals['gaps']['filled']}")
+        logger.info(f"Ids absent on Telegram: {totals['gaps']['absent']}")
+        logger.info(f"Errors encountered: {totals['gaps']['errors']}")
+    elif mode == "live":
+        logger.info(f"Channels watched: {totals['live']['channels']}")
+        logger.info(f"Messages ingested: {totals['live']['messages']}")
+        logger.info(f"Records created: {totals['live']['created']}")
+        logger.info(f"Records updated: {totals['live']['updated']}")
+        logger.info(f"Errors encountered: {totals['live']['errors']}")
+    else:
+        logger.info(f"Channels processed: {totals['public']['channels']}")
+        logger.info(f"Messages fetched: {totals['public']['messages']}")
+        logger.info(f"Records created: {totals['public']['created']}")
+        logger.info(f"Records updated: {totals['public']['updated']}")
+        logger.info(f"Errors encountered: {totals['public']['errors']}")
+    for session_name, m in pools.items():
+        logger.info(f"[{session_name}] Client: connects {m['connects']} (avg {m['avg_connect_seconds']}s), "
+                    f"reconnects {m['reconnects']}, pings {m['pings_ok']}/{m['pings_ok'] + m['pings_failed']} ok, "
+                    f"uptime {m['uptime_seconds']}s, requests {m.get('rpc_calls', 0)} "
+                    f"(paced {m.get('rpc_wait_seconds', 0)}s)")
+    breaker = upload_breaker.summary()
+    if breaker["trips"] or breaker["buffered"]:
+        logger.info(f"Import API: circuit opened {breaker['trips']} times, {breaker['buffered']} uploads buffered, "
+                    f"{breaker['replayed']} replayed, retries {breaker['retries']} "
+                    f"({breaker['retries_denied']} denied by budget)")
     logger.info("="*50)
 
+# ---------------------------
+# Multi-process supervisor
+# ---------------------------
+def shard_accounts(accounts: List[Dict[str, Any]], workers: int) -> List[List[Dict[str, Any]]]:
+    shards = [accounts[i::workers] for i in range(workers)]
+    return [shard for shard in shards if shard]
+
+def merge_stats(snapshots) -> Dict[str, Dict[str, int]]:
+    totals: Dict[str, Dict[str, int]] = {mode: {k: 0 for k in counts} for mode, counts in stats.items()}
+    for snapshot in snapshots:
+        for mode, counts in snapshot.items():
+            for key, value in counts.items():
+                totals.setdefault(mode, {}).setdefault(key, 0)
+                totals[mode][key] += value
+    return totals
+
+def worker_main(shard: int, accounts: List[Dict[str, Any]], mode: str, loop_interval: float, events) -> None:
+    """Worker process entry point: runs one account shard on its own event loop
+    and reports its stats to the supervisor after every cycle."""
+    global ACCOUNTS, METRICS_PORT, METRICS_FILE, TRACE_FILE
+    ACCOUNTS = accounts
+    # One endpoint / file per shard
+    if METRICS_PORT:
+        METRICS_PORT += shard
+    if METRICS_FILE:
+        root, ext = os.path.splitext(METRICS_FILE)
+        METRICS_FILE = f"{root}-{shard}{ext}"
+    if TRACE_FILE:
+        root, ext = os.path.splitext(TRACE_FILE)
+        TRACE_FILE = f"{root}-{shard}{ext}"
+    names = ", ".join(a["session"] for a in accounts)
+    logger.info(f"[shard {shard}] Worker {os.getpid()} started for {names}")
+
+    def report():
+        events.put(("cycle", shard, json.loads(json.dumps(stats)), client_pool.summary()))
+
+    try:
+        asyncio.run(main(mode, loop_interval, on_cycle=report))
+    except KeyboardInterrupt:
+        pass
+    report()
+
+def supervise(mode: str, loop_interval: float, workers: int):
+    """Run account shards in separate worker processes, restart crashed shards
+    and print one combined summary for all of them."""
+    ctx = multiprocessing.get_context("spawn")
+    events = ctx.Queue()
+    shards = shard_accounts(ACCOUNTS, workers)
+    procs: Dict[int, Any] = {}
+    restarts = {i: 0 for i in range(len(shards))}
+    restart_at: Dict[int, float] = {}
+    snapshots: Dict[int, Dict[str, Dict[str, int]]] = {}
+    pools: Dict[str, Dict[str, float]] = {}
+    reported: set = set()
+    long_running = bool(loop_interval) or mode == "live"
+
+    def spawn(i: int):
+        p = ctx.Process(target=worker_main, args=(i, shards[i], mode, loop_interval, events), name=f"crawler-shard-{i}")
+        p.start()
+        procs[i] = p
+
+    def drain(timeout: float):
+        try:
+            while True:
+                _, shard, snapshot, pool = events.get(timeout=timeout)
+                snapshots[shard] = snapshot
+                pools.update(pool)
+                reported.add(shard)
+                timeout = 0
+        except queue.Empty:
+            pass
+
+    logger.info(f"=== Supervisor starting {len(shards)} workers ({mode}) ===")
+    for i in range(len(shards)):
+        spawn(i)
+
+    try:
+        while procs or restart_at:
+            drain(1.0)
+
+            if long_running and reported and reported >= set(procs):
+                log_summary(mode, merge_stats(snapshots.values()), pools)
+                reported.clear()
+
+            for i, p in list(procs.items()):
+                if p.is_alive():
+                    continue
+                p.join()
+                del procs[i]
+                if p.exitcode == 0 and not long_running:
+                    continue
+                restarts[i] += 1
+                if restarts[i] > SUPERVISOR_MAX_RESTARTS:
+                    logger.error(f"[shard {i}] Exited with {p.exitcode}; restart limit reached, leaving it down")
+                    continue
+                logger.warning(f"[shard {i}] Exited with {p.exitcode}; restarting in {SUPERVISOR_RESTART_DELAY:.0f}s "
+                               f"({restarts[i]}/{SUPERVISOR_MAX_RESTARTS})")
+                restart_at[i] = now_ts() + SUPERVISOR_RESTART_DELAY
+
+            for i, ts in list(restart_at.items()):
+                if ts <= now_ts():
+                    del restart_at[i]
+                    spawn(i)
+
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user, stopping workers")
+        for p in procs.values():
+            p.join(timeout=30)
+            if p.is_alive():
+                p.terminate()
+    finally:
+        drain(0.5)
+        log_summary(mode, merge_stats(snapshots.values()), pools)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram channel crawler")
+    parser.add_argument("mode", nargs="?", default="crawl", choices=sorted(MODES),
+                        help="crawl: fetch new messages; refresh: re-sync counters and edits of recent messages; "
+                             "sweep: detect deleted messages and send tombstones; "
+                             "gaps: fetch ids skipped by earlier crawls; "
+                             "live: receive updates for joined channels and poll the rest")
+    parser.add_argument("--loop", type=float, default=0, metavar="SECONDS",
+                        help="repeat the mode every SECONDS, keeping client connections open between cycles")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="run account shards in N worker processes (0 = one per CPU core)")
+    parser.add_argument("--lease-store", metavar="PATH",
+                        help="SQLite file shared by all crawler processes, channels are then crawled under leases; "
+                             "across hosts its filesystem must support POSIX locks (e.g. NFSv4)")
+    parser.add_argument("--node-id", help="name of this node in the lease store (default: hostname)")
+    parser.add_argument("--archive-dir", metavar="PATH",
+                        help=f"local archive of every uploaded batch (default: {ARCHIVE_DIR or 'disabled'}; '' disables)")
+    parser.add_argument("--record", metavar="DIR",
+                        help="record raw Telegram responses as replay fixtures into DIR (see recording.py)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help=f"serve /metrics on {METRICS_HOST}:PORT in daemon mode, +1 per worker "
+                             f"(default: {METRICS_PORT}; 0 disables)")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help=f"write metrics to PATH after a one-shot run, -N per worker "
+                             f"(default: {METRICS_FILE or 'disabled'}; '' disables)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write Chrome trace-event spans of the crawl stages to FILE, -N per worker "
+                             "(open in ui.perfetto.dev or chrome://tracing)")
+    parser.add_argument("--trace-sample", type=float, metavar="RATE",
+                        help=f"share of channel crawls to trace (default: {TRACE_SAMPLE})")
+    args = parser.parse_args()
+
+    # Set through the environment so spawned worker processes see them too
+    if args.lease_store:
+        os.environ["CRAWLER_LEASE_STORE"] = LEASE_STORE_PATH = args.lease_store
+    if args.node_id:
+        os.environ["CRAWLER_NODE_ID"] = NODE_ID = args.node_id
+    if args.archive_dir is not None:
+        os.environ["CRAWLER_ARCHIVE_DIR"] = ARCHIVE_DIR = args.archive_dir
+        archive = MessageArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+    if args.record:
+        os.environ["CRAWLER_RECORD_DIR"] = RECORD_DIR = args.record
+    if args.metrics_port is not None:
+        METRICS_PORT = args.metrics_port
+        os.environ["CRAWLER_METRICS_PORT"] = str(METRICS_PORT)
+    if args.metrics_file is not None:
+        os.environ["CRAWLER_METRICS_FILE"] = METRICS_FILE = args.metrics_file
+    if args.trace:
+        os.environ["CRAWLER_TRACE_FILE"] = TRACE_FILE = args.trace
+    if args.trace_sample is not None:
+        TRACE_SAMPLE = args.trace_sample
+        os.environ["CRAWLER_TRACE_SAMPLE"] = str(TRACE_SAMPLE)
+    workers = min(args.workers or os.cpu_count() or 1, len(ACCOUNTS))
+
     try:
-        asyncio.run(main())
+        if workers > 1:
+            supervise(args.mode, args.loop, workers)
+        else:
+            asyncio.run(main(args.mode, args.loop))
     except KeyboardInterrupt:
         logger.info("Interrupted by user")
     except Exception as e:
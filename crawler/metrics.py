@@ -0,0 +1,180 @@
+"""Crawler metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms with labels, kept in one process-wide
+registry and rendered by render(). main.py serves them on
+http://METRICS_HOST:METRICS_PORT/metrics while it runs as a daemon (--loop
+or live) and writes them to METRICS_FILE at the end of a one-shot run, for
+node_exporter's textfile collector. Updates happen on the crawler's event
+loop; a gauge may instead compute its samples at scrape time from a
+callback, which is how queue depths are read.
+"""
+import asyncio
+import bisect
+import logging
+import math
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+# ---------------------------
+# Metric types
+# ---------------------------
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """(suffix, label string, value) lines of the metric"""
+        return [("", format_labels(self.labels, k), v) for k, v in sorted(self.values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{suffix}{labels} {format_value(v)}" for suffix, labels, v in self.samples()]
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, help, labels)
+        self.callback = callback  # Returns {label values: value}, replacing the stored samples
+
+    def set(self, value: float, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self.callback is not None:
+            try:
+                self.values = dict(self.callback())
+            except Exception as e:
+                logger.warning(f"Metric {self.name} callback failed: {e}")
+        return super().samples()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], list] = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        lines = []
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(("_bucket", format_labels(self.labels, key, f'le="{format_value(bound)}"'), cumulative))
+            lines.append(("_bucket", format_labels(self.labels, key, 'le="+Inf"'), series[-1]))
+            lines.append(("_sum", format_labels(self.labels, key), series[-2]))
+            lines.append(("_count", format_labels(self.labels, key), series[-1]))
+        return lines
+
+REGISTRY: List[Metric] = []
+
+def render() -> str:
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+# ---------------------------
+# Exposition
+# ---------------------------
+def write_file(path: str):
+    """Write all metrics to `path` atomically, for a textfile collector"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+async def handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split(" ")
+        path = parts[1].split("?", 1)[0] if len(parts) > 1 else ""
+        if path == "/metrics":
+            status, body = "200 OK", render().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\n"
+                     f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        logger.debug(f"Metrics scrape dropped: {e}")
+    finally:
+        writer.close()
+
+async def serve(host: str, port: int) -> Optional[asyncio.AbstractServer]:
+    """Serve /metrics on host:port; None when the port cannot be bound"""
+    try:
+        server = await asyncio.start_server(handle_scrape, host, port)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint {host}:{port} not available: {e}")
+        return None
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return server
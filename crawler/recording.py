@@ -0,0 +1,309 @@
+"""Record real Telegram responses to compact fixtures and serve them back offline.
+
+RecordingClient wraps a TelegramClient during a normal crawl (main.py
+--record DIR). Every entity returned by get_entity and every message from
+iter_messages / get_messages is written as its raw TL serialization, next
+to the users and chats it references and the time the client waited for it.
+ReplayClient reads such a directory and answers the same calls. It uses the
+original timing, scaled by `speed`, or no delay at all with speed=0. Then
+the transform and upload path can be profiled against production-shaped
+data, e.g. python -m bench.crawl --fixtures DIR.
+
+Layout: <root>/<peer id>.tl.gz holds one chat's frames, as concatenated gzip
+members, one per recorded call. <root>/index-<pid>.json maps the usernames
+and peers passed to get_entity to peer ids.
+"""
+import asyncio
+import fcntl
+import gzip
+import json
+import os
+import struct
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from telethon import utils
+from telethon.extensions import markdown
+from telethon.extensions.binaryreader import BinaryReader
+from telethon.tl import types
+
+FRAME = struct.Struct("<BfqI")  # kind, seconds waited, reference, length of the TL bytes
+KIND_ENTITY = 1  # A user/chat/channel; reference 1 when it was a get_entity result
+KIND_MESSAGE = 2
+KIND_COMMENT = 3  # A discussion comment; reference is the channel post id
+PAGE_SIZE = 100  # Messages per GetHistory / GetMessages request
+TESTED_TELETHON = "1.45"  # Replay hooks into Message._finish_init, which is not public API
+
+def entity_key(entity) -> str:
+    """Index key of a get_entity argument: '@username' or the marked peer id"""
+    if isinstance(entity, str):
+        return "@" + entity.strip().lstrip("@").lower()
+    return str(utils.get_peer_id(entity))
+
+def referenced_entities(msg) -> List[Any]:
+    """Users and chats Telethon attached to a received message"""
+    found = [getattr(msg, "_sender", None), getattr(msg, "_chat", None), getattr(msg, "_via_bot", None),
+             getattr(msg, "_linked_chat", None), getattr(msg, "_reply_to_chat", None)]
+    forward = getattr(msg, "_forward", None)
+    if forward is not None:
+        found += [getattr(forward, "_sender", None), getattr(forward, "_chat", None)]
+    return [e for e in found if isinstance(e, (types.User, types.Chat, types.Channel))]
+
+# ---------------------------
+# Recording
+# ---------------------------
+class FixtureWriter:
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, f"index-{os.getpid()}.json")
+        self.index: Dict[str, int] = {}
+        self.written: Dict[int, set] = {}  # Peer id -> entity ids already in its file
+        os.makedirs(root, exist_ok=True)
+
+    def write(self, peer_id: int, frames: List[tuple]):
+        """Append (kind, seconds, reference, tlobject) frames to a chat's file as one gzip member.
+
+        Worker processes of the supervisor record into the same directory, so
+        the member is compressed first and appended in one write under a lock.
+        """
+        if not frames:
+            return
+        data = bytearray()
+        for kind, seconds, ref, obj in frames:
+            raw = bytes(obj)
+            data += FRAME.pack(kind, seconds, ref, len(raw)) + raw
+        member = gzip.compress(bytes(data))
+        with open(os.path.join(self.root, f"{peer_id}.tl.gz"), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(member)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def entity_frames(self, peer_id: int, entities, resolved: bool = False, seconds: float = 0.0) -> List[tuple]:
+        """Frames for entities not yet written to this chat's file (a get_entity result always is)"""
+        seen = self.written.setdefault(peer_id, set())
+        frames = []
+        for e in entities:
+            eid = utils.get_peer_id(e)
+            if resolved or eid not in seen:
+                seen.add(eid)
+                frames.append((KIND_ENTITY, seconds if resolved else 0.0, 1 if resolved else 0, e))
+        return frames
+
+    def remember(self, key: str, peer_id: int):
+        if self.index.get(key) != peer_id:
+            self.index[key] = peer_id
+            with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.index, f)
+            os.replace(self.index_path + ".tmp", self.index_path)
+
+class RecordingClient:
+    """Proxy around a TelegramClient that records what the crawler receives.
+
+    Attribute writes go to the wrapped client, so ClientPool's pace_client
+    still paces the real requests.
+    """
+
+    def __init__(self, client, root: str):
+        object.__setattr__(self, "_client", client)
+        object.__setattr__(self, "_writer", FixtureWriter(root))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._client, name, value)
+
+    async def __call__(self, *args, **kwargs):
+        return await self._client(*args, **kwargs)
+
+    async def get_entity(self, entity):
+        started = time.monotonic()
+        result = await self._client.get_entity(entity)
+        if isinstance(result, (types.User, types.Chat, types.Channel)):
+            peer_id = utils.get_peer_id(result)
+            self._writer.write(peer_id, self._writer.entity_frames(peer_id, [result], True, time.monotonic() - started))
+            self._writer.remember(entity_key(entity), peer_id)
+        return result
+
+    async def iter_messages(self, entity, *args, **kwargs):
+        peer_id = utils.get_peer_id(entity)
+        reply_to = kwargs.get("reply_to")
+        frames = []
+        last = time.monotonic()
+        try:
+            async for msg in self._client.iter_messages(entity, *args, **kwargs):
+                now = time.monotonic()
+                frames += self._writer.entity_frames(peer_id, referenced_entities(msg))
+                frames.append((KIND_COMMENT, now - last, reply_to, msg) if reply_to else
+                              (KIND_MESSAGE, now - last, 0, msg))
+                last = now
+                yield msg
+        finally:
+            self._writer.write(peer_id, frames)
+
+    async def get_messages(self, entity, *args, **kwargs):
+        started = time.monotonic()
+        result = await self._client.get_messages(entity, *args, **kwargs)
+        msgs = [m for m in (result if isinstance(result, list) else [result]) if m is not None]
+        if msgs:
+            peer_id = utils.get_peer_id(entity)
+            seconds = (time.monotonic() - started) / len(msgs)
+            frames = []
+            for msg in msgs:
+                frames += self._writer.entity_frames(peer_id, referenced_entities(msg))
+                frames.append((KIND_MESSAGE, seconds, 0, msg))
+            self._writer.write(peer_id, frames)
+        return result
+
+# ---------------------------
+# Replay
+# ---------------------------
+class RecordedChat:
+    def __init__(self):
+        self.entity = None
+        self.resolve_seconds = 0.0
+        self.entities: Dict[int, Any] = {}
+        self.messages: Dict[int, tuple] = {}  # id -> (message, seconds)
+        self.comments: Dict[int, Dict[int, tuple]] = {}  # post id -> comment id -> (message, seconds)
+
+def read_fixture(path: str) -> RecordedChat:
+    chat = RecordedChat()
+    with gzip.open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + FRAME.size <= len(data):
+        kind, seconds, ref, length = FRAME.unpack_from(data, pos)
+        pos += FRAME.size
+        with BinaryReader(data[pos:pos + length]) as reader:
+            obj = reader.tgread_object()
+        pos += length
+        if kind == KIND_ENTITY:
+            chat.entities[utils.get_peer_id(obj)] = obj
+            if ref:
+                chat.entity, chat.resolve_seconds = obj, seconds
+        elif kind == KIND_MESSAGE:
+            chat.messages[obj.id] = (obj, seconds)  # Later recordings (edits) win
+        elif kind == KIND_COMMENT:
+            chat.comments.setdefault(ref, {})[obj.id] = (obj, seconds)
+    return chat
+
+class ReplayClient:
+    """Serves recorded fixtures through the TelegramClient calls the crawler uses.
+
+    Delays are the recorded ones divided by `speed`; speed=0 replays without
+    waiting. Requests go through `_call`, so pacing and RPC counts work as
+    with a real client. Calls for chats that were never recorded raise like
+    an unknown username.
+    """
+
+    def __init__(self, root: str, speed: float = 1.0):
+        self.root = root
+        self.speed = speed
+        self.index: Dict[str, int] = {}
+        for name in sorted(os.listdir(root)):
+            if name.startswith("index-") and name.endswith(".json"):
+                with open(os.path.join(root, name), encoding="utf-8") as f:
+                    self.index.update(json.load(f))
+        self.chats: Dict[int, RecordedChat] = {}
+        self.rpcs: Counter = Counter()
+        self.debt = 0.0
+        self.connected = False
+        self.parse_mode = markdown
+        self._self_id = None
+        self._mb_entity_cache: Dict[int, Any] = {}  # Always misses; Telethon then builds input peers from the entities
+        if not callable(getattr(types.Message, "_finish_init", None)):
+            import telethon
+            raise RuntimeError(f"Fixture replay needs Message._finish_init, which Telethon {telethon.__version__} "
+                               f"no longer has; install telethon~={TESTED_TELETHON}.0 to replay fixtures")
+
+    def usernames(self) -> List[str]:
+        return sorted(key[1:] for key in self.index if key.startswith("@"))
+
+    def chat(self, peer_id: int) -> RecordedChat:
+        if peer_id not in self.chats:
+            path = os.path.join(self.root, f"{peer_id}.tl.gz")
+            chat = read_fixture(path) if os.path.exists(path) else RecordedChat()
+            for msg, _ in list(chat.messages.values()) + [c for cs in chat.comments.values() for c in cs.values()]:
+                msg._finish_init(self, chat.entities, None)
+            self.chats[peer_id] = chat
+        return self.chats[peer_id]
+
+    async def _wait(self, seconds: float):
+        # Short waits add up and are slept together; one sleep per message would mostly measure the event loop
+        if self.speed <= 0 or seconds <= 0:
+            return
+        self.debt += seconds / self.speed
+        if self.debt >= 0.005:
+            started = time.monotonic()
+            await asyncio.sleep(self.debt)
+            self.debt -= time.monotonic() - started
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        self.rpcs[request] += 1
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        return await self._call(None, request, ordered=ordered)
+
+    async def get_entity(self, entity):
+        await self("ResolveUsername" if isinstance(entity, str) else "GetChannels")
+        peer_id = self.index.get(entity_key(entity))
+        chat = self.chat(peer_id) if peer_id is not None else None
+        if chat is None or chat.entity is None:
+            raise ValueError(f'No user has "{entity}" as username')
+        await self._wait(chat.resolve_seconds)
+        return chat.entity
+
+    async def iter_messages(self, entity, limit: Optional[int] = None, min_id: int = 0, max_id: int = 0,
+                            reply_to: Optional[int] = None, **kwargs):
+        chat = self.chat(utils.get_peer_id(entity))
+        source = chat.comments.get(reply_to, {}) if reply_to is not None else chat.messages
+        ids = sorted((i for i in source if i > min_id and (not max_id or i < max_id)), reverse=True)
+        if limit is not None:
+            ids = ids[:limit]
+        await self("GetReplies" if reply_to is not None else "GetHistory")
+        for n, msg_id in enumerate(ids):
+            if n and n % PAGE_SIZE == 0:
+                await self("GetReplies" if reply_to is not None else "GetHistory")
+            msg, seconds = source[msg_id]
+            await self._wait(seconds)
+            yield msg
+
+    async def get_messages(self, entity, ids=None, limit: Optional[int] = None, **kwargs):
+        chat = self.chat(utils.get_peer_id(entity))
+        if ids is None:
+            await self("GetHistory")
+            newest = sorted(chat.messages, reverse=True)[:limit or 1]
+            return [chat.messages[i][0] for i in newest]
+        single = isinstance(ids, int)
+        ids = [ids] if single else list(ids)
+        for _ in range(0, len(ids), PAGE_SIZE):
+            await self("GetMessages")
+        found = [chat.messages.get(i) for i in ids]
+        await self._wait(sum(f[1] for f in found if f))
+        result = [f[0] if f else None for f in found]
+        return result[0] if single else result
+
+    async def download_profile_photo(self, peer, file=None, download_big=False):
+        return b""
+
+    async def start(self):
+        self.connected = True
+
+    async def connect(self):
+        self.connected = True
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def get_me(self):
+        return types.User(id=1, is_self=True)
+
+    async def disconnect(self):
+        self.connected = False
@@ -0,0 +1,209 @@
+"""Replay the local archive into the import API, to rebuild the backend without re-crawling.
+
+Partitions of the archive (see MessageArchive) are read in order, coalesced
+into requests of up to --batch payloads per channel and posted by up to
+--workers concurrent uploads, on one event loop through the same circuit
+breaker and idempotency keys as send_to_api. --rate caps payloads per second so the backend is not flooded.
+Finished partitions are checkpointed; running the command again resumes
+after them, and batches that were in flight are recognised by their keys.
+
+    python replay.py [--archive-dir DIR] [--url URL] [--workers 4] [--batch 500] [--rate 0] [--restart]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from archive import ARCHIVE_DIR, MessageArchive
+from main import LARAVEL_API, api_post, idempotency_key, load_json, now_ts, save_json, upload_breaker
+
+logger = logging.getLogger(__name__)
+
+REPLAY_CHECKPOINT_FILE = "replay_checkpoint.json"
+REPLAY_WORKERS = 4
+REPLAY_BATCH_SIZE = 500  # Payloads per request; the archive holds segments of BATCH_SIZE or less
+REPLAY_CHECKPOINT_INTERVAL = 10.0  # Seconds between checkpoint saves and progress lines
+
+CHECKPOINT_TEMPLATE = {"done": [], "sent": 0, "created": 0, "updated": 0, "skipped": 0, "duplicate": 0, "rejected": 0}
+COUNTS = ("created", "updated", "skipped", "duplicate", "rejected")
+
+class RateLimiter:
+    """Token bucket shared by the uploads; `rate` units per second, 0 for no limit"""
+
+    def __init__(self, rate: float, burst: float = 0):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    async def acquire(self, n: float = 1):
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # A request larger than the burst is let through once the bucket is full
+            if self.tokens >= min(n, self.burst):
+                self.tokens -= n
+                return
+            await asyncio.sleep((min(n, self.burst) - self.tokens) / self.rate)
+
+def coalesce(archive: MessageArchive, done: set, size: int) -> Iterator[Tuple[List[Dict[str, Any]], List[str], List[str]]]:
+    """(payloads, partitions in them, partitions fully read) per request.
+
+    Consecutive partitions of one channel share requests; a batch never mixes
+    channels, so its idempotency key names the channel like the crawler's. A
+    partition is reported as read together with the batch holding its last
+    payloads, or on its own (with no payloads) when nothing of it is pending.
+    """
+    batch: List[Dict[str, Any]] = []
+    parts: List[str] = []
+    read: List[str] = []
+    channel = None
+    for channel_id, day, folder in archive.partitions():
+        part = f"{channel_id}/{day}"
+        if part in done:
+            continue
+        if batch and channel_id != channel:
+            yield batch, parts, read
+            batch, parts, read = [], [], []
+        channel = channel_id
+
+        for p in archive.read_partition(folder):
+            batch.append(p)
+            if not parts or parts[-1] != part:
+                parts.append(part)
+            if len(batch) >= size:
+                yield batch, parts, read
+                batch, parts, read = [], [], []
+        if batch:
+            read.append(part)
+        else:
+            yield [], [], [part]
+    if batch:
+        yield batch, parts, read
+
+class Replay:
+    """Uploads coalesced archive batches and tracks which partitions are fully acknowledged.
+
+    Everything but reading the archive runs on one event loop, so the
+    checkpoint state and main's circuit breaker need no locks.
+    """
+
+    def __init__(self, url: str, checkpoint_path: str, limiter: RateLimiter):
+        self.url = url
+        self.checkpoint_path = checkpoint_path
+        self.limiter = limiter
+        self.state = {**CHECKPOINT_TEMPLATE, **load_json(checkpoint_path, {})}
+        self.done = set(self.state["done"])
+        self.outstanding: Dict[str, int] = {}  # Partition -> batches in flight, +1 while still being read
+
+    async def upload(self, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Post one batch, waiting out open circuits, until the API answers"""
+        await self.limiter.acquire(len(payloads))
+        key = idempotency_key(payloads)
+        while True:
+            status, jr = await api_post(self.url, payloads, "replay", key)
+            if status == "ok":
+                jr = jr or {}
+                if jr.get("failed"):
+                    # The API did not record the key either; the whole batch is sent again on the next run
+                    raise RuntimeError(f"{jr['failed']} of {len(payloads)} items failed to import")
+                # Applied before the checkpoint was saved; the stored counts are not new rows
+                return {"duplicate": len(payloads)} if jr.get("duplicate") else jr
+            if status == "rejected":
+                logger.error(f"Replay batch {key} rejected by the API, skipped")
+                return {"rejected": len(payloads)}
+            await asyncio.sleep(max(1.0, upload_breaker.open_until - now_ts()))
+
+    def release(self, parts: List[str], result: Dict[str, Any] = None, sent: int = 0):
+        if result is not None:
+            self.state["sent"] += sent
+            for k in COUNTS:
+                self.state[k] += int(result.get(k, 0) or 0)
+        for part in parts:
+            self.outstanding[part] -= 1
+            if not self.outstanding[part]:
+                del self.outstanding[part]
+                self.done.add(part)
+
+    def save(self):
+        self.state["done"] = sorted(self.done)
+        save_json(self.checkpoint_path, self.state)
+
+    async def run(self, archive: MessageArchive, workers: int, batch_size: int) -> Dict[str, Any]:
+        started = last_report = time.monotonic()
+        sent_before = self.state["sent"]
+        in_flight = asyncio.Semaphore(workers)
+        tasks: set = set()
+
+        async def work(payloads: List[Dict[str, Any]], parts: List[str]):
+            try:
+                self.release(parts, await self.upload(payloads), len(payloads))
+            except Exception as e:
+                # Partitions of a failed batch stay out of the checkpoint and are replayed next time
+                logger.error(f"Replay batch of {len(payloads)} payloads failed: {e}")
+            finally:
+                in_flight.release()
+
+        # Partitions are read and decompressed in a worker thread, from a copy of the done set
+        batches = coalesce(archive, set(self.done), batch_size)
+        try:
+            while True:
+                item = await asyncio.to_thread(next, batches, None)
+                if item is None:
+                    break
+                payloads, parts, read = item
+                for part in parts + read:
+                    # A partition being read holds one extra count until it is fully read
+                    self.outstanding.setdefault(part, 1)
+                for part in parts:
+                    self.outstanding[part] += 1
+                if payloads:
+                    await in_flight.acquire()
+                    task = asyncio.create_task(work(payloads, parts))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                self.release(read)
+
+                if time.monotonic() - last_report >= REPLAY_CHECKPOINT_INTERVAL:
+                    last_report = time.monotonic()
+                    self.save()
+                    rate = (self.state["sent"] - sent_before) / (last_report - started)
+                    logger.info(f"Replay: {self.state['sent']} payloads sent ({rate:.0f}/s), "
+                                f"{len(self.done)} partitions done")
+        finally:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.save()
+        elapsed = time.monotonic() - started
+        sent = self.state["sent"] - sent_before
+        return {"status": "ok", "partitions": len(self.done), "sent": sent,
+                "payloads_per_s": round(sent / elapsed) if elapsed else 0,
+                **{k: self.state[k] for k in COUNTS}}
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the local archive into the import API")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR or "archive")
+    parser.add_argument("--url", default=LARAVEL_API, help="import endpoint (default LARAVEL_API)")
+    parser.add_argument("--workers", type=int, default=REPLAY_WORKERS, help="parallel uploaders")
+    parser.add_argument("--batch", type=int, default=REPLAY_BATCH_SIZE, help="payloads per request")
+    parser.add_argument("--rate", type=float, default=0, help="max payloads per second (0: unlimited)")
+    parser.add_argument("--checkpoint", default=REPLAY_CHECKPOINT_FILE)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and replay everything")
+    args = parser.parse_args()
+
+    if args.restart:
+        save_json(args.checkpoint, CHECKPOINT_TEMPLATE)
+    replay = Replay(args.url, args.checkpoint, RateLimiter(args.rate, burst=max(args.rate, args.batch)))
+    try:
+        report = asyncio.run(replay.run(MessageArchive(args.archive_dir), args.workers, args.batch))
+        logger.info(f"Replay finished: {report}")
+    except KeyboardInterrupt:
+        replay.save()
+        logger.info("Interrupted by user, checkpoint saved")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# main.py logs to ./crawler.log and keeps its state files in the working
+# directory; import it from a scratch directory, not the checkout
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="crawler-tests-"))
@@ -0,0 +1,53 @@
+"""Local archive segments, compaction and reads under the partition lock"""
+import fcntl
+import os
+import threading
+
+from archive import MessageArchive
+
+def payload(msg_id: int, text: str) -> dict:
+    return {"channel": {"telegram_id": 1}, "message": {"telegram_id": msg_id, "posted_at": "2026-01-02 10:00:00",
+                                                      "content_text": text}}
+
+def test_compaction_keeps_the_newest_copy(tmp_path):
+    archive = MessageArchive(str(tmp_path))
+    archive.write([payload(1, "a"), payload(2, "b")])
+    archive.write([payload(2, "b2"), payload(3, "c")])
+    folder = next(archive.partitions())[2]
+
+    assert archive.compact(folder, force=True) == 2
+    assert len(archive.files(folder)) == 1
+    assert [p["message"]["content_text"] for p in archive.read_partition(folder)] == ["a", "b2", "c"]
+
+def test_reads_wait_for_a_running_compaction(tmp_path):
+    archive = MessageArchive(str(tmp_path))
+    archive.write([payload(1, "a")])
+    archive.write([payload(2, "b")])
+    folder = next(archive.partitions())[2]
+    result = []
+
+    # Stand in for a compaction in another process: hold the lock exclusively
+    lock_fd = os.open(os.path.join(folder, ".lock"), os.O_CREAT | os.O_RDWR)
+    fcntl.flock(lock_fd, fcntl.LOCK_EX)
+    reader = threading.Thread(target=lambda: result.append(archive.read_partition(folder)))
+    reader.start()
+    reader.join(0.2)
+    assert reader.is_alive()
+    os.close(lock_fd)
+    reader.join(5)
+
+    assert [p["message"]["telegram_id"] for p in result[0]] == [1, 2]
+
+def test_compaction_skips_a_partition_being_read(tmp_path):
+    archive = MessageArchive(str(tmp_path))
+    for i in range(3):
+        archive.write([payload(i, "x")])
+    folder = next(archive.partitions())[2]
+
+    lock_fd = os.open(os.path.join(folder, ".lock"), os.O_CREAT | os.O_RDWR)
+    fcntl.flock(lock_fd, fcntl.LOCK_SH)
+    try:
+        assert archive.compact(folder, force=True) == 0
+    finally:
+        os.close(lock_fd)
+    assert archive.compact(folder, force=True) == 3
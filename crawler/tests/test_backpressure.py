@@ -0,0 +1,82 @@
+"""Circuit breaker, retry budget and upload buffer in front of the import API"""
+import asyncio
+import json
+
+import pytest
+
+import main
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main, "now_ts", lambda: now[0])
+    return now
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = main.CircuitBreaker()
+    for _ in range(main.BREAKER_FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert not breaker.allow()
+    assert breaker.open_until == clock[0] + main.BREAKER_COOLDOWN
+    assert breaker.metrics["trips"] == 1 and breaker.metrics["rejected"] == 1
+
+def test_half_open_probe_closes_or_reopens_with_a_longer_cooldown(clock):
+    breaker = main.CircuitBreaker()
+    breaker.trip()
+    clock[0] += main.BREAKER_COOLDOWN
+
+    assert breaker.allow()  # The probe
+    assert not breaker.allow()  # Everyone else waits for it
+    breaker.record_failure()
+    assert breaker.open_until == clock[0] + 2 * main.BREAKER_COOLDOWN
+
+    clock[0] += 2 * main.BREAKER_COOLDOWN
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+    assert breaker.cooldown == main.BREAKER_COOLDOWN and breaker.failures == 0
+
+def test_retry_after_opens_at_once_and_is_capped(clock):
+    breaker = main.CircuitBreaker()
+    breaker.record_failure(retry_after=10 ** 6)
+
+    assert breaker.open_until == clock[0] + main.BREAKER_MAX_RETRY_AFTER
+    assert breaker.cooldown == main.BREAKER_COOLDOWN  # A server-chosen wait does not grow the backoff
+
+def test_retry_budget_is_spent_and_earned_back():
+    breaker = main.CircuitBreaker()
+    assert sum(breaker.spend_retry() for _ in range(20)) == main.RETRY_BUDGET_MAX
+    assert breaker.metrics["retries_denied"] == 20 - main.RETRY_BUDGET_MAX
+
+    for _ in range(round(1 / main.RETRY_BUDGET_EARN)):
+        breaker.record_success()
+    assert breaker.spend_retry()
+    assert not breaker.spend_retry()
+
+def test_buffer_drains_in_order_and_keeps_the_rest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "upload_breaker", main.CircuitBreaker())
+    statuses = ["ok", "rejected", "unavailable"]
+    sent = []
+
+    async def api_post(url, body, username, key=None, account=""):
+        sent.append(body["n"])
+        return (statuses.pop(0) if statuses else "ok"), {}
+
+    monkeypatch.setattr(main, "api_post", api_post)
+    for n in range(5):
+        main.buffer_upload("acc", "http://api/import", {"n": n}, key=f"k{n}")
+    path = main.UPLOAD_BUFFER_TEMPLATE.format("acc")
+
+    # Stops at the first unavailable answer; the rejected upload is dropped
+    assert asyncio.run(main.drain_upload_buffer("acc")) == 2
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line)["body"]["n"] for line in f] == [2, 3, 4]
+
+    assert asyncio.run(main.drain_upload_buffer("acc")) == 3
+    assert sent == [0, 1, 2, 2, 3, 4]
+    assert not (tmp_path / path).exists()
@@ -0,0 +1,65 @@
+"""MessageBatch against the per-message payload builder it replaced"""
+from telethon.tl import types
+
+import main
+from bench.fakes import SyntheticChannel
+
+def legacy_payload(msg, entity, is_adults: bool) -> dict:
+    """build_payload as it was before MessageBatch, without the media stage"""
+    text = main.get_message_text(msg)
+    sender = getattr(msg, "sender", None)
+    return {
+        "message": {
+            "telegram_id": msg.id,
+            "message_type": main.detect_message_type(msg),
+            "content_text": text[:10000],
+            "media_file_path": f"https://t.me/{entity.username}/{msg.id}" if getattr(entity, "username", None) else None,
+            "views": int(getattr(msg, "views", 0) or 0),
+            "forwards": int(getattr(msg, "forwards", 0) or 0),
+            "replies_count": main.get_replies_count(msg),
+            "posted_at": str(msg.date) if msg.date else None,
+        },
+        "channel": {
+            "telegram_id": entity.id,
+            "title": entity.title,
+            "username": entity.username,
+            "type": entity.__class__.__name__,
+            "is_private": False,
+            "is_adults": is_adults,
+            "description": getattr(entity, "about", None),
+            "members_count": getattr(entity, "participants_count", None),
+            "photo_url": None,
+        },
+        "sender": {
+            "telegram_id": int(getattr(msg, "sender_id", 0) or 0),
+            "username": getattr(sender, "username", None) if sender else None,
+            "display_name": getattr(sender, "first_name", None) if sender else None,
+            "is_bot": bool(getattr(sender, "bot", False)) if sender else False,
+            "photo_url": None,
+        },
+        "entities": main.extract_entities(msg, text),
+    }
+
+def group_messages(channel: SyntheticChannel) -> list:
+    """Synthetic posts re-sent as group messages from a few users"""
+    users = [types.User(id=70 + n, username=f"user{n}", first_name=f"User {n}", bot=n == 2) for n in range(3)]
+    msgs = []
+    for msg in filter(None, map(channel.message, range(1, 301))):
+        user = users[msg.id % len(users)]
+        sent = types.Message(id=msg.id, peer_id=msg.peer_id, date=msg.date, message=msg.message,
+                             entities=msg.entities, media=msg.media, views=msg.views, forwards=msg.forwards,
+                             replies=msg.replies, from_id=types.PeerUser(user.id))
+        sent._text, sent._chat, sent._sender = msg._text, msg._chat, user
+        msgs.append(sent)
+    return msgs
+
+def test_payloads_match_the_per_message_builder():
+    channel = SyntheticChannel(400, "batch_channel", 300)
+    for msgs in (list(filter(None, map(channel.message, range(1, 301)))), group_messages(channel)):
+        batch = main.MessageBatch()
+        for msg in msgs:
+            batch.add(msg)
+
+        assert batch.payloads(channel.entity, True) == [legacy_payload(m, channel.entity, True) for m in msgs]
+        assert [batch.counters_row(i) for i in range(len(batch))] == \
+            [main.counters_entry(m, main.get_message_text(m)[:10000]) for m in msgs]
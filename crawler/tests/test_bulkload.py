@@ -0,0 +1,68 @@
+"""COPY staging and set-based upserts of the bulk loader.
+
+Needs a scratch Postgres database with the backend migrations applied; its
+tables are truncated. Skipped unless CRAWLER_TEST_DATABASE_URL is set:
+
+    CRAWLER_TEST_DATABASE_URL=postgresql://root@127.0.0.1:5432/backend_test python -m pytest tests/test_bulkload.py
+"""
+import os
+
+import pytest
+
+TEST_DSN = os.environ.get("CRAWLER_TEST_DATABASE_URL")
+if not TEST_DSN:
+    pytest.skip("CRAWLER_TEST_DATABASE_URL is not set", allow_module_level=True)
+
+import psycopg
+
+from bench.ingest import synthetic_payloads, truncate
+from bulkload import BulkLoader
+
+def table_counts() -> dict:
+    with psycopg.connect(TEST_DSN) as conn:
+        return {table: conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                for table in ("channels", "senders", "messages", "message_entities", "import_batches")}
+
+@pytest.fixture
+def loader():
+    truncate(TEST_DSN)
+    loader = BulkLoader(TEST_DSN)
+    yield loader
+    loader.close()
+
+def test_load_then_resend_with_the_same_key(loader):
+    payloads = synthetic_payloads(300, channels=5)
+
+    first = loader.load(payloads, key="batch-1")
+
+    assert first == {"created": 300, "updated": 0, "skipped": 0, "staged": 300}
+    counts = table_counts()
+    assert counts["channels"] == len({p["channel"]["telegram_id"] for p in payloads})
+    assert counts["senders"] == len({p["sender"]["telegram_id"] for p in payloads})
+    assert counts["messages"] == 300
+    assert counts["message_entities"] == sum(len(p["entities"]) for p in payloads)
+    assert counts["import_batches"] == 1
+
+    # The same key answers with the stored counts and writes nothing
+    again = loader.load(payloads, key="batch-1")
+
+    assert again == {"created": 300, "updated": 0, "skipped": 0, "duplicate": True}
+    assert table_counts() == counts
+    assert loader.acknowledged(["batch-1", "batch-2"]) == ["batch-1"]
+
+def test_unchanged_rows_are_skipped_and_changed_rows_updated(loader):
+    payloads = synthetic_payloads(100, channels=3)
+    loader.load(payloads)
+
+    assert loader.load(payloads) == {"created": 0, "updated": 0, "skipped": 100, "staged": 100}
+
+    payloads[0]["message"]["views"] += 1
+    payloads[1]["entities"] = [{"entity_type": "hashtag", "entity_value": "#changed"}]
+    result = loader.load(payloads[:2])
+
+    assert result["updated"] == 1 and result["skipped"] == 1
+    with psycopg.connect(TEST_DSN) as conn:
+        entities = conn.execute(
+            "SELECT e.entity_value FROM message_entities e JOIN messages m ON m.id = e.message_id "
+            "WHERE m.telegram_id = %s", (payloads[1]["message"]["telegram_id"],)).fetchall()
+    assert entities == [("#changed",)]
@@ -0,0 +1,52 @@
+"""Quarantine of pooled clients"""
+import asyncio
+import logging
+
+import main
+from bench.fakes import FakeTelegramClient
+
+class TrackedClient(FakeTelegramClient):
+    def __init__(self, fail_disconnect: bool = False):
+        super().__init__([])
+        self.fail_disconnect = fail_disconnect
+        self.disconnects = 0
+
+    async def disconnect(self):
+        self.disconnects += 1
+        await super().disconnect()
+        if self.fail_disconnect:
+            raise ConnectionError("socket already closed")
+
+def test_client_in_use_is_disconnected_on_release(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = TrackedClient()
+
+    async def run():
+        pool = main.ClientPool(lambda account: client)
+        assert (await pool.acquire({"session": "acc"}))[0] is client
+        pool.quarantine("acc", "auth_key_unregistered")
+        await asyncio.sleep(0.01)
+        assert client.disconnects == 0  # Other channel workers still hold it
+
+        pool.release("acc")
+        await asyncio.sleep(0.01)
+        assert client.disconnects == 1
+        assert (await pool.acquire({"session": "acc"}))[1] == {"skipped": True, "reason": "quarantined"}
+
+    asyncio.run(run())
+
+def test_disconnect_errors_are_logged(tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    client = TrackedClient(fail_disconnect=True)
+
+    async def run():
+        pool = main.ClientPool(lambda account: client)
+        await pool.acquire({"session": "acc"})
+        pool.release("acc")
+        pool.quarantine("acc", "auth_key_unregistered")
+        await pool.close()
+
+    with caplog.at_level(logging.WARNING, logger="main"):
+        asyncio.run(run())
+    assert client.disconnects == 1
+    assert "socket already closed" in caplog.text
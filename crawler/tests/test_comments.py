@@ -0,0 +1,45 @@
+"""Discussion-group comment crawling"""
+import asyncio
+from types import SimpleNamespace
+
+from telethon.errors import ChannelPrivateError
+
+import main
+from bench.fakes import FakeTelegramClient, SyntheticChannel
+
+class ThreadClient(FakeTelegramClient):
+    """Group 901 is private; every thread in group 902 holds one comment"""
+
+    async def get_entity(self, entity):
+        if getattr(entity, "channel_id", None) == 901:
+            raise ChannelPrivateError(request=None)
+        return await super().get_entity(entity)
+
+    async def iter_messages(self, entity, limit=None, reply_to=None, **kwargs):
+        if reply_to is None:
+            async for msg in super().iter_messages(entity, limit=limit, **kwargs):
+                yield msg
+            return
+        yield SimpleNamespace(id=reply_to * 10, reply_to=None)
+
+def test_bad_threads_are_skipped_without_uploading(monkeypatch):
+    monkeypatch.setattr(main, "MIN_DELAY_BETWEEN_MESSAGES", 0)
+    monkeypatch.setattr(main, "MAX_DELAY_BETWEEN_MESSAGES", 0)
+    sent = []
+
+    async def send_to_api(payloads, *args, **kwargs):
+        sent.append(payloads)
+        return len(payloads), 0
+
+    def build_payload(msg, *args):
+        raise ValueError("no date")
+
+    monkeypatch.setattr(main, "send_to_api", send_to_api)
+    monkeypatch.setattr(main, "build_payload", build_payload)
+    channel, group = SyntheticChannel(900, "with_comments", 5), SyntheticChannel(902, "group", 1)
+    client = ThreadClient([channel, group])
+
+    report = asyncio.run(main.crawl_comments(client, "acc", channel.entity, [(1, 901), (2, 902), (3, 901)], False))
+
+    assert report == {"comments": 0, "replies": 0, "skipped": 2}
+    assert sent == []
@@ -0,0 +1,32 @@
+"""Resolution of discovered channel candidates"""
+import asyncio
+
+from telethon.errors import RpcCallFailError
+
+import main
+from bench.fakes import FakeTelegramClient, SyntheticChannel
+
+class FlakyClient(FakeTelegramClient):
+    """Resolves usernames, but fails with an RPC error on `broken`"""
+
+    async def get_entity(self, username):
+        if username == "broken":
+            raise RpcCallFailError(request=None)
+        return await super().get_entity(username)
+
+def test_rpc_error_on_one_candidate_does_not_stop_the_others(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "MIN_DELAY_BETWEEN_RESOLVES", 0)
+    monkeypatch.setattr(main, "MAX_DELAY_BETWEEN_RESOLVES", 0)
+    found = SyntheticChannel(900, "found_channel", 10)
+    main.save_json(main.DISCOVERY_FRONTIER_FILE, {
+        name: {"refs": refs, "adult_refs": 0, "first_seen": 0}
+        for name, refs in (("broken", 9), ("found_channel", 5), ("missing_channel", 3))
+    })
+
+    report = asyncio.run(main.resolve_discovered_channels(FlakyClient([found]), "acc", main.now_ts() + 60))
+
+    assert report == {"resolved": 1, "added": 1}
+    assert [ch["username"] for ch in main.load_json(main.CHANNELS_TEMPLATE.format("acc"), [])] == ["found_channel"]
+    # The failed candidate is kept for a later attempt, the rejected one is not
+    assert list(main.load_json(main.DISCOVERY_FRONTIER_FILE, {})) == ["broken"]
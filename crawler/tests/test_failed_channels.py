@@ -0,0 +1,39 @@
+"""Failure classes and retry backoff of failed channels"""
+import pytest
+
+import main
+
+@pytest.mark.parametrize("reason, cls", [
+    ("flood_3600s", "flood"),
+    ("channel_private", "private"),
+    ("admin_required", "private"),
+    ("not_found", "not_found"),
+    ("username_error: The username is not in use", "not_found"),
+    ("entity_not_found", "not_found"),
+    ('value_error: No user has "gone" as username', "not_found"),
+    ("value_error: something else", "transient"),
+    ("rpc: RPC_CALL_FAIL", "transient"),
+    ("retry_failed: api_error", "transient"),
+    ("", "transient"),
+])
+def test_failure_class(reason, cls):
+    assert main.failure_class(reason) == cls
+
+@pytest.mark.parametrize("cls", sorted(main.RETRY_BACKOFF))
+def test_retry_delay_doubles_up_to_the_cap_with_jitter(cls):
+    base, cap = main.RETRY_BACKOFF[cls]
+    for failures in range(0, 12):
+        expected = min(cap, base * 2 ** max(0, failures - 1))
+        delays = [main.retry_delay(cls, failures) for _ in range(50)]
+        assert all(0.8 * expected <= d <= 1.2 * expected for d in delays)
+
+def test_permanent_failures_are_retired(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for _ in range(main.RETRY_RETIRE_AFTER):
+        main.record_failed_channels([{"username": "gone", "reason": "not_found"},
+                                     {"username": "flaky", "reason": "rpc: RPC_CALL_FAIL"}])
+
+    failed = {f["username"]: f for f in main.load_json(main.FAILED_FILE, [])}
+    assert failed["gone"]["retired"] and failed["gone"]["failures"] == main.RETRY_RETIRE_AFTER
+    assert not failed["flaky"].get("retired")
+    assert failed["flaky"]["next_retry"] > main.now_ts()
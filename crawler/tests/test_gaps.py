@@ -0,0 +1,24 @@
+"""Gap detection over the known/absent ledger"""
+import main
+
+def test_missing_ids_are_newest_first_within_bounds():
+    covered = [[3, 5], [8, 8]]
+    assert main.ranges_missing(covered, 1, 10, 100) == [10, 9, 7, 6, 2, 1]
+    assert main.ranges_missing(covered, 4, 9, 100) == [9, 7, 6]
+    assert main.ranges_missing(covered, 1, 10, 3) == [10, 9, 7]
+    assert main.ranges_missing([], 1, 3, 100) == [3, 2, 1]
+    assert main.ranges_missing([[1, 10]], 1, 10, 100) == []
+
+def test_gaps_start_at_the_oldest_uploaded_id():
+    entry = {"known": [[10, 20], [25, 30]], "absent": [[21, 22]]}
+    assert main.find_gaps(entry, 30, 100) == [24, 23]
+    assert main.find_gaps(entry, 33, 100) == [33, 32, 31, 24, 23]
+    assert main.find_gaps({"known": [], "absent": []}, 50, 100) == []
+    assert main.find_gaps(None, 50, 100) == []
+
+def test_contiguous_id_stops_below_the_first_gap():
+    entry = {"known": [[1, 10], [14, 20]], "absent": [[11, 12]]}
+    assert main.contiguous_id(entry, 5) == 12
+    assert main.contiguous_id(entry, 12) == 12  # 13 is missing
+    assert main.contiguous_id(entry, 13) == 20
+    assert main.contiguous_id(entry, 25) == 25
@@ -0,0 +1,61 @@
+"""Idempotency keys and recovery of cursors from acknowledged batches"""
+import asyncio
+
+import pytest
+
+import main
+from bench.fakes import FakeImportServer, SyntheticChannel, point_crawler_at
+
+def channel_payloads(channel: SyntheticChannel, ids) -> list:
+    batch = main.MessageBatch()
+    for msg in filter(None, map(channel.message, ids)):
+        batch.add(msg)
+    batch.sort()
+    return batch.payloads(channel.entity, False)
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "upload_breaker", main.CircuitBreaker())
+    monkeypatch.setattr(main, "archive", None)
+    for name in ("LARAVEL_API", "LARAVEL_ACKS_API", "LARAVEL_COUNTERS_API", "LARAVEL_TOMBSTONES_API", "LARAVEL_REPLIES_API"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    server = FakeImportServer()
+    point_crawler_at(server.start())
+    yield server
+    server.stop()
+
+def test_key_depends_on_the_content_only():
+    channel = SyntheticChannel(300, "keys", 50)
+    payloads = channel_payloads(channel, range(1, 51))
+    key = main.idempotency_key(payloads)
+
+    assert key == main.idempotency_key(channel_payloads(channel, range(1, 51)))
+    assert key.startswith(f"300:{payloads[0]['message']['telegram_id']}-{payloads[-1]['message']['telegram_id']}:")
+    payloads[3]["message"]["views"] += 1
+    assert main.idempotency_key(payloads) != key
+
+def test_only_acknowledged_batches_advance_the_cursor(server):
+    channel = SyntheticChannel(301, "pending", 80)
+    applied, lost = channel_payloads(channel, range(1, 41)), channel_payloads(channel, range(41, 81))
+    assert asyncio.run(main.send_to_api(applied, "acc", "pending", main.idempotency_key(applied)))[0]
+    main.save_pending_for("acc", {
+        "pending": {"key": main.idempotency_key(applied), "last_id": 40},
+        "other": {"key": main.idempotency_key(lost), "last_id": 80},
+    })
+    last_ids = {"pending": 0, "other": 10}
+
+    asyncio.run(main.recover_pending_uploads("acc", last_ids))
+
+    assert last_ids == {"pending": 40, "other": 10}
+    assert main.load_last_ids_for("acc") == last_ids
+    assert main.load_pending_for("acc") == {}
+
+def test_partial_failure_is_an_upload_error(server, monkeypatch):
+    async def post_to_api(url, body, username, buffer=None, key=None):
+        return {"status": "ok", "created": len(body) - 1, "updated": 0, "skipped": 0, "failed": 1}
+
+    monkeypatch.setattr(main, "post_to_api", post_to_api)
+    payloads = channel_payloads(SyntheticChannel(302, "partial", 10), range(1, 11))
+
+    assert asyncio.run(main.send_to_api(payloads, "acc", "partial")) == (None, None)
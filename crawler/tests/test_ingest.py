@@ -0,0 +1,33 @@
+"""Routing and auth of the standalone ingest service, with the database loader faked"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+from ingest import IngestService
+
+class RecordedKeys:
+    """BulkLoader stand-in that knows a fixed set of recorded idempotency keys"""
+
+    def __init__(self, recorded):
+        self.recorded = recorded
+        self.conn = SimpleNamespace(closed=False)
+
+    def acknowledged(self, keys):
+        return [k for k in keys if k in self.recorded]
+
+def dispatch(path: str, body, token: str = "secret"):
+    async def run():
+        service = IngestService(token="secret")
+        service.loaders.put_nowait(RecordedKeys({"applied"}))
+        return await service.dispatch("POST", path, {"authorization": f"Bearer {token}"}, json.dumps(body).encode())
+
+    return asyncio.run(run())
+
+def test_acks_answer_from_recorded_batches():
+    assert dispatch("/api/messages/import/acks", {"keys": ["applied", "lost", 5]}) == \
+        (200, {"status": "ok", "acknowledged": ["applied"]})
+
+def test_acks_need_keys_and_the_token():
+    assert dispatch("/api/messages/import/acks", {"keys": []})[0] == 400
+    assert dispatch("/api/messages/import/acks", {"keys": ["applied"]}, token="wrong")[0] == 401
+    assert dispatch("/api/messages/counters", {"messages": []})[0] == 404
@@ -0,0 +1,85 @@
+"""Fencing of cursor commits by channel leases"""
+import asyncio
+import sqlite3
+
+import pytest
+
+import main
+from bench.fakes import FakeTelegramClient, SyntheticChannel
+
+def test_stale_holder_cannot_commit_after_takeover(tmp_path, monkeypatch):
+    store = main.SqliteLeaseStore(str(tmp_path / "leases.db"))
+    old = store.acquire("chan", "a", ttl=60)
+    assert store.commit_cursor("chan", 10, old)
+
+    # Node a stalls past its TTL; node b takes over but has not committed yet
+    monkeypatch.setattr(main, "now_ts", lambda: main.time.time() + 120)
+    new = store.acquire("chan", "b", ttl=60)
+    assert new == old + 1
+    assert not store.commit_cursor("chan", 50, old)
+    assert store.load_cursor("chan") == 10
+
+    assert store.commit_cursor("chan", 20, new)
+    assert store.load_cursor("chan") == 20
+
+def test_released_lease_cannot_commit(tmp_path):
+    store = main.SqliteLeaseStore(str(tmp_path / "leases.db"))
+    token = store.acquire("chan", "a", ttl=60)
+    store.release("chan", "a", token)
+    assert not store.commit_cursor("chan", 5, token)
+
+def test_failed_renewal_marks_the_lease_lost(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LEASE_TTL", 0.03)
+
+    class LockedStore(main.SqliteLeaseStore):
+        def renew(self, channel, node, token, ttl):
+            raise sqlite3.OperationalError("database is locked")
+
+    async def run():
+        store = LockedStore(str(tmp_path / "leases.db"))
+        lease = main.ChannelLease(store, "chan", "a", store.acquire("chan", "a", ttl=60))
+        await asyncio.sleep(0.1)
+        assert lease.lost
+        assert not await lease.commit(5)
+        await lease.release()
+
+    asyncio.run(run())
+
+@pytest.fixture
+def lease_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "LEASE_STORE_PATH", str(tmp_path / "leases.db"))
+    monkeypatch.setattr(main, "_lease_store", None)
+    monkeypatch.setattr(main, "MIN_DELAY_BETWEEN_CHANNELS", 0)
+    monkeypatch.setattr(main, "MAX_DELAY_BETWEEN_CHANNELS", 0)
+    return main.SqliteLeaseStore(main.LEASE_STORE_PATH)
+
+def test_maintenance_pass_skips_channels_leased_elsewhere(lease_store, monkeypatch):
+    channels = [SyntheticChannel(800, "taken", 5), SyntheticChannel(801, "free", 5)]
+    monkeypatch.setattr(main, "client_pool", main.ClientPool(lambda account: FakeTelegramClient(channels)))
+    main.save_json(main.CHANNELS_TEMPLATE.format("acc"), [{"username": "taken"}, {"username": "free"}])
+    lease_store.acquire("taken", "other-node", ttl=60)
+    processed = []
+
+    async def process(client, ch):
+        held = lease_store.db.execute("SELECT expires_at > ? FROM leases WHERE channel = ?",
+                                      (main.now_ts(), ch["username"])).fetchone()
+        processed.append((ch["username"], bool(held and held[0])))
+        return {"status": "ok"}
+
+    asyncio.run(main.run_account_pass({"session": "acc"}, "refresh", lambda ch: True, process, lambda: None))
+
+    assert processed == [("free", True)]
+    assert lease_store.acquire("free", "other-node", ttl=60) is not None  # Released afterwards
+
+def test_leases_are_acquired_concurrently_off_the_event_loop(lease_store):
+    async def run():
+        results = await asyncio.gather(*(main.acquire_channel_lease(f"chan{i}") for i in range(20)))
+        for _, lease in results:
+            await lease.release()
+        return results
+
+    results = asyncio.run(run())
+
+    assert all(may_crawl for may_crawl, _ in results)
+    assert sorted(lease.channel for _, lease in results) == sorted(f"chan{i}" for i in range(20))
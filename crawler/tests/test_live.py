@@ -0,0 +1,111 @@
+"""Live mode driven through run_account_live's source_factory with a fake update source"""
+import asyncio
+import time
+
+import pytest
+
+import main
+from bench.fakes import FakeImportServer, FakeTelegramClient, FakeUpdateSource, SyntheticChannel, point_crawler_at
+
+SESSION = "live"
+
+@pytest.fixture
+def live(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ("MIN_DELAY_BETWEEN_CHANNELS", "MAX_DELAY_BETWEEN_CHANNELS",
+                 "MIN_DELAY_BETWEEN_MESSAGES", "MAX_DELAY_BETWEEN_MESSAGES", "API_REQUEST_DELAY"):
+        monkeypatch.setattr(main, name, 0)
+    monkeypatch.setattr(main, "LIVE_FLUSH_INTERVAL", 0.05)
+    monkeypatch.setattr(main, "LIVE_WATCHDOG_INTERVAL", 0.05)
+    monkeypatch.setattr(main, "LIVE_CATCHUP_INTERVAL", 3600)  # Only the startup and reconnect catch-ups
+    # point_crawler_at() rebinds the endpoints; registering them restores them afterwards
+    for name in ("LARAVEL_API", "LARAVEL_ACKS_API", "LARAVEL_COUNTERS_API", "LARAVEL_TOMBSTONES_API", "LARAVEL_REPLIES_API"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    server = FakeImportServer(keep_content=True)
+    point_crawler_at(server.start())
+
+    channel = SyntheticChannel(700, "live_channel", 30)
+    client = FakeTelegramClient([channel])
+    monkeypatch.setattr(main, "client_pool", main.ClientPool(lambda account: client))
+    main.save_json(main.CHANNELS_TEMPLATE.format(SESSION), [{"username": channel.username}])
+    yield server, client, channel
+    server.stop()
+
+def existing(channel: SyntheticChannel, ids) -> set:
+    return {(channel.channel_id, i) for i in ids if channel.message(i) is not None}
+
+async def until(condition, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+def run_live(scenario):
+    """Run run_account_live with a FakeUpdateSource while `scenario(source)` runs, then cancel it"""
+    async def run():
+        sources = []
+
+        def factory(client, chats):
+            sources.append(FakeUpdateSource(client, chats))
+            return sources[0]
+
+        task = asyncio.create_task(main.run_account_live({"session": SESSION}, source_factory=factory))
+        try:
+            await until(lambda: sources and sources[0].queue is not None)
+            await scenario(sources[0])
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+def cursor(channel: SyntheticChannel) -> int:
+    return int(main.load_last_ids_for(SESSION).get(channel.username, 0))
+
+def test_new_messages_are_uploaded_and_advance_the_cursor(live):
+    server, client, channel = live
+
+    async def scenario(source):
+        await until(lambda: cursor(channel) == 30)  # Startup catch-up
+        assert server.messages == existing(channel, range(1, 31))
+
+        ids = source.post(channel, 5)
+        await until(lambda: existing(channel, ids) <= server.messages)
+        await until(lambda: cursor(channel) == max(i for _, i in existing(channel, ids)))
+
+    run_live(scenario)
+
+def test_edits_replace_the_uploaded_message(live):
+    server, client, channel = live
+    msg_id = max(i for _, i in existing(channel, range(1, 31)))
+
+    async def scenario(source):
+        await until(lambda: cursor(channel) == 30)
+        created = len(server.messages)
+        source.edit(channel, msg_id, "edited in place")
+        await until(lambda: server.content.get((channel.channel_id, msg_id)) == "edited in place")
+        assert len(server.messages) == created
+        assert cursor(channel) == 30
+
+    run_live(scenario)
+
+def test_reconnect_catches_up_messages_missed_while_disconnected(live):
+    server, client, channel = live
+
+    async def scenario(source):
+        await until(lambda: cursor(channel) == 30)
+        client.connected = False
+        await asyncio.sleep(0.2)  # The watchdog notices
+        missed = source.post(channel, 6, deliver=False)
+        # An event after the outage arrives before the catch-up has run
+        after = source.post(channel, 1)
+        await until(lambda: existing(channel, after) <= server.messages)
+        await asyncio.sleep(0.2)
+        assert not existing(channel, missed) & server.messages
+        assert cursor(channel) == 30, "the cursor must not pass the missed ids"
+
+        client.connected = True
+        await until(lambda: existing(channel, missed) <= server.messages)
+        await until(lambda: cursor(channel) == after[0])
+
+    run_live(scenario)
@@ -0,0 +1,47 @@
+"""Prometheus text rendering"""
+import pytest
+
+import metrics
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+
+def test_histogram_buckets_are_cumulative_with_an_inf_bucket():
+    h = metrics.Histogram("upload_seconds", "Upload time", ("stage",), buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.1, 0.3, 100):
+        h.observe(value, stage="send")
+
+    assert metrics.render() == (
+        "# HELP upload_seconds Upload time\n"
+        "# TYPE upload_seconds histogram\n"
+        'upload_seconds_bucket{stage="send",le="0.1"} 2\n'
+        'upload_seconds_bucket{stage="send",le="0.5"} 3\n'
+        'upload_seconds_bucket{stage="send",le="1"} 3\n'
+        'upload_seconds_bucket{stage="send",le="+Inf"} 4\n'
+        'upload_seconds_sum{stage="send"} 100.45\n'
+        'upload_seconds_count{stage="send"} 4\n'
+    )
+
+def test_label_values_are_escaped():
+    c = metrics.Counter("errors_total", "Errors", ("channel",))
+    c.inc(channel='a"b\\c\nd')
+
+    assert 'errors_total{channel="a\\"b\\\\c\\nd"} 1' in metrics.render().splitlines()
+
+def test_counters_and_gauges_without_labels():
+    c = metrics.Counter("runs_total", "Runs")
+    metrics.Gauge("queue_depth", "Depth", callback=lambda: {(): 7})
+    c.inc()
+    c.inc(2.5)
+
+    lines = metrics.render().splitlines()
+    assert "runs_total 3.5" in lines
+    assert "queue_depth 7" in lines
+
+def test_failing_gauge_callback_keeps_the_last_samples():
+    values = [{(): 3}]
+    metrics.Gauge("buffered", "Buffered uploads", callback=lambda: values.pop())
+
+    assert "buffered 3" in metrics.render().splitlines()
+    assert "buffered 3" in metrics.render().splitlines()
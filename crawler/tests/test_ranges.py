@@ -0,0 +1,30 @@
+"""Message id range helpers behind the known/absent ledger"""
+import main
+
+def test_add_merges_overlapping_and_adjacent_ids():
+    assert main.ranges_add([], [5, 3, 4, 9]) == [[3, 5], [9, 9]]
+    assert main.ranges_add([[1, 3], [7, 8]], [4, 6]) == [[1, 4], [6, 8]]
+    assert main.ranges_add([[1, 10]], [2, 10]) == [[1, 10]]
+    assert main.ranges_add([[5, 6], [1, 2]], ()) == [[1, 2], [5, 6]]
+
+def test_remove_splits_ranges_and_ignores_unknown_ids():
+    assert main.ranges_remove([[1, 10]], [1, 5, 10]) == [[2, 4], [6, 9]]
+    assert main.ranges_remove([[1, 1], [3, 4]], [1, 2, 7]) == [[3, 4]]
+
+def test_contains():
+    ranges = [[1, 3], [7, 9]]
+    assert [i for i in range(11) if main.ranges_contains(ranges, i)] == [1, 2, 3, 7, 8, 9]
+    assert not main.ranges_contains([], 1)
+
+def test_ids_below_are_newest_first_and_limited():
+    ranges = [[1, 3], [7, 9]]
+    assert main.ranges_ids_below(ranges, 9, 10) == [8, 7, 3, 2, 1]
+    assert main.ranges_ids_below(ranges, 100, 4) == [9, 8, 7, 3]
+    assert main.ranges_ids_below(ranges, 1, 10) == []
+
+def test_ledger_seeds_channels_crawled_before_it_existed():
+    ledger = {}
+    assert main.ledger_for_channel(ledger, "old", 40) == {"known": [[1, 40]], "absent": []}
+    assert main.ledger_for_channel(ledger, "new", 0) == {"known": [], "absent": []}
+    ledger["old"]["absent"] = [[5, 5]]
+    assert main.ledger_for_channel(ledger, "old", 90)["absent"] == [[5, 5]]
@@ -0,0 +1,54 @@
+"""Recording fixtures and replaying them offline"""
+import asyncio
+import multiprocessing
+
+import pytest
+from telethon.tl import types
+
+import main
+from bench.fakes import FakeTelegramClient, SyntheticChannel
+from recording import KIND_MESSAGE, FixtureWriter, RecordingClient, ReplayClient, read_fixture
+
+async def record_and_replay(root: str):
+    recorder = RecordingClient(FakeTelegramClient([SyntheticChannel(1000, "recorded_channel", 120)]), str(root))
+    entity = await recorder.get_entity("recorded_channel")
+    recorded = [msg async for msg in recorder.iter_messages(entity, limit=120)]
+    replay = ReplayClient(str(root))
+    entity = await replay.get_entity("recorded_channel")
+    return recorded, [msg async for msg in replay.iter_messages(entity, limit=120)]
+
+def test_replayed_messages_match_the_recording(tmp_path):
+    recorded, replayed = asyncio.run(record_and_replay(tmp_path))
+
+    assert [(m.id, m.text, m.date, m.views) for m in replayed] == [(m.id, m.text, m.date, m.views) for m in recorded]
+    batch = main.MessageBatch()
+    for msg in replayed:
+        batch.add(msg)
+    assert len(batch) == len(recorded)
+
+def test_replay_fails_clearly_without_the_telethon_hook(tmp_path, monkeypatch):
+    monkeypatch.setattr(types.Message, "_finish_init", None)
+
+    with pytest.raises(RuntimeError, match="telethon~="):
+        ReplayClient(str(tmp_path))
+
+def record_share(root: str, worker: int, workers: int):
+    channel = SyntheticChannel(1000, "shared", 2000)
+    writer = FixtureWriter(root)
+    for _ in range(10):  # Large members, written again and again, so unlocked appends would interleave
+        for start in range(1 + worker * 250, 2001, workers * 250):
+            msgs = [m for m in map(channel.message, range(start, start + 250)) if m is not None]
+            writer.write(1000, [(KIND_MESSAGE, 0.0, 0, m) for m in msgs])
+
+def test_worker_processes_append_to_one_file_without_corrupting_it(tmp_path):
+    processes = [multiprocessing.get_context("fork").Process(target=record_share, args=(str(tmp_path), w, 4))
+                 for w in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join(60)
+        assert p.exitcode == 0
+
+    channel = SyntheticChannel(1000, "shared", 2000)
+    expected = {i for i in range(1, 2001) if channel.message(i) is not None}
+    assert set(read_fixture(str(tmp_path / "1000.tl.gz")).messages) == expected
@@ -0,0 +1,54 @@
+"""Counter and edit deltas of the engagement refresh"""
+from datetime import timedelta
+
+from telethon.tl.types import MessageEntityHashtag
+
+import main
+from bench.fakes import SyntheticChannel
+
+def snapshot_of(msg) -> list:
+    return main.counters_entry(msg, main.get_message_text(msg))
+
+def message(msg_id: int = 3):
+    channel = SyntheticChannel(600, "refresh_channel", 10)
+    return next(m for m in map(channel.message, range(msg_id, 11)) if m is not None)
+
+def test_unchanged_message_has_no_delta():
+    msg = message()
+    old = snapshot_of(msg)
+
+    assert main.counters_delta(msg, old) == (None, old)
+
+def test_counter_changes_are_reported_alone():
+    msg = message()
+    old = snapshot_of(msg)
+    msg.views += 40
+    msg.replies.replies += 2
+
+    delta, row = main.counters_delta(msg, old)
+
+    assert delta == {"telegram_id": msg.id, "views": old[0] + 40, "replies_count": old[2] + 2}
+    assert row[:3] == [old[0] + 40, old[1], old[2] + 2]
+
+def test_edit_without_text_change_only_moves_the_edit_time():
+    msg = message()
+    old = snapshot_of(msg)
+    msg.edit_date = msg.date + timedelta(hours=1)
+
+    delta, row = main.counters_delta(msg, old)
+
+    assert delta is None
+    assert row[3] == int(msg.edit_date.timestamp()) and row[4] == old[4]
+
+def test_edited_text_is_sent_with_its_entities():
+    msg = message()
+    old = snapshot_of(msg)
+    msg.edit_date = msg.date + timedelta(hours=1)
+    msg.message = msg._text = "corrected #news"
+    msg.entities = [MessageEntityHashtag(offset=10, length=5)]
+
+    delta, row = main.counters_delta(msg, old)
+
+    assert delta["content_text"] == "corrected #news"
+    assert delta["entities"] == [{"entity_type": "hashtag", "entity_value": "#news"}]
+    assert row[4] == main.text_hash("corrected #news")
@@ -0,0 +1,77 @@
+"""Replay of the local archive into the import API"""
+import asyncio
+
+import main
+import replay
+from archive import MessageArchive
+from bench.fakes import FakeImportServer, SyntheticChannel
+
+def archived_channels(root: str, count: int, size: int) -> set:
+    """Write `count` synthetic channels to an archive; returns their (channel, message) ids"""
+    archive = MessageArchive(root)
+    idents = set()
+    for c in range(count):
+        channel = SyntheticChannel(500 + c, f"replay_{c}", size)
+        batch = main.MessageBatch()
+        for msg_id in range(1, size + 1):
+            msg = channel.message(msg_id)
+            if msg is not None:
+                batch.add(msg)
+                idents.add((channel.channel_id, msg_id))
+        batch.sort()
+        archive.write(batch.payloads(channel.entity, False))
+    return idents
+
+class PartialFailureServer(FakeImportServer):
+    """Fails one item of the first batch that contains message 7 of each channel"""
+
+    def __init__(self):
+        super().__init__()
+        self.failing = True
+
+    def import_batch(self, payloads, key):
+        if self.failing and any(p["message"]["telegram_id"] == 7 for p in payloads):
+            self.failing = False
+            return {"status": "ok", "created": len(payloads) - 1, "updated": 0, "skipped": 0, "failed": 1}
+        return super().import_batch(payloads, key)
+
+def test_partial_failure_leaves_the_partition_for_the_next_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "upload_breaker", main.CircuitBreaker())
+    monkeypatch.setattr(replay, "upload_breaker", main.upload_breaker)
+    idents = archived_channels(str(tmp_path / "archive"), 1, 50)
+    server = PartialFailureServer()
+    url = f"{server.start()}/messages/import"
+    checkpoint = str(tmp_path / "checkpoint.json")
+    try:
+        first = replay.Replay(url, checkpoint, replay.RateLimiter(0))
+        asyncio.run(first.run(MessageArchive(str(tmp_path / "archive")), workers=2, batch_size=10))
+        assert not first.done
+
+        again = replay.Replay(url, checkpoint, replay.RateLimiter(0))
+        report = asyncio.run(again.run(MessageArchive(str(tmp_path / "archive")), workers=2, batch_size=10))
+        assert report["sent"] == len(idents)
+        assert server.messages == idents
+        assert again.done
+    finally:
+        server.stop()
+
+def test_concurrent_replay_uploads_everything_once_and_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "upload_breaker", main.CircuitBreaker())
+    monkeypatch.setattr(replay, "upload_breaker", main.upload_breaker)
+    idents = archived_channels(str(tmp_path / "archive"), 4, 300)
+    server = FakeImportServer(error_rate=0.1)
+    url = f"{server.start()}/messages/import"
+    checkpoint = str(tmp_path / "checkpoint.json")
+    try:
+        first = replay.Replay(url, checkpoint, replay.RateLimiter(0))
+        report = asyncio.run(first.run(MessageArchive(str(tmp_path / "archive")), workers=4, batch_size=40))
+        assert server.messages == idents
+        assert report["created"] + report["duplicate"] >= len(idents)
+        assert not first.outstanding
+
+        # A second run resumes after the checkpoint and sends nothing
+        again = replay.Replay(url, checkpoint, replay.RateLimiter(0))
+        report = asyncio.run(again.run(MessageArchive(str(tmp_path / "archive")), workers=4, batch_size=40))
+        assert report["sent"] == 0
+    finally:
+        server.stop()
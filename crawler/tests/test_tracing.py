@@ -0,0 +1,65 @@
+"""Span sampling and the Chrome trace-event file"""
+import asyncio
+import json
+
+import pytest
+
+import tracing
+
+@pytest.fixture
+def trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "tracer", None)
+    path = tmp_path / "trace.json"
+    tracing.start(str(path))
+
+    def events() -> list:
+        tracing.flush()
+        text = path.read_text(encoding="utf-8").rstrip().rstrip(",")
+        return [e["name"] for e in json.loads(text + "]") if e["ph"] == "X"]
+
+    yield events
+    tracing.stop()
+
+def test_spans_are_no_ops_while_tracing_is_off(monkeypatch):
+    monkeypatch.setattr(tracing, "tracer", None)
+    assert tracing.span("channel", sample=1.0) is tracing.NULL_SPAN
+
+def test_dropped_parent_drops_its_children_and_tasks(trace):
+    async def child_task():
+        with tracing.span("in_task"):
+            pass
+
+    async def run():
+        with tracing.span("channel", sample=0.0):
+            with tracing.span("upload"):
+                with tracing.span("sampled_child", sample=1.0):
+                    pass
+            await asyncio.create_task(child_task())
+        with tracing.span("unsampled_sibling"):
+            pass
+
+    asyncio.run(run())
+    assert trace() == ["unsampled_sibling"]
+
+def test_kept_parent_keeps_its_children(trace):
+    async def run():
+        with tracing.span("channel", sample=1.0):
+            with tracing.span("upload"):
+                pass
+            await asyncio.create_task(asyncio.sleep(0))
+            with pytest.raises(ValueError):
+                with tracing.span("failing"):
+                    raise ValueError("boom")
+
+    asyncio.run(run())
+    assert trace() == ["upload", "failing", "channel"]
+
+def test_rate_is_applied_per_span(trace, monkeypatch):
+    draws = iter([0.1, 0.9])
+    monkeypatch.setattr(tracing.random, "random", lambda: next(draws))
+    for n in range(2):
+        with tracing.span(f"channel{n}", sample=0.5):
+            with tracing.span(f"child{n}"):
+                pass
+
+    assert trace() == ["child0", "channel0"]
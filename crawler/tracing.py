@@ -0,0 +1,140 @@
+"""Optional tracing spans exported in the Chrome trace-event format.
+
+Disabled unless start() is called (main.py --trace FILE or
+CRAWLER_TRACE_FILE). Until then span() returns one shared no-op context
+manager, so instrumented code pays a function call per span.
+
+When enabled, every finished span is appended to FILE as a complete ("X")
+event. The file is a JSON array without its closing bracket, which
+chrome://tracing and ui.perfetto.dev accept, so even a killed crawler
+leaves a loadable trace. Each asyncio task gets its own track, named after
+the task.
+
+Sampling is decided per span: a span opened with sample=R is kept with
+probability R. Spans opened without a rate follow their enclosing span, and
+are kept when there is none. A dropped span drops everything inside it,
+including tasks created within it, so kept traces stay complete. The
+crawler samples per channel with TRACE_SAMPLE.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from contextlib import nullcontext
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+NULL_SPAN = nullcontext()
+_sampled: contextvars.ContextVar = contextvars.ContextVar("trace_sampled", default=None)
+
+class Tracer:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+        self.file.write("[\n")
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.task_tracks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.thread_tracks: Dict[int, int] = {}
+        self.next_track = 1
+        self.events = 0
+
+    def track(self) -> int:
+        """Track id of the running asyncio task (or thread); the first use names the track"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        tracks, key = (self.task_tracks, task) if task is not None else (self.thread_tracks, threading.get_ident())
+        tid = tracks.get(key)
+        if tid is None:
+            with self.lock:
+                tid = tracks[key] = self.next_track
+                self.next_track += 1
+            name = task.get_name() if task is not None else threading.current_thread().name
+            self.write({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}})
+        return tid
+
+    def write(self, event: Dict[str, Any]):
+        line = json.dumps(event, ensure_ascii=False, default=str) + ",\n"
+        with self.lock:
+            self.file.write(line)
+            self.events += 1
+
+    def emit(self, name: str, cat: str, start_ns: int, end_ns: int, args: Dict[str, Any]):
+        event = {"name": name, "cat": cat, "ph": "X", "pid": self.pid, "tid": self.track(),
+                 "ts": (start_ns - self.origin) / 1000, "dur": (end_ns - start_ns) / 1000}
+        if args:
+            event["args"] = args
+        self.write(event)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class Span:
+    __slots__ = ("tracer", "name", "cat", "sample", "args", "keep", "token", "start")
+
+    def __init__(self, tracer: Tracer, name: str, cat: str, sample: Optional[float], args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.sample = sample
+        self.args = args
+
+    def __enter__(self):
+        parent = _sampled.get()
+        if parent is False:
+            self.keep = False
+        elif self.sample is not None:
+            self.keep = self.sample >= 1 or random.random() < self.sample
+        else:
+            self.keep = True
+        self.token = _sampled.set(self.keep)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        _sampled.reset(self.token)
+        if self.keep:
+            if exc_type is not None:
+                self.args["error"] = exc_type.__name__
+            self.tracer.emit(self.name, self.cat, self.start, end, self.args)
+        return False
+
+tracer: Optional[Tracer] = None
+
+def span(name: str, cat: str = "crawl", sample: Optional[float] = None, **args):
+    """Context manager timing a block as a trace event; a no-op while tracing is off"""
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, name, cat, sample, args)
+
+def start(path: str):
+    global tracer
+    if tracer is None:
+        tracer = Tracer(path)
+        logger.info(f"Tracing to {path}")
+
+def flush():
+    if tracer is not None:
+        tracer.flush()
+
+def stop():
+    global tracer
+    if tracer is not None:
+        tracer.close()
+        logger.info(f"Trace written to {tracer.path} ({tracer.events} events)")
+        tracer = None